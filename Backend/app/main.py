@@ -5,69 +5,462 @@ FastAPI-based API server with REST and WebSocket endpoints
 """
 
 import asyncio
+import fcntl
 import json
 import logging
 import os
+import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 數據存儲配置（固定到 Backend/data，與執行目錄無關）
+# 支援以 `python app/main.py` 直接啟動
+try:
+    from app.services.broadcast_hub import BroadcastHub
+    from app.services.change_feed import ChangeFeed
+    from app.services.group_commit import GroupCommitter
+    from app.services import metrics
+    from app.services.order_lifecycle import IN_FLIGHT_STATES, TERMINAL_STATES, OrderLifecycle, parse_timestamp
+    from app.services.order_log import OrderLog
+    from app.services.order_events import WAKE_TYPES, OrderWaiters
+    from app.services.dispatch_queue import DispatchQueue
+    from app.services.inventory import STOCK_CHECK_MODES
+    from app.services.order_store import OrderStore
+    from app.services.pubsub import UnixPubSub
+    from app.services.shared_state import STATE_BACKENDS, SqliteState
+    from app.services.fleet import router as fleet_router
+    from app.services.pick_optimizer import router as batch_router
+    from app.services.routing import router as route_router
+    from app.services.slotting import router as slotting_router
+    from app.services.send_to_Front import (
+        inventory,
+        load_cargo_data,
+        receive_peer_ack,
+        replay_acks,
+        router as ue_router,
+    )
+    from app.services.websocket_service import WebSocketService
+except ModuleNotFoundError:
+    # 當以腳本形式在 `app` 目錄內執行時，將父目錄加入 sys.path
+    import sys as _sys
+    from pathlib import Path as _Path
+
+    _parent = _Path(__file__).resolve().parents[1]
+    if str(_parent) not in _sys.path:
+        _sys.path.insert(0, str(_parent))
+    from app.services.broadcast_hub import BroadcastHub
+    from app.services.change_feed import ChangeFeed
+    from app.services.group_commit import GroupCommitter
+    from app.services import metrics
+    from app.services.order_lifecycle import IN_FLIGHT_STATES, TERMINAL_STATES, OrderLifecycle, parse_timestamp
+    from app.services.order_log import OrderLog
+    from app.services.order_events import WAKE_TYPES, OrderWaiters
+    from app.services.dispatch_queue import DispatchQueue
+    from app.services.inventory import STOCK_CHECK_MODES
+    from app.services.order_store import OrderStore
+    from app.services.pubsub import UnixPubSub
+    from app.services.shared_state import STATE_BACKENDS, SqliteState
+    from app.services.fleet import router as fleet_router
+    from app.services.pick_optimizer import router as batch_router
+    from app.services.routing import router as route_router
+    from app.services.slotting import router as slotting_router
+    from app.services.send_to_Front import (
+        inventory,
+        load_cargo_data,
+        receive_peer_ack,
+        replay_acks,
+        router as ue_router,
+    )
+    from app.services.websocket_service import WebSocketService
+
+# 數據存儲配置（預設固定到 Backend/data，與執行目錄無關）
 BASE_DIR = Path(__file__).resolve().parents[1]
-DATA_DIR = BASE_DIR / "data"
+DATA_DIR = Path(os.getenv("APP_DATA_DIR", BASE_DIR / "data"))
 DATA_FILE = DATA_DIR / "app_data.json"
 
 # 創建數據目錄
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
+# 訂單日誌：快照 app_data.json + 追加日誌 app_data.wal
+order_log = OrderLog(
+    DATA_FILE,
+    fsync_policy=os.getenv("ORDER_FSYNC_POLICY", "always"),
+    fsync_interval_ms=int(os.getenv("ORDER_FSYNC_INTERVAL_MS", "50")),
+    compact_every=int(os.getenv("ORDER_COMPACT_EVERY", "10000")),
+)
+
+
+# 狀態後端：local 為單一行程（快照 + 日誌）；sqlite 讓多個 worker 共用 state.db，
+# 並以 Unix socket 互相轉送廣播，每個 worker 的連線都收得到
+STATE_BACKEND = os.getenv("STATE_BACKEND", "local")
+if STATE_BACKEND not in STATE_BACKENDS:
+    raise ValueError(f"未知的狀態後端: {STATE_BACKEND}")
+
+
+def _seed_from_log():
+    """state.db 初次建立時匯入既有的快照與日誌"""
+    if not DATA_FILE.exists() and not order_log.log_path.exists():
+        return [], 1, 0
+    orders, counter = order_log.load()
+    return orders, counter, order_log.seq
+
+
+def _lock_data_dir():
+    """local 後端只允許一個行程使用資料目錄，避免多個 worker 各自追加同一份日誌"""
+    f = open(DATA_DIR / "app_data.lock", "a")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise RuntimeError(f"{DATA_DIR} 已由其他行程使用；多個 worker 請設定 STATE_BACKEND=sqlite")
+    return f
+
+
+# 派工租約的預設秒數，到期未確認的訂單重新派送
+DISPATCH_LEASE_SECONDS = float(os.getenv("DISPATCH_LEASE_SECONDS", "30"))
+
+# 新增訂單時的箱子檢查：off / ids（拒絕不存在的箱子編號）/ stock（另需在庫且未被其他訂單保留，並保留之）
+ORDER_STOCK_CHECK = os.getenv("ORDER_STOCK_CHECK", "ids")
+if ORDER_STOCK_CHECK not in STOCK_CHECK_MODES:
+    raise ValueError(f"未知的庫存檢查模式: {ORDER_STOCK_CHECK}")
+# 保留在各行程的記憶體中、於提交前檢查；sqlite 後端的提交在其他 worker（或同一 worker 的多個請求）
+# 間沒有互斥，檢查與保留無法在同一交易內完成，會重複配出同一個箱子，因此不允許此組合
+if ORDER_STOCK_CHECK == "stock" and STATE_BACKEND == "sqlite":
+    raise ValueError("ORDER_STOCK_CHECK=stock 只支援 STATE_BACKEND=local")
+
+shared_state: Optional[SqliteState] = None
+pubsub: Optional[UnixPubSub] = None
+if STATE_BACKEND == "sqlite":
+    shared_state = SqliteState(
+        DATA_DIR / "state.db",
+        fsync_policy=os.getenv("ORDER_FSYNC_POLICY", "always"),
+        feed_capacity=int(os.getenv("ORDER_FEED_CAPACITY", "10000")),
+        seed=_seed_from_log,
+        lease_seconds=DISPATCH_LEASE_SECONDS,
+    )
+    pubsub = UnixPubSub(DATA_DIR / "pubsub")
+# local 後端的資料目錄鎖於 startup 取得、shutdown 釋放，import 本模組（測試、工具）不受執行中的伺服器影響
+_data_dir_lock = None
+
 
 def load_data():
-    """從JSON文件加載數據"""
-    if not DATA_FILE.exists():
+    """從快照與日誌加載數據"""
+    if not DATA_FILE.exists() and not order_log.log_path.exists():
         logger.info(f"沒有找到現有數據文件，使用空數據啟動")
-        return [], 1
+        return OrderStore(), 1
 
     try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        orders = data.get("orders", [])
-        counter = data.get("order_counter", len(orders) + 1)
+        orders, counter = order_log.load()
         logger.info(f"成功加載 {len(orders)} 筆訂單")
-        return orders, counter
+        return OrderStore(orders, issued=counter - 1), counter
     except Exception as e:
         logger.error(f"加載數據時發生錯誤: {e}")
-        return [], 1
+        return OrderStore(), 1
+
+
+# 群組提交：同一時間窗內的變更合併成一次寫入（sqlite 後端為一次交易）
+committer = GroupCommitter(
+    shared_state.write_batch if shared_state is not None else order_log.append_many,
+    window_ms=int(os.getenv("ORDER_COMMIT_WINDOW_MS", "20")),
+    max_batch=int(os.getenv("ORDER_COMMIT_MAX_BATCH", "500")),
+)
+
 
+async def save_data(entry: Dict[str, Any]) -> int:
+    """將單筆變更排入群組提交，待其落盤後返回其序號；必要時在背景壓縮成快照
 
-def save_data():
-    """保存數據到JSON文件"""
+    預設 ORDER_FSYNC_POLICY=always，返回時該批次已 fsync（群組提交讓一批只 fsync 一次）；
+    batch / os 策略下返回時僅寫入作業系統，fsync 最多延後 ORDER_FSYNC_INTERVAL_MS 或交給作業系統。
+    """
+    # 序號在事件迴圈上配發，確保與記憶體中的 orders_db 及變更序列一致
+    entry = {"seq": order_log.next_seq(), **entry}
+    change_feed.append(entry)
+    track_lifecycle(entry)
+    track_reservations(entry)
+    dispatch.apply(entry)
+    if order_log.needs_compaction():
+        last_seq = order_log.begin_compaction()
+        # 訂單 dict 建立後不再修改，淺複製清單即可交給背景執行緒
+        snapshot = list(orders_db)
+        asyncio.get_running_loop().run_in_executor(
+            None, order_log.write_snapshot, snapshot, order_counter, last_seq
+        )
+    started = time.perf_counter()
     try:
-        data = {"orders": orders_db, "order_counter": order_counter}
-        temp_file = DATA_FILE.with_suffix(".tmp")
-        with open(temp_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        temp_file.replace(DATA_FILE)
-        logger.info(f"成功保存數據到 {DATA_FILE}")
-        return True
+        await committer.submit(entry)
     except Exception as e:
         logger.error(f"保存數據時發生錯誤: {e}")
-        return False
+    SAVE_DATA_SECONDS.observe(time.perf_counter() - started)
+    return entry["seq"]
+
+
+async def save_shared(entry: Dict[str, Any]) -> Optional[int]:
+    """sqlite 後端：在共用狀態中配發訂單 id 與序號並提交，本行程套用到該序號後返回
+
+    刪除不存在的訂單時回傳 None；提交失敗時拋出例外（id 尚未配發，無法只留在記憶體）。
+    """
+    started = time.perf_counter()
+    await committer.submit(entry)
+    SAVE_DATA_SECONDS.observe(time.perf_counter() - started)
+    seq = entry.get("seq")
+    if seq is not None:
+        await catch_up(seq)
+        pubsub.publish({"kind": "changed", "seq": seq})
+    return seq
+
+
+async def add_orders(orders: List[Dict[str, Any]], bulk: bool = False) -> int:
+    """新增訂單並配發連續 id（就地填入 order["id"]），回傳變更序號"""
+    global order_counter
+    entry = {"op": "create_many", "orders": orders} if bulk else {"op": "create", "order": orders[0]}
+    if shared_state is not None:
+        return await save_shared(entry)
+    # 配發 id 到寫入記憶體之間不 await，避免與其他新增交錯
+    for order in orders:
+        order["id"] = order_counter
+        order_counter += 1
+        orders_db.add(order)
+    return await save_data(entry)
+
+
+async def remove_order(order_id: Any) -> Optional[int]:
+    """刪除訂單，回傳變更序號；訂單不存在時回傳 None"""
+    if shared_state is not None:
+        return await save_shared({"op": "delete", "order_id": order_id})
+    if orders_db.remove(order_id) is None:
+        return None
+    return await save_data({"op": "delete", "order_id": order_id})
+
+
+async def clear_all_orders() -> int:
+    global order_counter
+    if shared_state is not None:
+        return await save_shared({"op": "clear"})
+    orders_db.clear()
+    order_counter = 1
+    return await save_data({"op": "clear"})
+
+
+def apply_change(entry: Dict[str, Any]):
+    """sqlite 後端：把共用狀態中的一筆變更（任一 worker 提交）套用到本行程的記憶體"""
+    op = entry.get("op")
+    if op == "create":
+        orders_db.add(entry["order"])
+    elif op == "create_many":
+        for order in entry["orders"]:
+            orders_db.add(order)
+    elif op == "delete":
+        orders_db.remove(entry["order_id"])
+    elif op == "clear":
+        orders_db.clear()
+    change_feed.append(entry)
+    track_lifecycle(entry)
+    track_reservations(entry)
+
+
+_catch_up_lock = asyncio.Lock()
+
+
+async def catch_up(until: Optional[int] = None):
+    """依序號套用共用狀態中尚未套用的變更；until 已套用時直接返回"""
+    if until is not None and change_feed.last_seq >= until:
+        return
+    async with _catch_up_lock:
+        loop = asyncio.get_running_loop()
+        while until is None or change_feed.last_seq < until:
+            changes = await loop.run_in_executor(None, shared_state.changes_since, change_feed.last_seq)
+            if changes is None:
+                # 落後太多、需要的變更已被清除：整份重新載入
+                await reload_shared_orders()
+                return
+            if not changes:
+                return
+            for entry in changes:
+                apply_change(entry)
+
+
+async def reload_shared_orders():
+    orders, last_seq, issued = await asyncio.get_running_loop().run_in_executor(None, shared_state.load_orders)
+    orders_db.clear()
+    for order in orders:
+        orders_db.add(order)
+    orders_db.issued = max(orders_db.issued, issued)
+    track_existing_orders()
+    replay_acks(lifecycle)
+    reserve_open_orders()
+    change_feed.reset(last_seq)
+    logger.warning(f"已從共用狀態重新載入 {len(orders)} 筆訂單 (seq={last_seq})")
+
+
+def track_lifecycle(entry: Dict[str, Any]):
+    """依訂單變更維護生命週期狀態（新訂單以伺服器時間為建立時間）"""
+    op = entry.get("op")
+    if op == "create":
+        lifecycle.track(entry["order"]["id"])
+    elif op == "create_many":
+        for order in entry["orders"]:
+            lifecycle.track(order["id"])
+    elif op == "delete":
+        lifecycle.forget(entry["order_id"])
+    elif op == "clear":
+        lifecycle.clear()
+
+
+def track_existing_orders():
+    """以訂單時間戳重建生命週期（啟動或重新載入時）"""
+    lifecycle.clear()
+    for order in orders_db:
+        lifecycle.track(order["id"], parse_timestamp(order.get("timestamp")))
+
+
+def track_reservations(entry: Dict[str, Any]):
+    """ORDER_STOCK_CHECK=stock 時依訂單變更保留 / 取消保留箱子"""
+    if ORDER_STOCK_CHECK != "stock":
+        return
+    op = entry.get("op")
+    if op == "create":
+        inventory.reserve(entry["order"]["id"], entry["order"].get("items") or [])
+    elif op == "create_many":
+        for order in entry["orders"]:
+            inventory.reserve(order["id"], order.get("items") or [])
+    elif op == "delete":
+        inventory.release(entry["order_id"])
+    elif op == "clear":
+        inventory.release_all()
+
+
+def reserve_open_orders():
+    """重建未結束訂單的保留（啟動或重新載入時，需在重播確認之後）"""
+    if ORDER_STOCK_CHECK != "stock":
+        return
+    inventory.release_all()
+    finished = set(lifecycle.ids_in(TERMINAL_STATES))
+    for order in orders_db:
+        if order["id"] not in finished:
+            inventory.reserve(order["id"], order.get("items") or [])
+
+
+def stock_problems(items: List[int]) -> Optional[Dict[str, Any]]:
+    """依 ORDER_STOCK_CHECK 檢查訂單的箱子，通過時回傳 None，否則回傳各類問題箱子"""
+    if ORDER_STOCK_CHECK == "off":
+        return None
+    result = inventory.validate(items)
+    if ORDER_STOCK_CHECK == "ids":
+        return {"invalid": result["invalid"]} if result["invalid"] else None
+    return None if result["ok"] else {k: v for k, v in result.items() if k != "ok" and v}
 
 
 # 狀態
-orders_db, order_counter = load_data()
-connected_clients: Set[WebSocket] = set()
+if shared_state is not None:
+    # id 由 state.db 配發，不使用 order_counter
+    _orders, _last_seq, _issued = shared_state.load_orders()
+    orders_db, order_counter = OrderStore(_orders, issued=_issued), 0
+else:
+    orders_db, order_counter = load_data()
+    _last_seq = order_log.seq
+# 訂單生命週期與延遲統計；超過 ORDER_STUCK_SECONDS 未更新的未完成訂單視為卡住
+lifecycle = OrderLifecycle(float(os.getenv("ORDER_STUCK_SECONDS", "300")))
+track_existing_orders()
+# 派工佇列：多個 UE 代理以租約領取訂單；sqlite 後端由 state.db 保存，所有 worker 共用
+if shared_state is not None:
+    dispatch = shared_state.dispatch
+else:
+    dispatch = DispatchQueue(orders_db.get, DISPATCH_LEASE_SECONDS)
+    for _order in orders_db:
+        dispatch.add(_order["id"], _order.get("priority") or 0)
+# 最近的變更，供斷線重連的客戶端補齊增量；多 worker 共用同一個 epoch
+change_feed = ChangeFeed(
+    int(os.getenv("ORDER_FEED_CAPACITY", "10000")),
+    last_seq=_last_seq,
+    epoch=shared_state.epoch if shared_state is not None else None,
+)
+# sqlite 後端定期檢查共用狀態的序號，補齊遺失的 pub/sub 通知
+STATE_POLL_SECONDS = int(os.getenv("STATE_POLL_MS", "500")) / 1000.0
+# 增量超過此訂單數時改送快照（快照只含最新 50 筆）
+SYNC_MAX_DELTA = 500
+# 每個連線一個有界送出佇列，慢速客戶端不會拖住廣播或請求
+hub = BroadcastHub(
+    max_queue=int(os.getenv("WS_SEND_QUEUE", "256")),
+    policy=os.getenv("WS_SLOW_CLIENT_POLICY", "drop_oldest"),
+)
+# 連線與主題訂閱登記，廣播只送給訂閱該主題的連線
+registry = WebSocketService()
+# 等待 /vue/order/next 的長輪詢請求
+order_waiters = OrderWaiters()
+
+# 指標：熱路徑只記錄延遲，狀態類指標在抓取 /metrics 時才計算
+WS_MESSAGE_TYPES = (
+    "custom_message", "get_orders", "sync", "subscribe", "unsubscribe", "delete_order", "clear_orders",
+)
+WS_MESSAGE_SECONDS = metrics.Histogram(
+    "ws_message_duration_seconds", "/ws 客戶端訊息處理時間", ("type",)
+)
+BROADCAST_SECONDS = metrics.Histogram(
+    "broadcast_fanout_duration_seconds", "廣播路由、序列化並排入各連線佇列的時間"
+)
+BROADCAST_RECIPIENTS = metrics.Histogram(
+    "broadcast_recipients", "每則廣播排入的連線數", buckets=(0, 1, 10, 100, 1000, 10000)
+)
+SAVE_DATA_SECONDS = metrics.Histogram(
+    "save_data_duration_seconds", "save_data 從排入群組提交到落盤返回的時間"
+)
+metrics.Gauge("ws_connected_clients", "目前的 WebSocket 連線數", callback=lambda: len(hub))
+metrics.Gauge("order_long_poll_waiters", "等待 /vue/order/next 的長輪詢請求數", callback=lambda: order_waiters.waiting)
+metrics.Gauge(
+    "ws_subscribers", "各主題的訂閱連線數", ("topic",),
+    callback=lambda: registry.get_connection_stats()["subscribers"],
+)
+metrics.Gauge(
+    "broadcast_queue_depth_max", "所有連線中最長的送出佇列", callback=lambda: hub.stats()["max_queue_depth"]
+)
+metrics.Gauge(
+    "broadcast_backlogged_clients", "送出佇列已滿的連線數", callback=lambda: hub.stats()["backlogged_clients"]
+)
+metrics.Counter(
+    "broadcast_dropped_messages_total", "因佇列已滿被丟棄或合併的訊息數", ("reason",),
+    callback=lambda: {"dropped": hub.dropped, "coalesced": hub.coalesced},
+)
+metrics.Counter(
+    "broadcast_disconnected_clients_total", "因佇列已滿被中斷的連線數", callback=lambda: hub.disconnected
+)
+metrics.Gauge("order_commit_queue_depth", "等待群組提交的變更數", callback=lambda: committer.pending)
+metrics.Counter("order_commit_flushes_total", "群組提交寫入次數", callback=lambda: committer.flushes)
+metrics.Gauge("orders", "記憶體中的訂單數", callback=lambda: len(orders_db))
+metrics.Gauge("order_feed_entries", "變更序列緩衝區內的筆數", callback=lambda: len(change_feed))
+if pubsub is not None:
+    metrics.Counter(
+        "pubsub_messages_total", "worker 之間的 pub/sub 訊息數", ("direction",),
+        callback=lambda: {
+            "published": pubsub.published, "received": pubsub.received, "dropped": pubsub.dropped,
+        },
+    )
+    metrics.Gauge("pubsub_peers", "其他 worker 的數量", callback=pubsub.peers)
+metrics.Gauge(
+    "dispatch_orders", "派工佇列中待派與租約中的訂單數", ("state",),
+    callback=lambda: {k: v for k, v in dispatch.stats().items() if k in ("pending", "leased")},
+)
+metrics.Counter(
+    "dispatch_leases_total", "派工租約事件數（本行程）", ("event",),
+    callback=lambda: {k: v for k, v in dispatch.stats().items() if k not in ("pending", "leased")},
+)
+metrics.Gauge("order_lifecycle_orders", "各生命週期狀態的訂單數", ("state",), callback=lambda: lifecycle.counts())
+metrics.Summary(
+    "order_lifecycle_latency_ms", "訂單生命週期延遲（毫秒）", ("stage",),
+    callback=lambda: lifecycle.histograms,
+)
 
 # FastAPI 應用
 app = FastAPI(title="AutoWarehouse API", version="1.0.0")
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -76,25 +469,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 掛載 VUE 專用路由（支援以 `python app/main.py` 直接啟動）
-try:
-    from app.services.send_to_Front import router as ue_router
-except ModuleNotFoundError:
-    # 當以腳本形式在 `app` 目錄內執行時，將父目錄加入 sys.path
-    import sys as _sys
-    from pathlib import Path as _Path
-
-    _parent = _Path(__file__).resolve().parents[1]
-    if str(_parent) not in _sys.path:
-        _sys.path.insert(0, str(_parent))
-    from app.services.send_to_Front import router as ue_router
+# 掛載 VUE 專用路由與路徑規劃
 app.include_router(ue_router)
+app.include_router(route_router)
+app.include_router(batch_router)
+app.include_router(slotting_router)
+app.include_router(fleet_router)
 
 
 class CreateOrderRequest(BaseModel):
     content: Optional[str] = None
     items: Optional[List[int]] = None
     timestamp: Optional[str] = None
+    priority: Optional[int] = None  # 派工優先度，越大越先領取，預設 0
 
 
 class OrderResponse(BaseModel):
@@ -103,6 +490,7 @@ class OrderResponse(BaseModel):
     timestamp: str
     client_id: Optional[int] = None
     items: Optional[List[int]] = None
+    priority: Optional[int] = None
 
 
 def parse_items_from_content(content: str) -> List[int]:
@@ -122,20 +510,78 @@ def parse_items_from_content(content: str) -> List[int]:
     return items
 
 
-async def broadcast_to_all(message: Dict[str, Any]):
-    """廣播訊息給所有連線的客戶端"""
-    if not connected_clients:
-        return
-    message_json = json.dumps(message)
-    tasks = []
-    for client in list(connected_clients):
+def normalize_order_input(
+    content: Optional[str], items: Optional[List[int]]
+) -> Tuple[str, List[int]]:
+    """允許以 items 或 content 傳入，互相推導；兩者皆提供時以 content 為準"""
+    if items and not content:
+        return "-".join(str(n) for n in items), items
+    if content:
+        return content, parse_items_from_content(content)
+    return "", []
+
+
+def deliver(message: Dict[str, Any]) -> int:
+    """依主題與車輛/區域篩選，排入本行程訂閱連線的佇列"""
+    started = time.perf_counter()
+    recipients = 0
+    for projected, websockets in registry.route(message):
+        recipients += hub.publish_to(websockets, projected)
+    if message.get("type") in WAKE_TYPES:
+        order_waiters.notify()
+    BROADCAST_SECONDS.observe(time.perf_counter() - started)
+    BROADCAST_RECIPIENTS.observe(recipients)
+    return recipients
+
+
+async def broadcast_to_all(message: Dict[str, Any], relay: bool = True):
+    """廣播給訂閱的客戶端；排入各連線佇列後立即返回，多 worker 時同時轉送給其他 worker"""
+    deliver(message)
+    if relay and pubsub is not None:
+        pubsub.publish({"kind": "broadcast", "message": message})
+
+
+# 帶有訂單序號的廣播；其他 worker 轉送前先補齊到該序號，客戶端據此增量同步時才不會落後
+ORDER_MESSAGE_TYPES = {"new_order", "orders_bulk_created", "order_deleted", "orders_cleared"}
+
+
+async def relay_from_peers():
+    """處理其他 worker 送來的訊息：補齊訂單變更、轉送廣播、重新載入貨物、喚醒領取者、推進訂單狀態"""
+    while True:
+        message = await pubsub.queue.get()
         try:
-            tasks.append(client.send_text(message_json))
-        except RuntimeError:
-            # 連線已關閉或無效
-            connected_clients.discard(client)
-    if tasks:
-        await asyncio.gather(*tasks, return_exceptions=True)
+            kind = message.get("kind")
+            if kind == "changed":
+                await catch_up(message.get("seq"))
+            elif kind == "broadcast":
+                payload = message["message"]
+                if payload.get("type") in ORDER_MESSAGE_TYPES and isinstance(payload.get("seq"), int):
+                    await catch_up(payload["seq"])
+                deliver(payload)
+            elif kind == "cargo":
+                load_cargo_data()
+            elif kind == "released":
+                order_waiters.notify()
+            elif kind == "ack":
+                ack = message["ack"]
+                if lifecycle.state_of(ack.get("order_id")) is None:
+                    await catch_up()
+                receive_peer_ack(lifecycle, ack, orders_db)
+        except Exception as e:
+            logger.error(f"處理其他 worker 的訊息時發生錯誤: {e}")
+
+
+async def poll_shared_state():
+    """pub/sub 通知遺失時的保險：定期比對共用狀態的最後序號"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(STATE_POLL_SECONDS)
+        try:
+            last_seq = await loop.run_in_executor(None, shared_state.last_seq)
+            if last_seq > change_feed.last_seq:
+                await catch_up(last_seq)
+        except Exception as e:
+            logger.error(f"檢查共用狀態時發生錯誤: {e}")
 
 
 async def periodic_status_update():
@@ -146,22 +592,47 @@ async def periodic_status_update():
             status_message = {
                 "type": "status_update",
                 "total_orders": len(orders_db),
-                "connected_clients": len(connected_clients),
+                "connected_clients": len(hub),
                 "uptime": "active",
                 "timestamp": datetime.now(timezone.utc).isoformat(),
             }
-            await broadcast_to_all(status_message)
+            # 各 worker 回報自己的連線數，不轉送
+            await broadcast_to_all(status_message, relay=False)
         except Exception as e:
             logger.error(f"Error in status update: {e}")
 
 
 @app.on_event("startup")
 async def on_startup():
+    global _data_dir_lock
+    # 寫入任何資料之前先鎖住資料目錄
+    if shared_state is None and _data_dir_lock is None:
+        _data_dir_lock = _lock_data_dir()
     # 啟動背景任務
     asyncio.create_task(periodic_status_update())
     logger.info("FastAPI server started with background status updater")
     # 對外暴露共用狀態，供 UE 路由使用
     app.state.orders_db = orders_db
+    app.state.registry = registry
+    app.state.hub = hub
+    app.state.order_waiters = order_waiters
+    app.state.broadcast = broadcast_to_all
+    app.state.lifecycle = lifecycle
+    app.state.dispatch = dispatch
+    app.state.shared = shared_state
+    app.state.publish = pubsub.publish if pubsub is not None else None
+    if pubsub is not None:
+        pubsub.start()
+        asyncio.create_task(relay_from_peers())
+        asyncio.create_task(poll_shared_state())
+        logger.info(f"共用狀態 {shared_state.path}（worker {os.getpid()}，其他 worker {pubsub.peers()} 個）")
+    # 以封存的確認記錄還原重啟前的訂單狀態
+    replayed = replay_acks(lifecycle)
+    if replayed:
+        logger.info(f"已從確認封存還原 {replayed} 筆訂單狀態")
+    # 已結束的訂單不再派送（重啟前的租約不保留，未結束的訂單都可重新領取）
+    dispatch.discard(lifecycle.ids_in(TERMINAL_STATES))
+    reserve_open_orders()
     # 列出已註冊路由，便於除錯
     try:
         route_paths = [getattr(r, "path", str(r)) for r in app.router.routes]
@@ -170,66 +641,180 @@ async def on_startup():
         pass
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    global _data_dir_lock
+    # 寫完排隊中的變更並關閉日誌檔，確保尾端資料落盤
+    await hub.close()
+    await committer.close()
+    order_log.close()
+    if _data_dir_lock is not None:
+        _data_dir_lock.close()
+        _data_dir_lock = None
+    if pubsub is not None:
+        pubsub.close()
+    if shared_state is not None:
+        shared_state.close()
+
+
 @app.get("/health")
 async def health():
-    return {"status": "ok", "orders": len(orders_db), "clients": len(connected_clients)}
+    return {
+        "status": "ok",
+        "backend": STATE_BACKEND,
+        "worker": os.getpid(),
+        "orders": len(orders_db),
+        "clients": len(hub),
+        "persistence": committer.stats(),
+        "broadcast": hub.stats(),
+        "subscriptions": registry.get_connection_stats(),
+        "lifecycle": lifecycle.counts(),
+        "dispatch": dispatch.stats(),
+        "inventory": inventory.stats(),
+        "pubsub": pubsub.stats() if pubsub is not None else None,
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus 文字格式的指標"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/orders")
 async def list_orders(limit: int = 50):
-    recent = orders_db[-limit:]
+    recent = orders_db.tail(limit)
     return {"orders": recent, "total": len(orders_db)}
 
 
 @app.post("/orders", response_model=OrderResponse)
 async def create_order(payload: CreateOrderRequest):
-    global order_counter
-    # 允許前端以 items 或 content 傳入，互相推導
-    if payload.items and not payload.content:
-        content = "-".join(str(n) for n in payload.items)
-        items = payload.items
-    elif payload.content and not payload.items:
-        content = payload.content
-        items = parse_items_from_content(payload.content)
-    elif payload.content and payload.items:
-        # 兩者皆提供，以 content 為準並重新解析 items
-        content = payload.content
-        items = parse_items_from_content(payload.content)
-    else:
-        content = ""
-        items = []
-
+    content, items = normalize_order_input(payload.content, payload.items)
+    problems = stock_problems(items)
+    if problems:
+        raise HTTPException(status_code=422, detail={"message": "Items not available", **problems})
     order = {
-        "id": order_counter,
+        "id": None,
         "content": content,
         "items": items,
         "timestamp": payload.timestamp or datetime.now(timezone.utc).isoformat(),
         "client_id": None,
     }
-    orders_db.append(order)
-    order_counter += 1
-    save_data()
+    if payload.priority is not None:
+        order["priority"] = payload.priority
+    seq = await add_orders([order])
 
-    await broadcast_to_all({"type": "new_order", "order": order})
+    await broadcast_to_all({"type": "new_order", "order": order, "seq": seq})
     return order  # FastAPI 會依 response_model 轉換
 
 
+# 批次匯入最多回報的錯誤行數、匯出時每段的訂單數
+BULK_MAX_ERRORS = 100
+EXPORT_CHUNK_SIZE = 500
+
+
+def _parse_bulk_line(line: bytes, line_no: int, parsed: List, errors: List, claimed: set) -> bool:
+    """驗證一行 NDJSON，成功時附加 (content, items, timestamp, priority)；空行回傳 True
+
+    claimed 為同一批前面各行已要的箱子，stock 模式下同批訂單也不能重複要同一個箱子。
+    """
+    line = line.strip()
+    if not line:
+        return True
+    try:
+        data = json.loads(line)
+        if not isinstance(data, dict):
+            raise ValueError("Line must be a JSON object")
+        payload = CreateOrderRequest(**data)
+    except ValidationError as e:
+        first = e.errors()[0]
+        message = f"{'.'.join(str(p) for p in first['loc'])}: {first['msg']}"
+    except ValueError as e:
+        message = str(e)
+    else:
+        content, items = normalize_order_input(payload.content, payload.items)
+        problems = stock_problems(items)
+        if problems is None and ORDER_STOCK_CHECK == "stock" and not claimed.isdisjoint(items):
+            problems = {"claimed_in_batch": sorted(claimed.intersection(items))}
+        if problems is None:
+            claimed.update(items)
+            parsed.append((content, items, payload.timestamp, payload.priority))
+            return True
+        message = f"items not available: {json.dumps(problems)}"
+    if len(errors) < BULK_MAX_ERRORS:
+        errors.append({"line": line_no, "error": message})
+    return False
+
+
+@app.post("/orders/bulk")
+async def bulk_import_orders(request: Request):
+    """串流匯入 NDJSON 訂單（每行一筆 content/items/timestamp/priority），
+    整批配發連續 id、寫入一次日誌並只廣播一則摘要；原始 id 會被忽略"""
+    parsed: List[Tuple[str, List[int], Optional[str], Optional[int]]] = []
+    errors: List[Dict[str, Any]] = []
+    claimed: set = set()
+    invalid = 0
+    line_no = 0
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            invalid += not _parse_bulk_line(line, line_no, parsed, errors, claimed)
+    if buffer.strip():
+        line_no += 1
+        invalid += not _parse_bulk_line(buffer, line_no, parsed, errors, claimed)
+
+    if not parsed:
+        return {"created": 0, "invalid": invalid, "errors": errors, "total": len(orders_db)}
+
+    # 解析完才一次配發連續 id
+    now = datetime.now(timezone.utc).isoformat()
+    orders = [
+        {"id": None, "content": content, "items": items, "timestamp": timestamp or now, "client_id": None}
+        for content, items, timestamp, _ in parsed
+    ]
+    for order, (*_, priority) in zip(orders, parsed):
+        if priority is not None:
+            order["priority"] = priority
+    seq = await add_orders(orders, bulk=True)
+
+    summary = {
+        "created": len(orders),
+        "first_id": orders[0]["id"],
+        "last_id": orders[-1]["id"],
+        "invalid": invalid,
+        "total": len(orders_db),
+    }
+    await broadcast_to_all(
+        {"type": "orders_bulk_created", **summary, "seq": seq, "timestamp": now}
+    )
+    return {**summary, "errors": errors}
+
+
+@app.get("/orders/export")
+async def export_orders():
+    """以 NDJSON 串流匯出所有訂單，分段序列化，不先組出完整清單"""
+
+    async def body():
+        for chunk in orders_db.iter_chunks(EXPORT_CHUNK_SIZE):
+            yield "".join(json.dumps(order, ensure_ascii=False) + "\n" for order in chunk)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
 @app.delete("/orders/{order_id}")
 async def delete_order(order_id: int):
-    target = None
-    for o in orders_db:
-        if o["id"] == order_id:
-            target = o
-            break
-    if not target:
+    seq = await remove_order(order_id)
+    if seq is None:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    orders_db.remove(target)
-    save_data()
     await broadcast_to_all(
         {
             "type": "order_deleted",
             "order_id": order_id,
+            "seq": seq,
             "timestamp": datetime.now(timezone.utc).isoformat(),
         }
     )
@@ -238,120 +823,219 @@ async def delete_order(order_id: int):
 
 @app.delete("/orders")
 async def clear_orders():
-    global order_counter
-    orders_db.clear()
-    order_counter = 1
-    save_data()
+    seq = await clear_all_orders()
     await broadcast_to_all(
-        {"type": "orders_cleared", "timestamp": datetime.now(timezone.utc).isoformat()}
+        {
+            "type": "orders_cleared",
+            "seq": seq,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }
     )
     return {"status": "cleared"}
 
 
+@app.get("/orders/pending")
+async def list_pending_orders(limit: int = 100):
+    """尚未收到 UE 確認的訂單（等待最久的在前）"""
+    return {"orders": lifecycle.in_states(("created",), limit), "total": lifecycle.counts()["created"]}
+
+
+@app.get("/orders/in-flight")
+async def list_in_flight_orders(limit: int = 100):
+    """已收到、尚未完成的訂單（最久未更新的在前）"""
+    counts = lifecycle.counts()
+    return {
+        "orders": lifecycle.in_states(IN_FLIGHT_STATES, limit),
+        "total": sum(counts[s] for s in IN_FLIGHT_STATES),
+    }
+
+
+@app.get("/orders/stuck")
+async def list_stuck_orders(older_than: Optional[float] = None, limit: int = 100):
+    """超過 older_than 秒（預設 ORDER_STUCK_SECONDS）沒有進展的未完成訂單"""
+    return {"orders": lifecycle.stuck(older_than, limit)}
+
+
+@app.get("/orders/lifecycle")
+async def order_lifecycle_metrics():
+    """各狀態數量與 建立→收到、收到→完成、端到端 延遲分布（毫秒）"""
+    return lifecycle.metrics()
+
+
+@app.get("/orders/{order_id}/lifecycle")
+async def order_lifecycle(order_id: int):
+    state = lifecycle.state_of(order_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return state
+
+
+def orders_snapshot() -> Dict[str, Any]:
+    """最新 50 筆訂單的快照，附上目前序號供之後增量同步"""
+    return {
+        "type": "orders_list",
+        "orders": orders_db.tail(50),
+        "total": len(orders_db),
+        "seq": change_feed.last_seq,
+        "epoch": change_feed.epoch,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def sync_response(since: Any, epoch: Optional[str]) -> Dict[str, Any]:
+    """回傳 since 之後的變更；序號過舊或無法沿用時改回快照"""
+    try:
+        since = int(since)
+    except (TypeError, ValueError):
+        return orders_snapshot()
+    changes = change_feed.since(since, epoch, max_cost=SYNC_MAX_DELTA)
+    if changes is None:
+        return orders_snapshot()
+    return {
+        "type": "orders_delta",
+        "since": since,
+        "seq": change_feed.last_seq,
+        "epoch": change_feed.epoch,
+        "changes": changes,
+        "total": len(orders_db),
+    }
+
+
+async def handle_ws_message(websocket: WebSocket, client_id: int, data: Dict[str, Any]):
+    """處理一則 /ws 客戶端訊息"""
+    msg_type = data.get("type")
+    if msg_type == "custom_message":
+        # 舊協議相容：透過 WS 新增訂單
+        content = data.get("content", "")
+        timestamp = data.get(
+            "timestamp", datetime.now(timezone.utc).isoformat()
+        )
+        items = parse_items_from_content(content)
+        problems = stock_problems(items)
+        if problems:
+            hub.send(websocket, {"type": "error", "message": "Items not available", "content": content, **problems})
+            return
+        order = {
+            "id": None,
+            "content": content,
+            "items": items,
+            "timestamp": timestamp,
+            "client_id": client_id,
+        }
+        seq = await add_orders([order])
+
+        hub.send(
+            websocket,
+            {
+                "type": "order_confirmation",
+                "order_id": order["id"],
+                "content": content,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+            },
+        )
+        await broadcast_to_all({"type": "new_order", "order": order, "seq": seq})
+
+    elif msg_type == "get_orders":
+        hub.send(websocket, orders_snapshot())
+
+    elif msg_type == "sync":
+        hub.send(websocket, sync_response(data.get("since"), data.get("epoch")))
+
+    elif msg_type in ("subscribe", "unsubscribe"):
+        # {"type": "subscribe", "topics": ["fleet"], "cars": [1], "replace": false}；zones 篩選會被拒絕
+        try:
+            if msg_type == "subscribe":
+                topics = registry.subscribe(
+                    str(client_id),
+                    data.get("topics"),
+                    data.get("cars"),
+                    data.get("zones"),
+                    bool(data.get("replace")),
+                )
+            else:
+                topics = registry.unsubscribe(str(client_id), data.get("topics"))
+        except ValueError as e:
+            hub.send(websocket, {"type": "error", "message": str(e)})
+            return
+        hub.send(websocket, {"type": "subscriptions", "topics": topics})
+
+    elif msg_type == "delete_order":
+        order_id = data.get("order_id")
+        if order_id is None:
+            hub.send(websocket, {"type": "error", "message": "Missing order_id"})
+            return
+        seq = await remove_order(order_id)
+        if seq is None:
+            hub.send(websocket, {"type": "error", "message": "Order not found"})
+            return
+        hub.send(websocket, {"type": "order_deleted", "order_id": order_id})
+        await broadcast_to_all(
+            {
+                "type": "order_deleted",
+                "order_id": order_id,
+                "seq": seq,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+
+    elif msg_type == "clear_orders":
+        seq = await clear_all_orders()
+        await broadcast_to_all(
+            {
+                "type": "orders_cleared",
+                "seq": seq,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+
+    else:
+        logger.warning(f"Unknown WS message type: {msg_type}")
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    connected_clients.add(websocket)
+    hub.add(websocket)
     client_id = id(websocket)
-    logger.info(f"WS connected: {client_id}, total={len(connected_clients)}")
+    params = websocket.query_params
     try:
+        # 可於連線時以 ?topics=fleet,status&cars=1,2 限定訂閱，預設訂閱全部（帶 zones 會被拒絕）
+        registry.add_connection(
+            str(client_id), websocket, params.get("client", "web"), params.get("topics")
+        )
+        if params.get("cars") is not None or params.get("zones") is not None:
+            registry.subscribe(
+                str(client_id), params.get("topics"), params.get("cars"), params.get("zones")
+            )
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        hub.remove(websocket)
+        registry.remove_connection(str(client_id))
+        return
+    logger.debug(f"WS connected: {client_id}, total={len(hub)}")
+    try:
+        # 重連時可直接帶 ?since=<seq>&epoch=<epoch> 取得遺漏的變更
+        since = websocket.query_params.get("since")
+        if since is not None:
+            hub.send(websocket, sync_response(since, websocket.query_params.get("epoch")))
         while True:
             raw = await websocket.receive_text()
             try:
                 data = json.loads(raw)
             except json.JSONDecodeError:
-                await websocket.send_text(
-                    json.dumps({"type": "error", "message": "Invalid JSON"})
-                )
+                hub.send(websocket, {"type": "error", "message": "Invalid JSON"})
                 continue
 
             msg_type = data.get("type")
-            if msg_type == "custom_message":
-                # 舊協議相容：透過 WS 新增訂單
-                content = data.get("content", "")
-                timestamp = data.get(
-                    "timestamp", datetime.now(timezone.utc).isoformat()
-                )
-                global order_counter
-                order = {
-                    "id": order_counter,
-                    "content": content,
-                    "items": parse_items_from_content(content),
-                    "timestamp": timestamp,
-                    "client_id": client_id,
-                }
-                orders_db.append(order)
-                order_counter += 1
-                save_data()
-
-                await websocket.send_text(
-                    json.dumps(
-                        {
-                            "type": "order_confirmation",
-                            "order_id": order["id"],
-                            "content": content,
-                            "timestamp": datetime.now(timezone.utc).isoformat(),
-                        }
-                    )
-                )
-                await broadcast_to_all({"type": "new_order", "order": order})
-
-            elif msg_type == "get_orders":
-                response = {
-                    "type": "orders_list",
-                    "orders": orders_db[-50:],
-                    "total": len(orders_db),
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                }
-                await websocket.send_text(json.dumps(response))
-
-            elif msg_type == "delete_order":
-                order_id = data.get("order_id")
-                if order_id is None:
-                    await websocket.send_text(
-                        json.dumps({"type": "error", "message": "Missing order_id"})
-                    )
-                    continue
-                target = None
-                for o in orders_db:
-                    if o["id"] == order_id:
-                        target = o
-                        break
-                if not target:
-                    await websocket.send_text(
-                        json.dumps({"type": "error", "message": "Order not found"})
-                    )
-                    continue
-                orders_db.remove(target)
-                save_data()
-                await websocket.send_text(
-                    json.dumps({"type": "order_deleted", "order_id": order_id})
-                )
-                await broadcast_to_all(
-                    {
-                        "type": "order_deleted",
-                        "order_id": order_id,
-                        "timestamp": datetime.now(timezone.utc).isoformat(),
-                    }
-                )
-
-            elif msg_type == "clear_orders":
-                orders_db.clear()
-                order_counter = 1
-                save_data()
-                await broadcast_to_all(
-                    {
-                        "type": "orders_cleared",
-                        "timestamp": datetime.now(timezone.utc).isoformat(),
-                    }
-                )
-
-            else:
-                logger.warning(f"Unknown WS message type: {msg_type}")
+            started = time.perf_counter()
+            await handle_ws_message(websocket, client_id, data)
+            label = msg_type if msg_type in WS_MESSAGE_TYPES else "unknown"
+            WS_MESSAGE_SECONDS.labels(label).observe(time.perf_counter() - started)
     except WebSocketDisconnect:
-        logger.info(f"WS disconnected: {client_id}")
+        logger.debug(f"WS disconnected: {client_id}")
     finally:
-        connected_clients.discard(websocket)
+        hub.remove(websocket)
+        registry.remove_connection(str(client_id))
 
 
 # 相容舊用法：允許 ws 根路徑連線（ws://host:port）
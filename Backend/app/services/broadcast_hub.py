@@ -0,0 +1,167 @@
+"""
+WebSocket 廣播中心
+
+每個連線有自己的有界送出佇列與寫入協程：廣播只序列化一次後放進各佇列即返回，
+慢速或卡住的客戶端只會塞滿自己的佇列，不會拖慢其他連線或發出變更的請求。
+佇列滿時依策略處理：
+- drop_oldest：丟棄最舊的訊息
+- coalesce：狀態類訊息只保留最新一筆，仍滿時丟棄最舊的訊息
+- disconnect：直接中斷該連線（客戶端可重連後以增量同步補齊）
+"""
+
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLOW_CLIENT_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# coalesce 策略下可合併的訊息類型（新訊息取代佇列中同類型的舊訊息）
+COALESCE_TYPES = {"status_update"}
+
+
+class _Client:
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.queue: Deque[Tuple[Optional[str], str]] = deque()  # (訊息類型, JSON 文字)
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+
+class BroadcastHub:
+    """每連線一個有界佇列與寫入協程的廣播器"""
+
+    def __init__(self, max_queue: int = 256, policy: str = "drop_oldest"):
+        if policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"未知的慢速客戶端策略: {policy}")
+        self.max_queue = max(max_queue, 1)
+        self.policy = policy
+        self._clients: Dict[Any, _Client] = {}
+
+        # 統計
+        self.published = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.disconnected = 0
+
+    def add(self, websocket):
+        """註冊已 accept 的連線並啟動其寫入協程"""
+        client = _Client(websocket)
+        client.task = asyncio.create_task(self._writer(client))
+        self._clients[websocket] = client
+
+    def remove(self, websocket):
+        client = self._clients.pop(websocket, None)
+        if client is not None and client.task is not None:
+            client.task.cancel()
+
+    def publish(self, message: Dict[str, Any]) -> int:
+        """序列化一次並放入所有連線的佇列，不等待送出，回傳排入的連線數"""
+        if not self._clients:
+            return 0
+        text = json.dumps(message)
+        kind = message.get("type")
+        self.published += 1
+        for client in list(self._clients.values()):
+            self._enqueue(client, kind, text)
+        return len(self._clients)
+
+    def publish_to(self, websockets, message: Dict[str, Any]) -> int:
+        """只排入指定連線的佇列（依訂閱分組後的廣播），同樣只序列化一次"""
+        targets = [c for c in (self._clients.get(ws) for ws in websockets) if c is not None]
+        if not targets:
+            return 0
+        text = json.dumps(message)
+        kind = message.get("type")
+        self.published += 1
+        for client in targets:
+            self._enqueue(client, kind, text)
+        return len(targets)
+
+    def send(self, websocket, message: Dict[str, Any]):
+        """回覆單一連線，與廣播共用同一佇列以保持順序"""
+        client = self._clients.get(websocket)
+        if client is not None:
+            self._enqueue(client, message.get("type"), json.dumps(message))
+
+    def _enqueue(self, client: _Client, kind: Optional[str], text: str):
+        queue = client.queue
+        if self.policy == "coalesce" and kind in COALESCE_TYPES:
+            for i, (queued_kind, _) in enumerate(queue):
+                if queued_kind == kind:
+                    del queue[i]
+                    client.coalesced += 1
+                    self.coalesced += 1
+                    break
+        if len(queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                self._disconnect(client)
+                return
+            queue.popleft()
+            client.dropped += 1
+            self.dropped += 1
+        queue.append((kind, text))
+        client.ready.set()
+
+    def _disconnect(self, client: _Client):
+        if self._clients.pop(client.websocket, None) is None:
+            return
+        self.disconnected += 1
+        logger.warning(f"送出佇列已滿，中斷慢速連線 {id(client.websocket)}")
+        if client.task is not None:
+            client.task.cancel()
+        # 卡住的連線可能連 close 都送不出去，不等待結果
+        asyncio.create_task(self._close_quietly(client.websocket))
+
+    @staticmethod
+    async def _close_quietly(websocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=1013), timeout=5)
+        except Exception:
+            pass
+
+    async def _writer(self, client: _Client):
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                while client.queue:
+                    _, text = client.queue.popleft()
+                    await client.websocket.send_text(text)
+                    client.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"送出失敗，移除連線 {id(client.websocket)}: {e}")
+            self._clients.pop(client.websocket, None)
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [len(c.queue) for c in self._clients.values()]
+        return {
+            "clients": len(self._clients),
+            "policy": self.policy,
+            "max_queue": self.max_queue,
+            "published": self.published,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "disconnected": self.disconnected,
+            "max_queue_depth": max(depths, default=0),
+            "backlogged_clients": sum(1 for d in depths if d >= self.max_queue),
+        }
+
+    async def close(self):
+        """停止所有寫入協程"""
+        tasks = [c.task for c in self._clients.values() if c.task is not None]
+        self._clients.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
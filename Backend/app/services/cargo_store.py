@@ -0,0 +1,173 @@
+"""
+貨物儲存與分批上傳（ingest session）
+
+貨物以 id 為鍵保存在記憶體索引中；前端分批上傳時先開啟 session，
+各批次在 session 內依 id upsert，commit 時才一次套用並寫檔，
+避免每一批都覆蓋前一批並重寫整個 cargo_data.json。
+"""
+
+import json
+import logging
+import time
+import uuid
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.services.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+SAVE_SERIALIZE_SECONDS = Histogram("cargo_save_serialize_seconds", "cargo_data.json 序列化時間")
+SAVE_WRITE_SECONDS = Histogram("cargo_save_write_seconds", "cargo_data.json 寫檔與替換時間")
+
+INGEST_MODES = ("replace", "merge")
+
+
+class CargoStore:
+    """依 id 索引的貨物資料，維持插入順序並可寫回 JSON 檔"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._cargo: Dict[str, Dict[str, Any]] = {}
+        # 變更監聽者：callback(added_or_updated, removed_ids)
+        self._listeners: List[Callable[[List[Dict[str, Any]], List[str]], None]] = []
+        # 每次變更加一，供讀取端判斷快取的回應是否仍有效
+        self.version = 0
+
+    def load(self):
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+        else:
+            items = []
+        removed = list(self._cargo)
+        self._cargo = {}
+        for cargo in items:
+            self._cargo[cargo["id"]] = cargo
+        self._notify(list(self._cargo.values()), removed)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.path.with_suffix(".tmp")
+        started = time.perf_counter()
+        text = json.dumps(list(self._cargo.values()), ensure_ascii=False, indent=2)
+        serialized = time.perf_counter()
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write(text)
+        temp_file.replace(self.path)
+        SAVE_SERIALIZE_SECONDS.observe(serialized - started)
+        SAVE_WRITE_SECONDS.observe(time.perf_counter() - serialized)
+
+    def add_listener(self, callback: Callable[[List[Dict[str, Any]], List[str]], None]):
+        self._listeners.append(callback)
+
+    def _notify(self, upserted: List[Dict[str, Any]], removed: List[str]):
+        self.version += 1
+        for callback in self._listeners:
+            try:
+                callback(upserted, removed)
+            except Exception as e:
+                logger.error(f"貨物變更監聽者發生錯誤: {e}")
+
+    def upsert_many(self, items: Iterable[Dict[str, Any]]) -> int:
+        upserted = []
+        for cargo in items:
+            self._cargo[cargo["id"]] = cargo
+            upserted.append(cargo)
+        self._notify(upserted, [])
+        return len(upserted)
+
+    def replace_all(self, items: Iterable[Dict[str, Any]]) -> int:
+        new_cargo = {cargo["id"]: cargo for cargo in items}
+        removed = [cid for cid in self._cargo if cid not in new_cargo]
+        self._cargo = new_cargo
+        self._notify(list(new_cargo.values()), removed)
+        return len(new_cargo)
+
+    def clear(self):
+        removed = list(self._cargo)
+        self._cargo = {}
+        self._notify([], removed)
+
+    def get(self, cargo_id: str) -> Optional[Dict[str, Any]]:
+        return self._cargo.get(cargo_id)
+
+    def tail(self, limit: int) -> List[Dict[str, Any]]:
+        if limit <= 0:
+            return []
+        recent = list(islice(reversed(self._cargo.values()), limit))
+        recent.reverse()
+        return recent
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        if not self._cargo:
+            return None
+        return next(reversed(self._cargo.values()))
+
+    def __len__(self) -> int:
+        return len(self._cargo)
+
+    def __iter__(self):
+        return iter(self._cargo.values())
+
+
+def apply_ingest(store: CargoStore, mode: str, items: List[Dict[str, Any]]) -> int:
+    """依上傳模式套用貨物（replace 取代全部、merge 依 id 合併），回傳套用筆數"""
+    if mode == "replace":
+        return store.replace_all(items)
+    return store.upsert_many(items)
+
+
+class CargoIngest:
+    """管理分批上傳 session：begin → append（可多次）→ take，取出的貨物由呼叫端以 apply_ingest 套用"""
+
+    def __init__(self, ttl_seconds: float = 600):
+        self.ttl = ttl_seconds
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+
+    def _expire(self):
+        now = time.monotonic()
+        for sid in [s for s, v in self._sessions.items() if v["expires_at"] < now]:
+            logger.info(f"貨物上傳 session 逾時: {sid}")
+            del self._sessions[sid]
+
+    def begin(self, mode: str = "replace") -> str:
+        if mode not in INGEST_MODES:
+            raise ValueError(f"未知的上傳模式: {mode}")
+        self._expire()
+        sid = uuid.uuid4().hex
+        self._sessions[sid] = {
+            "mode": mode,
+            "staged": {},
+            "chunks": 0,
+            "expires_at": time.monotonic() + self.ttl,
+        }
+        return sid
+
+    def _session(self, sid: str) -> Dict[str, Any]:
+        self._expire()
+        session = self._sessions.get(sid)
+        if session is None:
+            raise KeyError(sid)
+        return session
+
+    def append(self, sid: str, items: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        session = self._session(sid)
+        staged = session["staged"]
+        received = 0
+        for cargo in items:
+            staged[cargo["id"]] = cargo
+            received += 1
+        session["chunks"] += 1
+        session["expires_at"] = time.monotonic() + self.ttl
+        return {"received": received, "staged": len(staged), "chunks": session["chunks"]}
+
+    def take(self, sid: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """取出並結束 session，回傳 (mode, 暫存的貨物)，由呼叫端套用"""
+        session = self._session(sid)
+        del self._sessions[sid]
+        return session["mode"], list(session["staged"].values())
+
+    def abort(self, sid: str) -> bool:
+        return self._sessions.pop(sid, None) is not None
@@ -0,0 +1,63 @@
+"""
+訂單變更序列（change feed）
+
+每筆變更沿用訂單日誌配發的序號，依序存入固定大小的環狀緩衝區。
+斷線重連的客戶端帶著最後收到的序號與 epoch 回來時，只需補送缺少的變更；
+序號已被擠出緩衝區、epoch 不同（伺服器重啟）或差異太大時改送快照。
+"""
+
+import uuid
+from collections import deque
+from itertools import islice
+from typing import Any, Deque, Dict, List, Optional
+
+
+class ChangeFeed:
+    """保存最近 capacity 筆變更的環狀緩衝區"""
+
+    def __init__(self, capacity: int = 10000, last_seq: int = 0, epoch: Optional[str] = None):
+        self.capacity = max(capacity, 1)
+        # 每次啟動不同，客戶端據此判斷序號是否仍可沿用；多 worker 時沿用共用狀態的 epoch
+        self.epoch = epoch or uuid.uuid4().hex[:12]
+        self._entries: Deque[Dict[str, Any]] = deque(maxlen=self.capacity)
+        self.last_seq = last_seq
+
+    def reset(self, last_seq: int):
+        """清空緩衝區並從 last_seq 重新開始（重新載入整份訂單後使用）"""
+        self._entries.clear()
+        self.last_seq = last_seq
+
+    def append(self, entry: Dict[str, Any]):
+        """記錄一筆已配發序號的變更（需依序號遞增呼叫）"""
+        self._entries.append(entry)
+        self.last_seq = entry["seq"]
+
+    @property
+    def oldest_seq(self) -> Optional[int]:
+        return self._entries[0]["seq"] if self._entries else None
+
+    def since(
+        self, seq: int, epoch: Optional[str] = None, max_cost: Optional[int] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """回傳序號大於 seq 的變更；無法以增量補齊時回傳 None（應改送快照）
+
+        max_cost 以訂單筆數計（批次匯入一筆變更含多張訂單），超過即改送快照。
+        """
+        if epoch is not None and epoch != self.epoch:
+            return None
+        if seq == self.last_seq:
+            return []
+        oldest = self.oldest_seq
+        if oldest is None or seq > self.last_seq or seq < oldest - 1:
+            return None
+        changes = list(islice(self._entries, seq - oldest + 1, None))
+        if changes and changes[0]["seq"] != seq + 1:
+            return None
+        if max_cost is not None:
+            cost = sum(len(c.get("orders", ())) or 1 for c in changes)
+            if cost > max_cost:
+                return None
+        return changes
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,230 @@
+"""
+派工佇列：多個 UE 代理以租約（lease）領取訂單，避免同一筆訂單被重複揀貨
+
+- 待派訂單放在 heap，依 (優先度高者先, 到達順序) 排序，領取 N 筆為 O(N log n)
+- 領取時配發租約 token 與到期時間；POST /vue/ack 的 received / in_progress 視為心跳並延長租約，
+  completed / failed 結束租約；到期未確認的訂單自動回到佇列，由下一個代理領取
+- 刪除、重新排隊都不在 heap 中搜尋，改以字典記錄目前有效的項目，過期的 heap 項目在彈出時略過
+
+STATE_BACKEND=sqlite 時改用 shared_state.SqliteDispatch，介面相同，領取在交易內完成。
+"""
+
+import heapq
+import itertools
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.services.order_lifecycle import IN_FLIGHT_STATES, TERMINAL_STATES
+
+
+class LeaseError(Exception):
+    """確認帶的租約已過期或已由其他代理持有"""
+
+
+def new_lease() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class _Lease:
+    __slots__ = ("token", "agent", "expires_at", "key", "deliveries")
+
+    def __init__(self, token: str, agent: Optional[str], expires_at: float, key: Tuple[int, int], deliveries: int):
+        self.token = token
+        self.agent = agent
+        self.expires_at = expires_at
+        self.key = key
+        self.deliveries = deliveries
+
+
+class DispatchQueue:
+    """單一行程的派工佇列"""
+
+    def __init__(
+        self,
+        lookup: Callable[[Any], Optional[Dict[str, Any]]],
+        lease_seconds: float = 30.0,
+        max_lease_seconds: float = 600.0,
+    ):
+        """lookup：order_id → 訂單，用於領取時附上訂單內容"""
+        self.lookup = lookup
+        self.lease_seconds = lease_seconds
+        self.max_lease_seconds = max_lease_seconds
+        self._arrival = itertools.count()
+        # 待派：order_id → ((-優先度, 到達順序), 已派送次數)；heap 中 key 不符的項目已失效
+        self._pending: Dict[Any, Tuple[Tuple[int, int], int]] = {}
+        self._pending_heap: List[Tuple[Tuple[int, int], Any]] = []
+        # 租約：order_id → _Lease；到期 heap 中到期時間不符的項目已失效（租約延長過）
+        self._leases: Dict[Any, _Lease] = {}
+        self._expiry_heap: List[Tuple[float, Any, str]] = []
+
+        # 統計
+        self.claimed = 0
+        self.completed = 0
+        self.expired = 0
+        self.released = 0
+
+    def _lease_for(self, seconds: Optional[float]) -> float:
+        seconds = self.lease_seconds if seconds is None else seconds
+        return min(max(seconds, 1.0), self.max_lease_seconds)
+
+    # ---- 隨訂單變更維護 ----
+
+    def add(self, order_id: Any, priority: int = 0):
+        if order_id in self._pending or order_id in self._leases:
+            return
+        self._push(order_id, (-int(priority), next(self._arrival)), 0)
+
+    def _push(self, order_id: Any, key: Tuple[int, int], deliveries: int):
+        self._pending[order_id] = (key, deliveries)
+        heapq.heappush(self._pending_heap, (key, order_id))
+
+    def _take_pending(self, order_id: Any) -> Optional[Tuple[Tuple[int, int], int]]:
+        """不經 heap 取出待派項目；失效項目過多（例如只用確認、不經領取的客戶端）時重建 heap"""
+        pending = self._pending.pop(order_id, None)
+        if pending is not None and len(self._pending_heap) > 2 * len(self._pending) + 64:
+            self._pending_heap = [(key, oid) for oid, (key, _) in self._pending.items()]
+            heapq.heapify(self._pending_heap)
+        return pending
+
+    def remove(self, order_id: Any) -> bool:
+        """訂單刪除或已結束：不再派送"""
+        removed = self._take_pending(order_id) is not None
+        return self._leases.pop(order_id, None) is not None or removed
+
+    def discard(self, order_ids: Iterable[Any]) -> int:
+        """移除已結束的訂單（啟動時依重播的確認呼叫）"""
+        return sum(self.remove(order_id) for order_id in order_ids)
+
+    def clear(self):
+        self._pending.clear()
+        self._pending_heap.clear()
+        self._leases.clear()
+        self._expiry_heap.clear()
+
+    def apply(self, entry: Dict[str, Any]):
+        """依訂單日誌的一筆變更更新佇列"""
+        op = entry.get("op")
+        if op == "create":
+            self.add(entry["order"]["id"], entry["order"].get("priority") or 0)
+        elif op == "create_many":
+            for order in entry["orders"]:
+                self.add(order["id"], order.get("priority") or 0)
+        elif op == "delete":
+            self.remove(entry["order_id"])
+        elif op == "clear":
+            self.clear()
+
+    # ---- 租約 ----
+
+    def _reclaim(self, now: float):
+        """把已到期的租約放回待派"""
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, order_id, token = heapq.heappop(heap)
+            lease = self._leases.get(order_id)
+            if lease is None or lease.token != token or lease.expires_at != expires_at:
+                continue
+            del self._leases[order_id]
+            self._push(order_id, lease.key, lease.deliveries)
+            self.expired += 1
+
+    def _grant(
+        self, order_id: Any, key: Tuple[int, int], deliveries: int, agent: Optional[str], expires_at: float
+    ) -> _Lease:
+        lease = _Lease(new_lease(), agent, expires_at, key, deliveries + 1)
+        self._leases[order_id] = lease
+        heapq.heappush(self._expiry_heap, (expires_at, order_id, lease.token))
+        return lease
+
+    def claim(
+        self, agent: str, limit: int = 1, lease_seconds: Optional[float] = None, now: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """領取最多 limit 筆待派訂單，回傳 {order, lease, expires_at, deliveries}"""
+        now = time.time() if now is None else now
+        self._reclaim(now)
+        expires_at = now + self._lease_for(lease_seconds)
+        claimed = []
+        heap = self._pending_heap
+        while heap and len(claimed) < limit:
+            key, order_id = heapq.heappop(heap)
+            pending = self._pending.get(order_id)
+            if pending is None or pending[0] != key:
+                continue
+            del self._pending[order_id]
+            order = self.lookup(order_id)
+            if order is None:
+                continue
+            lease = self._grant(order_id, key, pending[1], agent, expires_at)
+            claimed.append(
+                {"order": order, "lease": lease.token, "expires_at": expires_at, "deliveries": lease.deliveries}
+            )
+        self.claimed += len(claimed)
+        return claimed
+
+    def acknowledge(
+        self,
+        order_id: Any,
+        status: str,
+        lease: Optional[str] = None,
+        lease_seconds: Optional[float] = None,
+        now: Optional[float] = None,
+    ) -> Optional[float]:
+        """依確認更新租約，回傳新的到期時間（租約結束或訂單不在佇列時為 None）
+
+        received / in_progress 延長租約；未經領取就直接確認的訂單視為被某個代理取走，同樣配發租約。
+        completed / failed 結束租約。帶 lease 但與目前持有者不符時拋出 LeaseError。
+        """
+        now = time.time() if now is None else now
+        self._reclaim(now)
+        held = self._leases.get(order_id)
+        if lease is not None and (held is None or held.token != lease):
+            raise LeaseError(order_id)
+        if status in TERMINAL_STATES:
+            if self.remove(order_id):
+                self.completed += 1
+            return None
+        if status not in IN_FLIGHT_STATES:
+            return None
+        expires_at = now + self._lease_for(lease_seconds)
+        if held is not None:
+            held.expires_at = expires_at
+            heapq.heappush(self._expiry_heap, (expires_at, order_id, held.token))
+            return expires_at
+        pending = self._take_pending(order_id)
+        if pending is None:
+            return None
+        self._grant(order_id, pending[0], pending[1], None, expires_at)
+        return expires_at
+
+    def release(self, order_id: Any, lease: str) -> bool:
+        """代理放棄租約，訂單立即回到待派"""
+        held = self._leases.get(order_id)
+        if held is None or held.token != lease:
+            return False
+        del self._leases[order_id]
+        self._push(order_id, held.key, held.deliveries)
+        self.released += 1
+        return True
+
+    def next_expiry(self) -> Optional[float]:
+        """最早到期的租約時間（沒有租約時為 None），長輪詢的領取據此決定最多等多久"""
+        heap = self._expiry_heap
+        while heap:
+            expires_at, order_id, token = heap[0]
+            lease = self._leases.get(order_id)
+            if lease is not None and lease.token == token and lease.expires_at == expires_at:
+                return expires_at
+            heapq.heappop(heap)
+        return None
+
+    def stats(self, now: Optional[float] = None) -> Dict[str, Any]:
+        self._reclaim(time.time() if now is None else now)
+        return {
+            "pending": len(self._pending),
+            "leased": len(self._leases),
+            "claimed": self.claimed,
+            "completed": self.completed,
+            "expired": self.expired,
+            "released": self.released,
+        }
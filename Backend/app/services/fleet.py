@@ -0,0 +1,536 @@
+"""
+多車隊排程與軌道預約
+
+以批次揀貨最佳化把取貨分配給 N 台車，再用視窗式合作 A*（WHCA*）規劃
+無碰撞的時間路徑：每一輪依序為各車在 window 個 tick 內做時空 A*，
+並將結果寫入時空預約表（格位 × tick、以及對向交換的軌道段），
+只提交前 commit 個 tick 後進入下一輪重新規劃。每輪成本與車數成線性。
+尚未規劃的車只保留下一個 tick 的格位，後規劃的車必須讓路；讓不出路時
+把該車提到最前面重排，仍不行則保留整個視窗（每台車都能原地等待）。
+卸貨延伸段是死路，依先到先服務一次只放行一台車。
+"""
+
+import asyncio
+import heapq
+import time
+import uuid
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel
+
+from app.services.pick_optimizer import optimize_picks, select_orders
+from app.services.routing import DEFAULT_CAR_CAPACITY, TRACK, Node, TrackGraph
+from app.services.send_to_Front import column_height, locate_box
+
+router = APIRouter(tags=["fleet"])
+
+# 每一步：(節點索引, 動作, 該動作剩餘 tick 數)
+Step = Tuple[int, str, int]
+
+
+class ReservationTable:
+    """時空預約表：(節點, tick)、(起點, 終點, 抵達 tick) 與卸貨死路的佔用"""
+
+    def __init__(self, zones: Optional[Dict[int, int]] = None):
+        self.vertex: Dict[Tuple[int, int], int] = {}
+        self.edge: Dict[Tuple[int, int, int], int] = {}
+        self.zones = zones or {}
+        self.zone_cars: Dict[Tuple[int, int], Set[int]] = {}
+
+    def can_move(self, car: int, u: int, v: int, t: int) -> bool:
+        """car 在 t-1 → t 由 u 移到 v（u == v 代表等待）是否可行"""
+        owner = self.vertex.get((v, t))
+        if owner is not None and owner != car:
+            return False
+        if u != v:
+            owner = self.edge.get((v, u, t))
+            if owner is not None and owner != car:
+                return False
+        return True
+
+    def zone_busy(self, car: int, zone: int, t: int) -> bool:
+        cars = self.zone_cars.get((zone, t))
+        return bool(cars) and (len(cars) > 1 or car not in cars)
+
+    def reserve(self, car: int, start: int, t0: int, steps: List[Step]):
+        prev = start
+        self.vertex[(start, t0)] = car
+        for k, (node, _, _) in enumerate(steps, 1):
+            self.vertex[(node, t0 + k)] = car
+            if node != prev:
+                self.edge[(prev, node, t0 + k)] = car
+            zone = self.zones.get(node)
+            if zone is not None:
+                self.zone_cars.setdefault((zone, t0 + k), set()).add(car)
+            prev = node
+
+
+class _Car:
+    def __init__(self, car_id: int, start: int, goals: List[Tuple[int, str]]):
+        self.id = car_id
+        self.pos = start
+        self.home = start
+        self.goals: Deque[Tuple[int, str]] = deque(goals)
+        self.dwell = 0
+        self.dwell_action = ""
+        self.completed = 0
+        self.bay: Optional[int] = None
+        # 完成所有目標後就近停車，不回起點，避免被其他已停好的車圍住
+        self.settled = not goals
+        self.waypoints: List[Dict[str, Any]] = []
+
+    @property
+    def busy(self) -> bool:
+        return bool(self.goals) or self.dwell > 0 or self.pos != self.home
+
+
+class FleetScheduler:
+    """WHCA* 車隊排程器"""
+
+    def __init__(
+        self,
+        graph: TrackGraph = TRACK,
+        window: int = 16,
+        commit: Optional[int] = None,
+        service_ticks: int = 2,
+    ):
+        self.graph = graph
+        self.window = max(window, 2)
+        self.commit = max(1, min(commit or self.window // 2, self.window))
+        self.service_ticks = max(service_ticks, 1)
+        self.neighbors = [[v for v, _ in edges] for edges in graph.adj]
+        # 卸貨延伸段是死路：有車在裡面時，其他車不得進入或停在入口，避免對頭僵持
+        self.zone_of: Dict[int, int] = {}
+        self.entry_zone: Dict[int, int] = {}
+        for zone, (x, z) in enumerate(graph.unload_points):
+            while z < 0:
+                self.zone_of[graph.index[(x, z)]] = zone
+                z += 1
+            if (x, z) in graph.index:
+                self.entry_zone[graph.index[(x, z)]] = zone
+
+    def _h(self, a: int, goal: int) -> float:
+        return self.graph._row(goal)[0][a]
+
+    def _astar(
+        self,
+        car: int,
+        start: int,
+        t0: int,
+        goal: int,
+        horizon: int,
+        hold: int,
+        table: ReservationTable,
+        pending: Set[int],
+        pending_zones: Counter,
+    ) -> Optional[Tuple[List[int], bool]]:
+        """時空 A*：抵達 goal 並可停留 hold 個 tick 即成功；
+        否則回傳在視窗末端最接近 goal 的部分路徑，皆不可行時回傳 None"""
+        own_zone = self.zone_of.get(start)
+
+        def free(u: int, v: int, t: int) -> bool:
+            if v in pending or not table.can_move(car, u, v, t):
+                return False
+            zone = self.zone_of.get(v, self.entry_zone.get(v))
+            if zone is None or zone == own_zone:
+                return True
+            return not pending_zones[zone] and not table.zone_busy(car, zone, t)
+
+        def can_hold(node: int, t: int) -> bool:
+            return all(free(node, node, tt) for tt in range(t + 1, min(t + hold, horizon) + 1))
+
+        # 同 f 值時優先展開走得較遠的狀態（g 以負值排序）
+        open_heap = [(self._h(start, goal), 0, start, t0)]
+        parent: Dict[Tuple[int, int], Optional[Tuple[int, int]]] = {(start, t0): None}
+        best_partial: Optional[Tuple[int, int]] = None
+        found: Optional[Tuple[int, int]] = None
+        while open_heap:
+            _, neg_g, node, t = heapq.heappop(open_heap)
+            if node == goal and can_hold(node, t):
+                found = (node, t)
+                break
+            if t == horizon:
+                # 視窗末端的 g 相同，第一個取出的即是最接近 goal 的狀態
+                best_partial = (node, t)
+                break
+            for nxt in [node] + self.neighbors[node]:
+                state = (nxt, t + 1)
+                if state in parent or not free(node, nxt, t + 1):
+                    continue
+                parent[state] = (node, t)
+                g = t + 1 - t0
+                heapq.heappush(open_heap, (g + self._h(nxt, goal), -g, nxt, t + 1))
+
+        end = found or best_partial
+        if end is None:
+            return None
+        path = []
+        state = end
+        while state != (start, t0):
+            path.append(state[0])
+            state = parent[state]
+        path.reverse()
+        return path, found is not None
+
+    def _plan_car(
+        self,
+        car: _Car,
+        t0: int,
+        table: ReservationTable,
+        pending: Set[int],
+        pending_zones: Counter,
+    ) -> Optional[List[Step]]:
+        """規劃單車一個視窗；連原地等待都不可行時回傳 None"""
+        horizon = t0 + self.window
+        steps: List[Step] = []
+        cur, t = car.pos, t0
+
+        def can_stay(until: int) -> bool:
+            return all(table.can_move(car.id, cur, cur, tt) for tt in range(t0 + 1, until + 1))
+
+        # 延續上一輪未完成的取貨/卸貨動作
+        dwell = car.dwell
+        while dwell > 0 and t < horizon:
+            dwell -= 1
+            steps.append((cur, car.dwell_action, dwell))
+            t += 1
+        prefix = len(steps)
+        if not can_stay(t0 + prefix):
+            return None
+
+        goals = list(car.goals) if car.dwell == 0 else list(car.goals)[1:]
+        gi = 0
+        while t < horizon:
+            if gi < len(goals) and self._admitted(car, *goals[gi]):
+                goal, action = goals[gi]
+                hold = self.service_ticks
+            elif gi < len(goals):
+                # 尚未輪到使用卸貨區，留在原地等待而不是擠到入口
+                goal, action = cur, ""
+                hold = horizon - t
+            else:
+                goal, action = car.home, ""
+                hold = horizon - t
+            result = self._astar(
+                car.id, cur, t, goal, horizon, hold, table, pending, pending_zones
+            )
+            if result is None:
+                break
+            path, reached = result
+            steps.extend((node, "move" if node != prev else "wait", 0)
+                         for prev, node in zip([cur] + path, path))
+            t += len(path)
+            cur = path[-1] if path else cur
+            if not reached or not action:
+                if reached:
+                    steps.extend((cur, "wait", 0) for _ in range(horizon - t))
+                    t = horizon
+                break
+            for k in range(self.service_ticks):
+                if t >= horizon:
+                    break
+                steps.append((cur, action, self.service_ticks - 1 - k))
+                t += 1
+            gi += 1
+
+        if len(steps) < self.window:
+            # 無法排滿視窗時退回到原地等待
+            if not can_stay(horizon):
+                return None
+            steps = steps[:prefix] + [(car.pos, "wait", 0)] * (self.window - prefix)
+        return steps
+
+    def _plan_round(
+        self, cars: List[_Car], order: List[_Car], t0: int, strict: bool
+    ) -> Tuple[Dict[int, List[Step]], Optional[_Car]]:
+        """依優先順序規劃一輪，回傳 (各車步驟, 無法讓路的車)
+
+        一般模式下尚未規劃的車只保留下一個 tick 的格位，後規劃的車必須讓路；
+        strict 模式則保留整個視窗，保證每台車至少能原地等待。
+        """
+        table = ReservationTable(self.zone_of)
+        pending: Set[int] = set()
+        for c in cars:
+            table.vertex[(c.pos, t0)] = c.id
+            if strict:
+                pending.add(c.pos)
+            else:
+                table.vertex[(c.pos, t0 + 1)] = c.id
+        pending_zones = Counter(self.zone_of[c.pos] for c in cars if c.pos in self.zone_of)
+        plans: Dict[int, List[Step]] = {}
+        for car in order:
+            pending.discard(car.pos)
+            if car.pos in self.zone_of:
+                pending_zones[self.zone_of[car.pos]] -= 1
+            steps = self._plan_car(car, t0, table, pending, pending_zones)
+            if steps is None:
+                return plans, car
+            plans[car.id] = steps
+            table.reserve(car.id, car.pos, t0, steps)
+        return plans, None
+
+    def run(
+        self, starts: List[Node], goals: List[List[Tuple[Node, str]]], max_ticks: int = 20000
+    ) -> Iterator[Dict[str, Any]]:
+        """逐輪規劃，每輪產出已提交的時間路徑點"""
+        index = self.graph.index
+        cars = [
+            _Car(i, index[s], [(index[n], a) for n, a in (goals[i] if i < len(goals) else [])])
+            for i, s in enumerate(starts)
+        ]
+        for car in cars:
+            car.waypoints.append(self._waypoint(0, car.pos, "start"))
+
+        self._bay_queue: Dict[int, Deque[int]] = {}
+        t0, round_no, idle_rounds = 0, 0, 0
+        while any(c.busy for c in cars) and t0 < max_ticks:
+            started = time.perf_counter()
+            self._displace_idle(cars)
+            self._admit(cars)
+            shift = round_no % len(cars)
+            order = cars[shift:] + cars[:shift]
+            # 讓不出路的車提到最前面重新規劃，仍失敗時改用 strict 模式
+            for attempt in range(len(cars) + 1):
+                plans, blocked = self._plan_round(cars, order, t0, attempt == len(cars))
+                if blocked is None:
+                    break
+                order.remove(blocked)
+                order.insert(0, blocked)
+
+            progressed = False
+            chunk = {}
+            for car in cars:
+                emitted = []
+                for k, (node, action, remaining) in enumerate(plans[car.id][: self.commit], 1):
+                    moved = node != car.pos
+                    car.pos = node
+                    if action in ("move", "wait"):
+                        car.dwell = 0
+                        if moved:
+                            progressed = True
+                            emitted.append(self._waypoint(t0 + k, node, action))
+                        continue
+                    if car.dwell == 0:
+                        emitted.append(self._waypoint(t0 + k, node, action))
+                    car.dwell, car.dwell_action = remaining, action
+                    if remaining == 0:
+                        car.goals.popleft()
+                        car.completed += 1
+                        progressed = True
+                car.waypoints.extend(emitted)
+                chunk[car.id] = emitted
+
+            idle_rounds = 0 if progressed else idle_rounds + 1
+            yield {
+                "round": round_no,
+                "from_tick": t0,
+                "to_tick": t0 + self.commit,
+                "planning_ms": (time.perf_counter() - started) * 1000,
+                "waypoints": chunk,
+                "stalled": idle_rounds >= 8,
+            }
+            t0 += self.commit
+            round_no += 1
+            if idle_rounds >= 8:
+                break
+        self.cars = cars
+
+    def _admitted(self, car: _Car, goal: int, action: str) -> bool:
+        zone = self.zone_of.get(goal)
+        return action != "unload" or zone is None or car.bay == zone
+
+    def _admit(self, cars: List[_Car]):
+        """卸貨區依先到先服務一次只放行一台車，車離開延伸段後才放行下一台"""
+        for car in cars:
+            if car.bay is None or car.pos in self.zone_of:
+                continue
+            if car.goals and car.goals[0][1] == "unload" and self.zone_of.get(car.goals[0][0]) == car.bay:
+                continue
+            car.bay = None
+        owners = {car.bay for car in cars if car.bay is not None}
+        for car in cars:
+            if car.bay is None and car.goals and car.goals[0][1] == "unload":
+                zone = self.zone_of.get(car.goals[0][0])
+                if zone is not None and car.id not in self._bay_queue.setdefault(zone, deque()):
+                    self._bay_queue[zone].append(car.id)
+        by_id = {car.id: car for car in cars}
+        for zone, queue in self._bay_queue.items():
+            if zone not in owners and queue:
+                by_id[queue.popleft()].bay = zone
+
+    def _displace_idle(self, cars: List[_Car]):
+        """剛完成的車就近找停車格；閒置車停在其他車待取貨的格位時改停到附近"""
+        targets = {goal for c in cars for goal, _ in c.goals}
+        for car in cars:
+            if car.goals or car.dwell:
+                continue
+            if car.settled and car.home not in targets:
+                continue
+            taken = targets | {c.home for c in cars if c is not car and c.settled}
+            car.home = self._nearest_spot(car.pos if not car.settled else car.home, taken)
+            car.settled = True
+
+    def _nearest_spot(self, start: int, taken: Set[int]) -> int:
+        seen = {start}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node not in taken and node not in self.zone_of and node not in self.entry_zone:
+                return node
+            for nxt in self.neighbors[node]:
+                if nxt not in seen:
+                    seen.add(nxt)
+                    queue.append(nxt)
+        return start
+
+    def _waypoint(self, t: int, node: int, action: str) -> Dict[str, Any]:
+        x, z = self.graph.nodes[node]
+        return {"t": t, "x": x, "z": z, "action": action}
+
+
+def default_starts(graph: TrackGraph, count: int) -> List[Node]:
+    """從最後一排開始，依序挑選非卸貨區的格位作為車子起點"""
+    grid = graph.grid
+    cells = [
+        (x, z)
+        for z in range(grid.depth - 1, -1, -1)
+        for x in range(grid.width)
+        if (x, z) in graph.index and (x, z) not in grid.unload_cells
+    ]
+    return cells[:count]
+
+
+def goals_from_plan(plan: Dict[str, Any]) -> List[List[Tuple[Node, str]]]:
+    """將 optimize_picks 的車輛計畫轉成依序的目標格位"""
+    goals = []
+    for car in plan["cars"]:
+        seq: List[Tuple[Node, str]] = []
+        for trip in car["trips"]:
+            for pick in trip["picks"]:
+                seq.append(((pick["cell"]["x"], pick["cell"]["z"]), "pick"))
+            seq.append(((trip["unload"]["x"], trip["unload"]["z"]), "unload"))
+        goals.append(seq)
+    return goals
+
+
+class FleetPlanRequest(BaseModel):
+    cars: Optional[List[Dict[str, int]]] = None
+    car_count: int = 2
+    order_ids: Optional[List[int]] = None
+    limit: int = 50
+    capacity: int = DEFAULT_CAR_CAPACITY
+    window: int = 16
+    service_ticks: int = 2
+    max_ticks: int = 20000
+    tick_seconds: float = 0.5
+    stream_every: int = 8
+
+
+_last_plan: Dict[str, Any] = {}
+
+
+@router.post("/fleet/plan")
+async def plan_fleet(payload: FleetPlanRequest, request: Request):
+    """分配訂單給車隊並規劃無碰撞的時間路徑，分段透過 /ws 廣播"""
+    orders = select_orders(request, payload.order_ids, payload.limit)
+
+    if payload.cars:
+        starts = [(c.get("x", 0), c.get("z", 0)) for c in payload.cars]
+    else:
+        starts = default_starts(TRACK, payload.car_count)
+    if not starts or any(s not in TRACK.index for s in starts) or len(set(starts)) != len(starts):
+        raise HTTPException(status_code=400, detail="Car starts must be distinct track cells")
+
+    # 與 /route/batch 相同：在事件迴圈上取好位置快照，最佳化與每一輪規劃交給工作執行緒
+    located = {
+        box_id: locate_box(box_id) for order in orders for box_id in order.get("items") or []
+    }
+    heights = {(x, z): column_height(x, z) for x, z in TRACK.nodes}
+    assignment = await asyncio.to_thread(
+        optimize_picks,
+        orders,
+        starts=starts,
+        capacity=payload.capacity,
+        locate=located.get,
+        height=lambda x, z: heights.get((x, z), 0),
+    )
+    scheduler = FleetScheduler(TRACK, window=payload.window, service_ticks=payload.service_ticks)
+    broadcast = getattr(request.app.state, "broadcast", None)
+    plan_id = uuid.uuid4().hex[:12]
+
+    rounds, planning_ms, stalled = 0, 0.0, False
+    pending_chunk: Dict[int, List[Dict[str, Any]]] = {}
+    chunk_from = 0
+    schedule = scheduler.run(starts, goals_from_plan(assignment), payload.max_ticks)
+    while True:
+        # 一次一輪，輪與輪之間讓出事件迴圈
+        result = await asyncio.to_thread(next, schedule, None)
+        if result is None:
+            break
+        rounds += 1
+        planning_ms += result["planning_ms"]
+        stalled = result["stalled"]
+        for car_id, points in result["waypoints"].items():
+            pending_chunk.setdefault(car_id, []).extend(points)
+        if broadcast and rounds % max(payload.stream_every, 1) == 0:
+            await broadcast(_chunk_message(plan_id, chunk_from, result["to_tick"], pending_chunk, payload))
+            pending_chunk, chunk_from = {}, result["to_tick"]
+    if broadcast:
+        # 一定送出 final 訊息；最後一輪剛好落在 stream_every 上時為空的收尾段
+        await broadcast(_chunk_message(plan_id, chunk_from, None, pending_chunk, payload))
+
+    cars = getattr(scheduler, "cars", [])
+    _last_plan.clear()
+    _last_plan.update(
+        {
+            "plan_id": plan_id,
+            "tick_seconds": payload.tick_seconds,
+            "cars": [
+                {
+                    "car": c.id,
+                    "start": {"x": starts[c.id][0], "z": starts[c.id][1]},
+                    "completed_goals": c.completed,
+                    "remaining_goals": len(c.goals),
+                    "waypoints": c.waypoints,
+                }
+                for c in cars
+            ],
+            "stats": {
+                "rounds": rounds,
+                "ticks": rounds * scheduler.commit,
+                "planning_ms": planning_ms,
+                "ms_per_round": planning_ms / rounds if rounds else 0.0,
+                "stalled": stalled,
+                "assignment": assignment["summary"],
+            },
+        }
+    )
+    return _last_plan
+
+
+@router.get("/fleet/plan")
+async def get_fleet_plan():
+    """取得最近一次的車隊計畫"""
+    if not _last_plan:
+        raise HTTPException(status_code=404, detail="No fleet plan")
+    return _last_plan
+
+
+def _chunk_message(
+    plan_id: str,
+    from_tick: int,
+    to_tick: Optional[int],
+    chunk: Dict[int, List[Dict[str, Any]]],
+    payload: FleetPlanRequest,
+) -> Dict[str, Any]:
+    return {
+        "type": "fleet_waypoints",
+        "plan_id": plan_id,
+        "from_tick": from_tick,
+        "to_tick": to_tick,
+        "final": to_tick is None,
+        "tick_seconds": payload.tick_seconds,
+        "cars": [{"car": car_id, "waypoints": points} for car_id, points in chunk.items()],
+    }
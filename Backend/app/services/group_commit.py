@@ -0,0 +1,140 @@
+"""
+群組提交（group commit）排程器
+
+突發流量下把同一時間窗內的多筆變更合併成一次寫入，
+於工作執行緒落盤；呼叫端 await 涵蓋自身變更的那次 flush，
+因此仍保有持久性，但不必每筆訂單各寫一次磁碟。
+返回時是否已 fsync 取決於 write_batch（訂單日誌的 ORDER_FSYNC_POLICY=always 才會）。
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitter:
+    """將變更排隊，每個時間窗或累積到上限時批次寫入"""
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[Dict[str, Any]]], Any],
+        window_ms: int = 20,
+        max_batch: int = 500,
+    ):
+        self.write_batch = write_batch
+        self.window = max(window_ms, 0) / 1000.0
+        self.max_batch = max(max_batch, 1)
+
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._has_work: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # 統計
+        self.flushes = 0
+        self.mutations = 0
+        self.failures = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def _ensure_worker(self):
+        if self._task is None or self._task.done():
+            self._has_work = asyncio.Event()
+            self._full = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, entry: Dict[str, Any]):
+        """排入一筆變更，待其所屬批次落盤後返回（失敗時拋出例外）"""
+        if self._closing:
+            raise RuntimeError("GroupCommitter 已關閉")
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((entry, future))
+        self._has_work.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._has_work.wait()
+            if self._closing and not self._pending:
+                return
+            if len(self._pending) < self.max_batch and not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.window)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._pending[: self.max_batch]
+            del self._pending[: self.max_batch]
+            if len(self._pending) < self.max_batch:
+                self._full.clear()
+            if not self._pending and not self._closing:
+                self._has_work.clear()
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                await loop.run_in_executor(None, self.write_batch, [e for e, _ in batch])
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"批次寫入 {len(batch)} 筆變更失敗: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+            self._record(len(batch), (time.perf_counter() - started) * 1000)
+
+    def _record(self, size: int, elapsed_ms: float):
+        self.flushes += 1
+        self.mutations += size
+        self.last_batch_size = size
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        flushes = self.flushes or 1
+        return {
+            "flushes": self.flushes,
+            "mutations": self.mutations,
+            "failures": self.failures,
+            "pending": self.pending,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": round(self.mutations / flushes, 2),
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / flushes, 3),
+        }
+
+    async def close(self):
+        """寫完剩餘變更（包含正在工作執行緒中寫入的批次）後停止工作協程
+
+        不取消工作協程：取消時進行中的 write_batch 仍在執行緒裡跑，
+        呼叫端隨即關閉日誌會與其競爭；改為喚醒它寫完所有批次後自行結束。
+        """
+        self._closing = True
+        if self._task is None or self._task.done():
+            return
+        self._has_work.set()
+        self._full.set()
+        await self._task
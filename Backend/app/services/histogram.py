@@ -0,0 +1,100 @@
+"""
+串流延遲直方圖（HDR 風格）
+
+數值先換成整數單位（預設毫秒），再依二進位數量級分桶、每桶內等分成固定數量的子桶，
+相對誤差固定（significant_figures=2 約 1%），記錄為 O(1)、記憶體只隨數量級成長，
+不需保存每筆樣本即可回報任意百分位數。
+"""
+
+import math
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class LatencyHistogram:
+    """對數-線性分桶的直方圖，適合長時間累積延遲分布"""
+
+    def __init__(self, significant_figures: int = 2, unit: float = 1.0):
+        if not 1 <= significant_figures <= 5:
+            raise ValueError("significant_figures 需介於 1 到 5")
+        self.significant_figures = significant_figures
+        self.unit = unit  # 一個整數單位代表的原始數值大小（例如 1.0 = 1 毫秒）
+        # 子桶數取 2 的冪次，足以區分 significant_figures 位有效數字
+        self._sub_bits = math.ceil(math.log2(2 * 10 ** significant_figures))
+        self._half = 1 << (self._sub_bits - 1)
+        self._counts: List[int] = []
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def _index(self, value: int) -> int:
+        bucket = max(0, value.bit_length() - self._sub_bits)
+        return bucket * self._half + (value >> bucket)
+
+    def _upper(self, index: int) -> int:
+        """子桶涵蓋的最大整數值"""
+        if index < 2 * self._half:
+            return index
+        bucket = index // self._half - 1
+        sub = index - bucket * self._half
+        return ((sub + 1) << bucket) - 1
+
+    def record(self, value: float, count: int = 1):
+        if value < 0:
+            value = 0.0
+        index = self._index(int(math.ceil(value / self.unit)))
+        if index >= len(self._counts):
+            self._counts.extend([0] * (index + 1 - len(self._counts)))
+        self._counts[index] += count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def record_many(self, values: Iterable[float]):
+        for value in values:
+            self.record(value)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """第 p 百分位數（0–100），回傳該子桶的上界（不超過實際最大值）"""
+        if self.count == 0:
+            return None
+        target = max(1, math.ceil(self.count * min(max(p, 0.0), 100.0) / 100.0))
+        seen = 0
+        for index, c in enumerate(self._counts):
+            seen += c
+            if seen >= target:
+                return min(self._upper(index) * self.unit, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def merge(self, other: "LatencyHistogram"):
+        if (other._sub_bits, other.unit) != (self._sub_bits, self.unit):
+            raise ValueError("直方圖精度或單位不同，無法合併")
+        if len(other._counts) > len(self._counts):
+            self._counts.extend([0] * (len(other._counts) - len(self._counts)))
+        for index, c in enumerate(other._counts):
+            self._counts[index] += c
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def reset(self):
+        self._counts = []
+        self.count = 0
+        self.total = 0.0
+        self.min = self.max = None
+
+    def snapshot(self, percentiles: Iterable[float] = (50, 90, 95, 99, 99.9)) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "min": self.min,
+            "mean": self.mean,
+            "max": self.max,
+            **{f"p{p:g}": self.percentile(p) for p in percentiles},
+        }
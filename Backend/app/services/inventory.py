@@ -0,0 +1,240 @@
+"""
+庫存佔用模型
+
+以 numpy 陣列表示 warehouseGrid 的 width × depth × height 個格位：
+- _slot_box[x, z, 層]：該格位上的箱子編號，0 為空
+- _box_slot[box_id]：箱子所在格位的扁平索引，-1 為不在庫
+- _reserved[box_id]：保留該箱子的訂單 id，0 為未保留
+
+箱子編號 ↔ (x, z, 層) 沿用 WarehouseGrid（與前端 boxGrid.js 相同）。
+有貨物資料時依 cargo_data.json 的實際位置建立，沒有時視為預設配置全部在庫；
+貨物變更時整份重建（上傳即為新的實況），揀貨完成（確認 completed）時移除。
+一筆訂單的所有箱子以一次陣列運算驗證 / 保留，並可查詢哪些箱子被壓在其他箱子下面。
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.warehouse_config import WarehouseGrid, parse_box_id
+
+# 新增訂單時的檢查：off 不檢查；ids 拒絕超出 1..getMaxBoxId() 的編號；
+# stock 另外拒絕不在庫、重複或已被其他訂單保留的箱子，並保留該訂單的箱子
+STOCK_CHECK_MODES = ("off", "ids", "stock")
+
+Cell = Tuple[int, int, int]
+
+
+class Inventory:
+    """格位佔用與箱子保留"""
+
+    def __init__(
+        self,
+        grid: WarehouseGrid,
+        source: Optional[Callable[[], Iterable[Dict[str, Any]]]] = None,
+        locate: Optional[Callable[[str], Optional[Cell]]] = None,
+    ):
+        """source：目前所有貨物；locate：貨物 id → 實際 (x, z, 層)（沒有時依編號的預設格位）"""
+        self.grid = grid
+        self.shape = (grid.width, grid.depth, grid.height)
+        self.max_box_id = grid.max_box_id()
+        self.source = source
+        self.locate = locate
+
+        # 預設配置：編號 1..max_box_id 依序對應的格位
+        default = np.full(self.max_box_id + 1, -1, dtype=np.int32)
+        for box_id in range(1, self.max_box_id + 1):
+            default[box_id] = np.ravel_multi_index(grid.box_cell(box_id), self.shape)
+        self._default_slot = default
+
+        self._slot_box = np.zeros(self.shape, dtype=np.int32)
+        self._box_slot = np.full(self.max_box_id + 1, -1, dtype=np.int32)
+        self._reserved = np.zeros(self.max_box_id + 1, dtype=np.int64)
+        self._above: Optional[np.ndarray] = None
+        self.seeded_from = "default"
+        self.unplaced = 0
+        self.version = 0
+        self.rebuild()
+
+    # ---- 維護 ----
+
+    def rebuild(self):
+        """依貨物資料重建佔用；沒有貨物資料時為預設配置"""
+        items = list(self.source()) if self.source is not None else []
+        slots = np.full(self.max_box_id + 1, -1, dtype=np.int32)
+        unplaced = 0
+        if items:
+            for cargo in items:
+                box_id = parse_box_id(cargo.get("id"))
+                if box_id is None or not 1 <= box_id <= self.max_box_id:
+                    unplaced += 1
+                    continue
+                cell = self.locate(cargo["id"]) if self.locate is not None else None
+                if cell is None:
+                    cell = self.grid.box_cell(box_id)
+                x, z, level = cell
+                if not (self.grid.in_bounds(x, z) and 0 <= level < self.grid.height):
+                    unplaced += 1
+                    continue
+                slots[box_id] = np.ravel_multi_index((x, z, level), self.shape)
+            self.seeded_from = "cargo"
+        else:
+            slots[:] = self._default_slot
+            self.seeded_from = "default"
+        self._box_slot = slots
+        self._slot_box = np.zeros(self.shape, dtype=np.int32)
+        present = np.flatnonzero(slots >= 0)
+        # 同一格位有多個箱子時，編號較大的覆蓋較小的，被覆蓋者視為未放置
+        self._slot_box.flat[slots[present]] = present
+        placed = self._slot_box.flat[slots[present]] == present
+        self._box_slot[present[~placed]] = -1
+        self.unplaced = unplaced + int((~placed).sum())
+        self._changed()
+
+    def on_cargo_change(self, upserted: List[Dict[str, Any]], removed: List[str]):
+        """CargoStore 監聽者（需註冊在空間索引之後，才能取得新位置）"""
+        self.rebuild()
+
+    def _changed(self):
+        self._above = None
+        self.version += 1
+
+    def _ids(self, items: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """(所有編號, 是否在 1..max_box_id 內)；範圍外的編號先換成 -1，超出 int64 的值也不會溢位"""
+        values = [int(i) for i in items]
+        ids = np.fromiter(
+            (v if 1 <= v <= self.max_box_id else -1 for v in values), dtype=np.int64, count=len(values)
+        )
+        return ids, ids >= 1
+
+    # ---- 驗證與保留 ----
+
+    def validate(self, items: Sequence[Any], order_id: Optional[int] = None) -> Dict[str, Any]:
+        """一次檢查訂單的所有箱子
+
+        invalid：超出編號範圍；missing：不在庫；duplicates：同一訂單重複；
+        reserved：已被其他訂單保留（{box_id: order_id}）。order_id 為本訂單時略過自己的保留。
+        """
+        values = [int(i) for i in items]
+        ids, valid = self._ids(values)
+        ok_ids = ids[valid]
+        missing = ok_ids[self._box_slot[ok_ids] < 0]
+        holders = self._reserved[ok_ids]
+        taken = (holders != 0) & (holders != (order_id or 0))
+        unique, counts = np.unique(ok_ids, return_counts=True)
+        duplicates = unique[counts > 1]
+        result = {
+            "invalid": [v for v, ok in zip(values, valid.tolist()) if not ok],
+            "missing": np.unique(missing).tolist(),
+            "duplicates": duplicates.tolist(),
+            "reserved": {int(b): int(o) for b, o in zip(ok_ids[taken], holders[taken])},
+        }
+        result["ok"] = not any(result.values())
+        return result
+
+    def reserve(self, order_id: int, items: Sequence[Any]) -> Dict[str, Any]:
+        """全部通過驗證時保留所有箱子給 order_id，否則不保留任何一個"""
+        result = self.validate(items, order_id)
+        if result["ok"]:
+            ids, _ = self._ids(items)
+            self._reserved[ids] = order_id
+        return result
+
+    def release(self, order_id: int, items: Optional[Sequence[Any]] = None):
+        """取消 order_id 的保留；items 為 None 時取消其所有保留"""
+        if items is None:
+            self._reserved[self._reserved == order_id] = 0
+            return
+        ids, valid = self._ids(items)
+        ids = ids[valid]
+        ids = ids[self._reserved[ids] == order_id]
+        self._reserved[ids] = 0
+
+    def release_all(self):
+        self._reserved[:] = 0
+
+    def consume(self, order_id: int, items: Sequence[Any]) -> int:
+        """揀貨完成：箱子離開格位並取消保留，回傳移除的箱子數"""
+        ids, valid = self._ids(items)
+        ids = np.unique(ids[valid])
+        self.release(order_id, ids)
+        slots = self._box_slot[ids]
+        present = slots >= 0
+        if not present.any():
+            return 0
+        self._slot_box.flat[slots[present]] = 0
+        self._box_slot[ids[present]] = -1
+        self._changed()
+        return int(present.sum())
+
+    # ---- 查詢 ----
+
+    def locate_many(self, items: Sequence[Any]) -> np.ndarray:
+        """各箱子的 (x, z, 層)，不在庫或編號無效時為 (-1, -1, -1)"""
+        ids, valid = self._ids(items)
+        slots = np.full(len(ids), -1, dtype=np.int64)
+        slots[valid] = self._box_slot[ids[valid]]
+        cells = np.full((len(ids), 3), -1, dtype=np.int64)
+        present = slots >= 0
+        cells[present] = np.column_stack(np.unravel_index(slots[present], self.shape))
+        return cells
+
+    def _above_counts(self) -> np.ndarray:
+        # 每個格位上方的箱子數：沿層數由上往下累加再扣掉自己
+        if self._above is None:
+            occupied = (self._slot_box > 0).astype(np.int32)
+            self._above = np.flip(np.cumsum(np.flip(occupied, axis=2), axis=2), axis=2) - occupied
+        return self._above
+
+    def buried(self, items: Sequence[Any]) -> Dict[str, Any]:
+        """訂單中被壓住的箱子與需要先移開的箱子
+
+        同一訂單的箱子彼此壓住時，由上往下取即可，不列為需移開；
+        dig_moves 為需要移開的不同箱子數，可作為挖箱成本。
+        """
+        ids, _ = self._ids(dict.fromkeys(int(i) for i in items))
+        cells = self.locate_many(ids)
+        present = cells[:, 0] >= 0
+        above = np.zeros(len(ids), dtype=np.int64)
+        if present.any():
+            x, z, level = cells[present].T
+            above[present] = self._above_counts()[x, z, level]
+        ordered = set(ids.tolist())
+        boxes = []
+        blockers_all = set()
+        for box_id, cell, count in zip(ids.tolist(), cells.tolist(), above.tolist()):
+            if count == 0:
+                continue
+            x, z, level = cell
+            column = self._slot_box[x, z, level + 1:]
+            blockers = [int(b) for b in column[column > 0] if int(b) not in ordered]
+            blockers_all.update(blockers)
+            boxes.append(
+                {"box_id": box_id, "cell": {"x": x, "z": z, "level": level}, "above": count, "blockers": blockers}
+            )
+        return {"buried": boxes, "dig_moves": len(blockers_all)}
+
+    def occupied(self) -> Tuple[np.ndarray, np.ndarray]:
+        """在庫的 (箱子編號, (x, z, 層))，依編號排序"""
+        ids = np.flatnonzero(self._box_slot >= 0)
+        cells = np.column_stack(np.unravel_index(self._box_slot[ids], self.shape))
+        return ids, cells.reshape(-1, 3)
+
+    def column_height(self, x: int, z: int) -> int:
+        """(x, z) 最上層箱子的層數 + 1"""
+        levels = np.flatnonzero(self._slot_box[x, z] > 0)
+        return int(levels[-1]) + 1 if len(levels) else 0
+
+    def stats(self) -> Dict[str, Any]:
+        occupied = int((self._slot_box > 0).sum())
+        return {
+            "width": self.grid.width,
+            "depth": self.grid.depth,
+            "height": self.grid.height,
+            "max_box_id": self.max_box_id,
+            "seeded_from": self.seeded_from,
+            "in_stock": occupied,
+            "empty_slots": self.max_box_id - occupied,
+            "reserved": int((self._reserved[self._box_slot >= 0] != 0).sum()),
+            "unplaced": self.unplaced,
+        }
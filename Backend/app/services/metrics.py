@@ -0,0 +1,290 @@
+"""
+Prometheus 文字格式的指標（/metrics）
+
+熱路徑上只做 O(log 桶數) 的計數與加總；佇列深度、連線數等狀態以 callback
+登記，只在有人抓取 /metrics 時才計算，沒有人抓取時幾乎沒有額外成本。
+
+    REQUESTS = Histogram("http_request_duration_seconds", "…", ("method", "route", "status"))
+    REQUESTS.labels("GET", "/orders", "200").observe(0.003)
+    Gauge("ws_connected_clients", "…", callback=lambda: len(hub))
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 秒為單位的預設延遲分桶（100µs – 10s）
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, "_Metric"] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            # 重複載入模組（例如測試中重新匯入）時沿用最新的定義
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional["_Metric"]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            try:
+                samples = list(metric.collect())
+            except Exception as e:  # callback 失敗不應讓整個 /metrics 失敗
+                lines.append(f"# {metric.name} collection failed: {_escape(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        callback: Optional[Callable[[], Any]] = None,
+        registry: Registry = REGISTRY,
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        # callback 回傳單一數值，或 {標籤值 tuple: 數值}
+        self.callback = callback
+        self._children: Dict[Tuple, Any] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values: Any):
+        key = tuple(values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name} 需要標籤 {self.label_names}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _callback_values(self) -> Iterable[Tuple[Tuple, float]]:
+        value = self.callback()
+        if isinstance(value, dict):
+            return [(k if isinstance(k, tuple) else (k,), v) for k, v in value.items()]
+        return [((), value)]
+
+    def collect(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self, lock: threading.Lock):
+        self.value = 0.0
+        self._lock = lock
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def collect(self):
+        items = self._callback_values() if self.callback else [(k, c.value) for k, c in self._children.items()]
+        for key, value in items:
+            yield f"{self.name}{_label_text(self.label_names, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...], lock: threading.Lock):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後一格為 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = lock
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+class _Timer:
+    """with HISTOGRAM.labels(...).time(): ... 記錄區塊耗時（秒）"""
+
+    __slots__ = ("_child", "_start")
+
+    def __init__(self, child: _HistogramChild):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets=LATENCY_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels, **kwargs)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets, self._lock)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def collect(self):
+        for key, child in list(self._children.items()):
+            with self._lock:
+                counts = list(child.counts)
+                total, count = child.sum, child.count
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                labels = _label_text(self.label_names, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _label_text(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Summary(_Metric):
+    """以 callback 提供的 LatencyHistogram 輸出分位數（summary 格式）"""
+
+    kind = "summary"
+    quantiles = (0.5, 0.9, 0.99, 0.999)
+
+    def collect(self):
+        for key, histogram in self._callback_values():
+            for q in self.quantiles:
+                value = histogram.percentile(q * 100)
+                if value is None:
+                    continue
+                labels = _label_text(self.label_names, key, f'quantile="{q:g}"')
+                yield f"{self.name}{labels} {_format_value(value)}"
+            labels = _label_text(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(histogram.total)}"
+            yield f"{self.name}_count{labels} {histogram.count}"
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ---- ASGI 中介層 ----
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP 請求處理時間（含回應本文送出）", ("method", "route", "status")
+)
+
+
+class MetricsMiddleware:
+    """依路由樣板（例如 /orders/{order_id}）記錄 HTTP 請求延遲；純 ASGI，不包裝 Request 物件"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # 未匹配的路徑統一歸類，避免任意路徑造成標籤爆量
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(
+                time.perf_counter() - start
+            )
@@ -0,0 +1,122 @@
+"""
+給 UE 的訂單通知：長輪詢與 Server-Sent Events
+
+VaRest 不容易使用 /ws 協議，原本只能每秒輪詢 /vue/order/latest。
+這裡兩種方式都掛在 broadcast_to_all 的同一條路徑上：
+
+- 長輪詢：所有等待中的請求共用一個 asyncio.Event，新訂單廣播時 set 後換新，
+  上千個等待者各只是一個 waiter，不是每秒一個請求
+- SSE：每個串流以 _SseSink 偽裝成一條 WebSocket 連線，註冊到 WebSocketService
+  與 BroadcastHub，沿用主題篩選、每連線有界佇列與慢速客戶端策略
+"""
+
+import asyncio
+import logging
+import uuid
+from typing import Any, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# 會喚醒長輪詢的廣播類型
+WAKE_TYPES = {"new_order", "orders_bulk_created"}
+
+
+class OrderWaiters:
+    """長輪詢等待者共用的通知"""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+        self.waiting = 0
+        self.notified = 0
+
+    def notify(self):
+        """喚醒目前所有等待者；之後才開始等待的使用新的 Event"""
+        self._event.set()
+        self._event = asyncio.Event()
+        self.notified += 1
+
+    async def wait(self, timeout: float) -> bool:
+        """等待下一次通知，逾時回傳 False"""
+        event = self._event
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+
+class _SseSink:
+    """讓 BroadcastHub 以為是 WebSocket 的 SSE 連線
+
+    只容納一則訊息，send_text 會等串流送出後才返回，
+    因此積壓留在 hub 的每連線佇列，由慢速客戶端策略處理。
+    """
+
+    def __init__(self):
+        self._queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=1)
+
+    async def send_text(self, text: str):
+        await self._queue.put(text)
+
+    async def get(self) -> Optional[str]:
+        return await self._queue.get()
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        # 佇列中的訊息捨棄，讓串流讀到 None 後結束
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+
+def sse_response(
+    request: Request,
+    registry,
+    hub,
+    topics: Any = None,
+    cars: Any = None,
+    zones: Any = None,
+    keepalive: float = 15.0,
+) -> StreamingResponse:
+    """開啟一條 SSE 串流並註冊為廣播接收者；訂閱參數與 /ws 相同，無效的主題拋出 ValueError"""
+    sink = _SseSink()
+    client_id = f"sse-{uuid.uuid4().hex[:8]}"
+    try:
+        registry.add_connection(client_id, sink, "sse", topics)
+        if cars is not None or zones is not None:
+            registry.subscribe(client_id, topics, cars, zones)
+    except ValueError:
+        registry.remove_connection(client_id)
+        raise
+    hub.add(sink)
+
+    async def stream():
+        try:
+            yield f"retry: 3000\n: {client_id}\n\n"
+            while True:
+                try:
+                    text = await asyncio.wait_for(sink.get(), keepalive)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # 註解行，維持連線並讓代理伺服器不逾時
+                    yield ": keep-alive\n\n"
+                    continue
+                if text is None:
+                    break
+                yield f"data: {text}\n\n"
+        finally:
+            hub.remove(sink)
+            registry.remove_connection(client_id)
+            logger.debug(f"SSE 串流結束: {client_id}")
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,182 @@
+"""
+訂單生命週期狀態機
+
+UE 端的確認（POST /vue/ack）依序把訂單推進到 received → in_progress → completed / failed。
+每個狀態一個保持插入順序的 dict，訂單換狀態時從舊 dict 移到新 dict 尾端，
+因此依狀態列出訂單、轉換狀態都是 O(1)，且各狀態內依「最後更新時間」排序，
+找卡住的訂單只需從最舊的一端掃到第一筆未逾時的為止。
+同時以 LatencyHistogram 累積 建立→收到、收到→完成、建立→完成 的延遲分布。
+"""
+
+import heapq
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.services.histogram import LatencyHistogram
+
+# 狀態依序推進，可跳過中間狀態但不可倒退；completed / failed 為終態
+STATES = ("created", "received", "in_progress", "completed", "failed")
+_RANK = {"created": 0, "received": 1, "in_progress": 2, "completed": 3, "failed": 3}
+PENDING_STATES = ("created",)
+IN_FLIGHT_STATES = ("received", "in_progress")
+TERMINAL_STATES = ("completed", "failed")
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """ISO 8601 字串或 Unix 秒轉成 Unix 秒，無法解析時回傳 None"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+class _Entry:
+    __slots__ = ("state", "created_at", "received_at", "finished_at", "updated_at", "message")
+
+    def __init__(self, created_at: float):
+        self.state = "created"
+        self.created_at = created_at
+        self.received_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.updated_at = created_at
+        self.message: Optional[str] = None
+
+
+class OrderLifecycle:
+    """訂單狀態與延遲統計（時間皆為 Unix 秒，延遲以毫秒統計）"""
+
+    def __init__(self, stuck_after: float = 300.0):
+        self.stuck_after = stuck_after
+        self._entries: Dict[Any, _Entry] = {}
+        self._by_state: Dict[str, Dict[Any, None]] = {s: {} for s in STATES}
+        self.histograms = {
+            "created_to_received": LatencyHistogram(),
+            "received_to_completed": LatencyHistogram(),
+            "end_to_end": LatencyHistogram(),
+        }
+        self.rejected = 0  # 倒退或終態後的確認
+
+    # ---- 維護 ----
+
+    def track(self, order_id: Any, created_at: Optional[float] = None):
+        """新訂單進入 created；已存在時不變"""
+        if order_id in self._entries:
+            return
+        self._entries[order_id] = _Entry(time.time() if created_at is None else created_at)
+        self._by_state["created"][order_id] = None
+
+    def forget(self, order_id: Any):
+        entry = self._entries.pop(order_id, None)
+        if entry is not None:
+            self._by_state[entry.state].pop(order_id, None)
+
+    def clear(self):
+        self._entries.clear()
+        for ids in self._by_state.values():
+            ids.clear()
+
+    def transition(
+        self, order_id: Any, state: str, at: Optional[float] = None, message: Optional[str] = None
+    ) -> Tuple[bool, Optional[str]]:
+        """套用一次確認，回傳 (是否套用, 目前狀態)；訂單不存在時為 (False, None)
+
+        相同狀態重複確認視為心跳，只更新時間。
+        """
+        if state not in _RANK or state == "created":
+            raise ValueError(f"未知的訂單狀態: {state}")
+        entry = self._entries.get(order_id)
+        if entry is None:
+            return False, None
+        now = time.time() if at is None else at
+        current = entry.state
+        if current in TERMINAL_STATES or _RANK[state] < _RANK[current]:
+            self.rejected += 1
+            return False, current
+
+        if entry.received_at is None and state != "failed":
+            entry.received_at = now
+            self._record("created_to_received", now - entry.created_at)
+        if state in TERMINAL_STATES:
+            entry.finished_at = now
+            if state == "completed":
+                self._record("received_to_completed", now - entry.received_at)
+                self._record("end_to_end", now - entry.created_at)
+
+        self._by_state[current].pop(order_id, None)
+        self._by_state[state][order_id] = None
+        entry.state = state
+        entry.updated_at = now
+        if message is not None:
+            entry.message = message
+        return True, state
+
+    def _record(self, name: str, seconds: float):
+        self.histograms[name].record(max(seconds, 0.0) * 1000.0)
+
+    # ---- 查詢 ----
+
+    def state_of(self, order_id: Any) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(order_id)
+        return None if entry is None else self._describe(order_id, entry)
+
+    def _describe(self, order_id: Any, entry: _Entry, now: Optional[float] = None) -> Dict[str, Any]:
+        now = time.time() if now is None else now
+        return {
+            "order_id": order_id,
+            "state": entry.state,
+            "created_at": entry.created_at,
+            "received_at": entry.received_at,
+            "finished_at": entry.finished_at,
+            "updated_at": entry.updated_at,
+            "age": now - entry.created_at,
+            "idle": now - entry.updated_at,
+            "message": entry.message,
+        }
+
+    def in_states(self, states: Tuple[str, ...], limit: int = 100) -> List[Dict[str, Any]]:
+        """指定狀態中最久未更新的 limit 筆"""
+        now = time.time()
+        return [self._describe(order_id, self._entries[order_id], now) for order_id in self._oldest(states, limit)]
+
+    def ids_in(self, states: Tuple[str, ...]) -> List[Any]:
+        return [order_id for state in states for order_id in self._by_state[state]]
+
+    def stuck(self, older_than: Optional[float] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """超過 older_than 秒未更新的未完成訂單（最久的在前）"""
+        threshold = self.stuck_after if older_than is None else older_than
+        now = time.time()
+        cutoff = now - threshold
+        overdue = self._oldest(PENDING_STATES + IN_FLIGHT_STATES, limit, before=cutoff)
+        return [self._describe(order_id, self._entries[order_id], now) for order_id in overdue]
+
+    def _oldest(self, states: Tuple[str, ...], limit: int, before: Optional[float] = None) -> List[Any]:
+        # 各狀態內不保證依更新時間排序（啟動時依 id 以訂單時間戳建立、確認可帶過去的時間），
+        # 因此逐筆比較，只保留最舊的 limit 筆
+        entries = self._entries
+        ids: Iterator[Any] = (order_id for s in states for order_id in self._by_state[s])
+        if before is not None:
+            ids = (order_id for order_id in ids if entries[order_id].updated_at <= before)
+        return heapq.nsmallest(max(limit, 0), ids, key=lambda order_id: entries[order_id].updated_at)
+
+    def oldest_open(self) -> Optional[float]:
+        """未完成訂單中最早的建立時間"""
+        return min(
+            (e.created_at for e in self._entries.values() if e.state not in TERMINAL_STATES),
+            default=None,
+        )
+
+    def counts(self) -> Dict[str, int]:
+        return {state: len(ids) for state, ids in self._by_state.items()}
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "counts": self.counts(),
+            "rejected_acks": self.rejected,
+            "stuck_after_seconds": self.stuck_after,
+            "latency_ms": {name: h.snapshot() for name, h in self.histograms.items()},
+        }
@@ -0,0 +1,240 @@
+"""
+訂單預寫日誌（append-only write-ahead log）
+
+每次變更（create/create_many/delete/clear）只追加一行 JSON 到 `app_data.wal`，
+啟動時以快照 `app_data.json` 為基礎重播日誌；日誌累積到一定筆數後
+於背景執行緒壓縮成新快照，避免每筆訂單都重寫整份資料。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.services.metrics import SIZE_BUCKETS, Histogram
+
+logger = logging.getLogger(__name__)
+
+SERIALIZE_SECONDS = Histogram("order_log_serialize_seconds", "訂單日誌批次 JSON 序列化時間")
+WRITE_SECONDS = Histogram("order_log_write_seconds", "訂單日誌批次 write + flush 時間")
+FSYNC_SECONDS = Histogram("order_log_fsync_seconds", "訂單日誌 fsync 時間", ("policy",))
+BATCH_SIZE = Histogram("order_log_batch_size", "每次寫入日誌的變更筆數", buckets=SIZE_BUCKETS)
+SNAPSHOT_SECONDS = Histogram("order_snapshot_seconds", "壓縮快照寫入時間（背景執行緒）")
+
+# fsync 策略：always=每次寫入、batch=每 N 毫秒合併一次、os=交給作業系統
+FSYNC_POLICIES = ("always", "batch", "os")
+
+
+class OrderLog:
+    """以快照 + 追加日誌保存訂單，寫入成本與單筆變更大小成正比"""
+
+    def __init__(
+        self,
+        snapshot_path: Path,
+        fsync_policy: str = "batch",
+        fsync_interval_ms: int = 50,
+        compact_every: int = 10000,
+    ):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"未知的 fsync 策略: {fsync_policy}")
+        self.snapshot_path = Path(snapshot_path)
+        self.log_path = self.snapshot_path.with_suffix(".wal")
+        # 壓縮進行中時，舊日誌先改名保留，快照寫完才刪除
+        self.rotated_path = self.snapshot_path.with_suffix(".wal.1")
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = max(fsync_interval_ms, 1) / 1000.0
+        self.compact_every = compact_every
+
+        self.seq = 0
+        self.entries_since_snapshot = 0
+        self.compacting = False
+        self._lock = threading.Lock()
+        self._file = None
+        self._fsync_timer: Optional[threading.Timer] = None
+
+    # ---- 讀取 ----
+
+    def load(self) -> Tuple[List[Dict[str, Any]], int]:
+        """讀取快照並重播日誌，回傳 (orders, order_counter)"""
+        orders: Dict[int, Dict[str, Any]] = {}
+        counter = 1
+        snapshot_seq = 0
+
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for order in data.get("orders", []):
+                orders[order["id"]] = order
+            counter = data.get("order_counter", len(orders) + 1)
+            snapshot_seq = data.get("last_seq", 0)
+
+        self.seq = snapshot_seq
+        replayed = 0
+        for path in (self.rotated_path, self.log_path):
+            for entry in self._read_entries(path):
+                seq = entry.get("seq", 0)
+                if seq <= snapshot_seq:
+                    # 已包含在快照中（壓縮途中當機時會出現）
+                    continue
+                counter = self._apply(orders, counter, entry)
+                self.seq = max(self.seq, seq)
+                replayed += 1
+
+        self.entries_since_snapshot = replayed
+        logger.info(f"快照 {len(orders)} 筆訂單，重播日誌 {replayed} 筆")
+        return list(orders.values()), counter
+
+    def _read_entries(self, path: Path) -> Iterable[Dict[str, Any]]:
+        if not path.exists():
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # 最後一行可能因當機只寫了一半，直接略過
+                    logger.warning(f"略過損毀的日誌行 {path.name}:{lineno}")
+
+    @staticmethod
+    def _apply(orders: Dict[int, Dict[str, Any]], counter: int, entry: Dict[str, Any]) -> int:
+        op = entry.get("op")
+        if op == "create":
+            order = entry["order"]
+            orders[order["id"]] = order
+            return max(counter, order["id"] + 1)
+        if op == "create_many":
+            for order in entry["orders"]:
+                orders[order["id"]] = order
+                counter = max(counter, order["id"] + 1)
+            return counter
+        if op == "delete":
+            orders.pop(entry.get("order_id"), None)
+            return counter
+        if op == "clear":
+            orders.clear()
+            return 1
+        logger.warning(f"未知的日誌操作: {op}")
+        return counter
+
+    # ---- 寫入 ----
+
+    def next_seq(self) -> int:
+        """預先配發序號，讓排隊中的變更與快照涵蓋範圍保持一致"""
+        with self._lock:
+            self.seq += 1
+            return self.seq
+
+    def append(self, entry: Dict[str, Any]) -> int:
+        """追加一筆變更並依 fsync 策略落盤，回傳其序號"""
+        return self.append_many([entry])
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> int:
+        """一次寫入多筆變更（單次 write + 最多一次 fsync），回傳最後序號"""
+        with self._lock:
+            started = time.perf_counter()
+            lines = []
+            for entry in entries:
+                if "seq" not in entry:
+                    self.seq += 1
+                    entry = {"seq": self.seq, **entry}
+                lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+            serialized = time.perf_counter()
+            f = self._open()
+            f.write("".join(lines))
+            f.flush()
+            SERIALIZE_SECONDS.observe(serialized - started)
+            WRITE_SECONDS.observe(time.perf_counter() - serialized)
+            BATCH_SIZE.observe(len(entries))
+            self._sync_locked()
+            # 批次匯入一行含多筆訂單，壓縮門檻以訂單數計
+            self.entries_since_snapshot += sum(len(e.get("orders", ())) or 1 for e in entries)
+            return self.seq
+
+    def _open(self):
+        if self._file is None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.log_path, "a", encoding="utf-8")
+        return self._file
+
+    def _sync_locked(self):
+        if self.fsync_policy == "always":
+            started = time.perf_counter()
+            os.fsync(self._file.fileno())
+            FSYNC_SECONDS.labels("always").observe(time.perf_counter() - started)
+        elif self.fsync_policy == "batch" and self._fsync_timer is None:
+            self._fsync_timer = threading.Timer(self.fsync_interval, self._deferred_fsync)
+            self._fsync_timer.daemon = True
+            self._fsync_timer.start()
+
+    def _deferred_fsync(self):
+        with self._lock:
+            self._fsync_timer = None
+            if self._file is not None:
+                started = time.perf_counter()
+                os.fsync(self._file.fileno())
+                FSYNC_SECONDS.labels("batch").observe(time.perf_counter() - started)
+
+    # ---- 壓縮 ----
+
+    def needs_compaction(self) -> bool:
+        return not self.compacting and self.entries_since_snapshot >= self.compact_every
+
+    def begin_compaction(self) -> int:
+        """切換到新的日誌檔，回傳快照應涵蓋到的序號（需在變更所在執行緒呼叫）"""
+        with self._lock:
+            self.compacting = True
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+            if self.log_path.exists():
+                if self.rotated_path.exists():
+                    # 上一次壓縮失敗留下的舊日誌，併入後再輪替
+                    with open(self.rotated_path, "a", encoding="utf-8") as dst, open(
+                        self.log_path, "r", encoding="utf-8"
+                    ) as src:
+                        dst.write(src.read())
+                    self.log_path.unlink()
+                else:
+                    self.log_path.replace(self.rotated_path)
+            self.entries_since_snapshot = 0
+            return self.seq
+
+    def write_snapshot(self, orders: List[Dict[str, Any]], counter: int, last_seq: int):
+        """寫入快照並移除已涵蓋的舊日誌，可於背景執行緒呼叫"""
+        started = time.perf_counter()
+        try:
+            data = {"orders": orders, "order_counter": counter, "last_seq": last_seq}
+            temp_file = self.snapshot_path.with_suffix(".tmp")
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            temp_file.replace(self.snapshot_path)
+            if self.rotated_path.exists():
+                self.rotated_path.unlink()
+            SNAPSHOT_SECONDS.observe(time.perf_counter() - started)
+            logger.info(f"日誌已壓縮為快照：{len(orders)} 筆訂單 (seq={last_seq})")
+        except Exception as e:
+            logger.error(f"壓縮訂單日誌時發生錯誤: {e}")
+        finally:
+            self.compacting = False
+
+    def close(self):
+        with self._lock:
+            if self._fsync_timer is not None:
+                self._fsync_timer.cancel()
+                self._fsync_timer = None
+            if self._file is not None:
+                self._file.flush()
+                if self.fsync_policy != "os":
+                    os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
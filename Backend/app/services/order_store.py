@@ -0,0 +1,119 @@
+"""
+訂單儲存：以 id 為鍵的索引取代單純的 list
+
+Python dict 保留插入順序，因此同一個 dict 同時是 id→訂單 的索引
+與插入順序索引：依 id 查詢/刪除為 O(1)，刪除不留墓碑，
+取最新 N 筆只需從尾端反向走 N 步。
+version 在每次變更時加一，讀取端據此判斷快取的回應是否仍有效。
+issued 為清空後配發過的最大 id（刪除不會降低），用來分辨「最新訂單被刪除」與「訂單已清空」。
+"""
+
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class OrderStore:
+    """依插入順序保存訂單，支援 O(1) 查詢/刪除與 O(limit) 尾端讀取"""
+
+    def __init__(self, orders: Iterable[Dict[str, Any]] = (), issued: int = 0):
+        """issued：已配發過的最大 id（最新的訂單可能已被刪除），預設為載入訂單中的最大 id"""
+        self._orders: Dict[int, Dict[str, Any]] = {}
+        self.version = 0
+        self.issued = 0
+        for order in orders:
+            self.add(order)
+        self.issued = max(self.issued, issued)
+
+    def add(self, order: Dict[str, Any]):
+        """新增訂單；id 已存在時以新資料取代並移到最後"""
+        self._orders.pop(order["id"], None)
+        self._orders[order["id"]] = order
+        self.issued = max(self.issued, order["id"])
+        self.version += 1
+
+    def get(self, order_id: Any) -> Optional[Dict[str, Any]]:
+        return self._orders.get(order_id)
+
+    def remove(self, order_id: Any) -> Optional[Dict[str, Any]]:
+        """刪除並回傳訂單，不存在時回傳 None"""
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            self.version += 1
+        return order
+
+    def clear(self):
+        """清空訂單；之後的 id 重新從 1 配發"""
+        self._orders.clear()
+        self.issued = 0
+        self.version += 1
+
+    def tail(self, limit: int) -> List[Dict[str, Any]]:
+        """依插入順序回傳最新的 limit 筆訂單"""
+        if limit <= 0:
+            return []
+        recent = list(islice(reversed(self._orders.values()), limit))
+        recent.reverse()
+        return recent
+
+    def head(self, limit: int) -> List[Dict[str, Any]]:
+        """依插入順序回傳最舊的 limit 筆訂單"""
+        if limit <= 0:
+            return []
+        return list(islice(self._orders.values(), limit))
+
+    def iter_chunks(self, size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+        """依插入順序分段讀取，段與段之間允許其他請求新增/刪除訂單
+
+        迭代途中 dict 被修改會拋出 RuntimeError，此時重新迭代並略過
+        id 不大於上一段最後一筆的訂單（id 依插入順序遞增）。
+        """
+        size = max(size, 1)
+        last_id = None
+        while True:
+            values = iter(self._orders.values())
+            try:
+                while True:
+                    chunk = []
+                    for order in values:
+                        if last_id is not None and order["id"] <= last_id:
+                            continue
+                        chunk.append(order)
+                        if len(chunk) >= size:
+                            break
+                    if not chunk:
+                        return
+                    last_id = chunk[-1]["id"]
+                    yield chunk
+            except RuntimeError:
+                continue
+
+    def next_after(self, order_id: int) -> Tuple[Optional[Dict[str, Any]], int]:
+        """id 大於 order_id 的最舊一筆訂單與這類訂單的數量
+
+        從尾端反向走，成本與較新的訂單數成正比。order_id 超過清空後配發過的
+        最大 id（issued）時，表示呼叫端看到的是清空前的編號，視為從頭開始；
+        只是最新訂單被刪除時 issued 不變，不會重新從頭送出。
+        """
+        if order_id > self.issued:
+            order_id = 0
+        found, newer = None, 0
+        for order in reversed(self._orders.values()):
+            if order["id"] <= order_id:
+                break
+            found = order
+            newer += 1
+        return found, newer
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        if not self._orders:
+            return None
+        return next(reversed(self._orders.values()))
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._orders.values())
+
+    def __contains__(self, order_id: Any) -> bool:
+        return order_id in self._orders
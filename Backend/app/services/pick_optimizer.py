@@ -0,0 +1,384 @@
+"""
+批次揀貨最佳化
+
+把一段時間窗內的待處理訂單攤平成取貨清單，跨訂單排定每台車的取貨順序：
+1. 先排路線：同一格的取貨彼此距離為 0，因此以「格位」為節點，
+   用最近鄰法建立從卸貨點出發的巡迴路線，再以 2-opt 與 Or-opt 改善；
+2. 再分群：展開成取貨序列（同格由上往下取，減少挖箱），以動態規劃
+   依車子載量切成多趟「卸貨點 → 取貨 → 卸貨點」；
+3. 依序把各趟交給最早空閒的車子。
+同時以先到先服務（FIFO）計算基準，回報距離、挖箱數與每小時揀貨量的差異。
+"""
+
+import asyncio
+import heapq
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel, Field
+
+from app.services.order_lifecycle import PENDING_STATES
+from app.services.routing import DEFAULT_CAR_CAPACITY, TRACK, Node, TrackGraph
+from app.services.send_to_Front import column_height, locate_box
+
+router = APIRouter(tags=["route"])
+
+BoxCell = Tuple[int, int, int]
+Pick = Tuple[int, int, BoxCell]  # (order_id, box_id, (x, z, 層))
+
+
+class CostModel:
+    """時間估算參數（秒）"""
+
+    def __init__(self, per_step: float = 1.0, per_pick: float = 2.0, per_dig: float = 2.0):
+        self.per_step = per_step
+        self.per_pick = per_pick
+        self.per_dig = per_dig
+
+
+def expand_picks(
+    orders: Sequence[Dict[str, Any]], locate: Callable[[int], Optional[BoxCell]]
+) -> Tuple[List[Pick], List[Dict[str, int]]]:
+    """將訂單攤平為取貨清單，回傳 (picks, 找不到位置的項目)"""
+    picks: List[Pick] = []
+    unknown: List[Dict[str, int]] = []
+    for order in orders:
+        for box_id in order.get("items") or []:
+            cell = locate(box_id)
+            if cell is None:
+                unknown.append({"order_id": order["id"], "box_id": box_id})
+            else:
+                picks.append((order["id"], box_id, cell))
+    return picks, unknown
+
+
+class _Distances:
+    """涉及節點的距離子矩陣與各格到最近卸貨點的距離"""
+
+    def __init__(self, graph: TrackGraph, cells: Sequence[Node]):
+        self.graph = graph
+        self.nodes = list(dict.fromkeys(list(cells) + graph.unload_points))
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.d = [[graph.distance(a, b) for b in self.nodes] for a in self.nodes]
+        bays = [self.index[b] for b in graph.unload_points]
+        self.bay_dist: List[float] = []
+        self.bay_of: List[int] = []
+        for i in range(len(self.nodes)):
+            best = min(bays, key=lambda b: self.d[i][b]) if bays else i
+            self.bay_of.append(best)
+            self.bay_dist.append(self.d[i][best] if bays else 0.0)
+
+
+# ---- 第一階段：格位巡迴路線 ----
+
+
+def _nearest_neighbor(cells: List[int], depot: int, d) -> List[int]:
+    tour = [depot]
+    remaining = set(cells)
+    current = depot
+    while remaining:
+        current = min(remaining, key=lambda c: d[current][c])
+        remaining.remove(current)
+        tour.append(current)
+    return tour
+
+
+def _tour_length(tour: List[int], d) -> float:
+    return sum(d[tour[i - 1]][tour[i]] for i in range(len(tour)))
+
+
+def _two_opt(tour: List[int], d, deadline: float) -> bool:
+    """封閉巡迴的 2-opt，索引 0 為固定的卸貨點"""
+    improved = False
+    n = len(tour)
+    changed = True
+    while changed and time.perf_counter() < deadline:
+        changed = False
+        for i in range(1, n - 1):
+            a, b = tour[i - 1], tour[i]
+            for j in range(i + 1, n):
+                c, e = tour[j], tour[(j + 1) % n]
+                delta = d[a][c] + d[b][e] - d[a][b] - d[c][e]
+                if delta < -1e-9:
+                    tour[i : j + 1] = reversed(tour[i : j + 1])
+                    b = tour[i]
+                    changed = improved = True
+            if time.perf_counter() >= deadline:
+                break
+    return improved
+
+
+def _or_opt(tour: List[int], d, deadline: float) -> bool:
+    """將長度 1～3 的片段移到其他位置（可反向）"""
+    improved = False
+    changed = True
+    while changed and time.perf_counter() < deadline:
+        changed = False
+        n = len(tour)
+        for length in (1, 2, 3):
+            for i in range(1, n - length + 1):
+                j = i + length - 1
+                prev, nxt = tour[i - 1], tour[(j + 1) % n]
+                first, last = tour[i], tour[j]
+                removed_gain = d[prev][first] + d[last][nxt] - d[prev][nxt]
+                segment = tour[i : j + 1]
+                rest = tour[:i] + tour[j + 1 :]
+                best_delta, best_pos, best_rev = -1e-9, None, False
+                for k in range(len(rest)):
+                    p, q = rest[k], rest[(k + 1) % len(rest)]
+                    base = d[p][q]
+                    forward = d[p][first] + d[last][q] - base
+                    backward = d[p][last] + d[first][q] - base
+                    for cost, rev in ((forward, False), (backward, True)):
+                        delta = cost - removed_gain
+                        if delta < best_delta:
+                            best_delta, best_pos, best_rev = delta, k, rev
+                if best_pos is not None:
+                    if best_rev:
+                        segment.reverse()
+                    tour[:] = rest[: best_pos + 1] + segment + rest[best_pos + 1 :]
+                    changed = improved = True
+                    break
+            if changed or time.perf_counter() >= deadline:
+                break
+    return improved
+
+
+# ---- 第二階段：切分成多趟 ----
+
+
+def _split(seq: List[int], capacity: int, dist: _Distances) -> List[Tuple[int, int]]:
+    """依序列最佳切分成每趟至多 capacity 箱，回傳各趟的 [start, end) 範圍"""
+    d, bay = dist.d, dist.bay_dist
+    n = len(seq)
+    best = [0.0] + [math.inf] * n
+    cut = [0] * (n + 1)
+    for j in range(1, n + 1):
+        inner = 0.0
+        for i in range(j - 1, max(j - capacity, 0) - 1, -1):
+            if i < j - 1:
+                inner += d[seq[i]][seq[i + 1]]
+            cost = best[i] + bay[seq[i]] + inner + bay[seq[j - 1]]
+            if cost < best[j]:
+                best[j], cut[j] = cost, i
+    trips = []
+    j = n
+    while j > 0:
+        trips.append((cut[j], j))
+        j = cut[j]
+    trips.reverse()
+    return trips
+
+
+def _dig_moves(sequence: Sequence[Pick], height: Callable[[int, int], int]) -> List[int]:
+    """依取貨順序計算每一箱上方仍壓著的箱數"""
+    removed: Dict[Tuple[int, int], set] = {}
+    moves = []
+    for _, _, (x, z, level) in sequence:
+        taken = removed.setdefault((x, z), set())
+        above = max(height(x, z) - 1 - level, 0)
+        moves.append(above - sum(1 for lv in taken if lv > level))
+        taken.add(level)
+    return moves
+
+
+# ---- 第三階段：分配給車子並評估 ----
+
+
+def _evaluate(
+    trips: List[List[Pick]],
+    digs: List[List[int]],
+    starts: List[Node],
+    dist: _Distances,
+    costs: CostModel,
+) -> Dict[str, Any]:
+    """把各趟分配給車子，計算實際行駛距離與工時"""
+    d, idx = dist.d, dist.index
+
+    def trip_distance(trip: List[Pick], origin: int) -> Tuple[float, int]:
+        cells = [idx[(x, z)] for _, _, (x, z, _) in trip]
+        total = d[origin][cells[0]]
+        total += sum(d[cells[k]][cells[k + 1]] for k in range(len(cells) - 1))
+        end = dist.bay_of[cells[-1]]
+        return total + d[cells[-1]][end], end
+
+    cars = [
+        {"car": i, "start": {"x": s[0], "z": s[1]}, "trips": [], "distance": 0.0, "picks": 0,
+         "dig_moves": 0, "busy_seconds": 0.0}
+        for i, s in enumerate(starts)
+    ]
+    positions = [idx[s] for s in starts]
+    # 依序交給最早空閒的車子，各趟開始時間與序列順序一致，挖箱數計算才成立
+    heap = [(0.0, i) for i in range(len(cars))]
+    for t in range(len(trips)):
+        busy, car_no = heapq.heappop(heap)
+        car = cars[car_no]
+        distance, end = trip_distance(trips[t], positions[car_no])
+        dig = sum(digs[t])
+        seconds = (
+            distance * costs.per_step + len(trips[t]) * costs.per_pick + dig * costs.per_dig
+        )
+        car["trips"].append(
+            {
+                "picks": [
+                    {"order_id": o, "box_id": b, "cell": {"x": x, "z": z, "level": lv}}
+                    for o, b, (x, z, lv) in trips[t]
+                ],
+                "unload": {"x": dist.nodes[end][0], "z": dist.nodes[end][1]},
+                "distance": distance,
+                "dig_moves": dig,
+            }
+        )
+        car["distance"] += distance
+        car["picks"] += len(trips[t])
+        car["dig_moves"] += dig
+        car["busy_seconds"] += seconds
+        positions[car_no] = end
+        heapq.heappush(heap, (busy + seconds, car_no))
+
+    picks = sum(c["picks"] for c in cars)
+    makespan = max((c["busy_seconds"] for c in cars), default=0.0)
+    return {
+        "cars": cars,
+        "trips": len(trips),
+        "total_distance": sum(c["distance"] for c in cars),
+        "dig_moves": sum(c["dig_moves"] for c in cars),
+        "makespan_seconds": makespan,
+        "picks_per_hour": picks * 3600 / makespan if makespan > 0 else 0.0,
+    }
+
+
+def optimize_picks(
+    orders: Sequence[Dict[str, Any]],
+    graph: TrackGraph = TRACK,
+    starts: Optional[List[Node]] = None,
+    capacity: int = DEFAULT_CAR_CAPACITY,
+    time_budget_ms: float = 1000,
+    locate: Callable[[int], Optional[BoxCell]] = locate_box,
+    height: Callable[[int, int], int] = column_height,
+    costs: Optional[CostModel] = None,
+) -> Dict[str, Any]:
+    """為一批訂單產生每台車的取貨計畫，並與 FIFO 基準比較"""
+    started = time.perf_counter()
+    deadline = started + time_budget_ms / 1000.0
+    capacity = max(capacity, 1)
+    costs = costs or CostModel()
+    starts = starts or [graph.unload_points[0] if graph.unload_points else graph.nodes[0]]
+
+    picks, unknown = expand_picks(orders, locate)
+    picks = [p for p in picks if p[2][:2] in graph.index]
+    summary: Dict[str, Any] = {"orders": len(orders), "picks": len(picks), "unknown_items": unknown}
+    if not picks:
+        summary["elapsed_ms"] = (time.perf_counter() - started) * 1000
+        return {"cars": [], "summary": summary}
+
+    dist = _Distances(graph, [p[2][:2] for p in picks] + starts)
+    idx = dist.index
+
+    # 第一階段：格位巡迴
+    by_cell: Dict[int, List[Pick]] = {}
+    for pick in picks:
+        by_cell.setdefault(idx[pick[2][:2]], []).append(pick)
+    depot = idx[graph.unload_points[0]] if graph.unload_points else idx[starts[0]]
+    cells = [c for c in by_cell if c != depot]
+    tour = _nearest_neighbor(cells, depot, dist.d)
+    constructed = _tour_length(tour, dist.d)
+    while time.perf_counter() < deadline:
+        if not (_two_opt(tour, dist.d, deadline) | _or_opt(tour, dist.d, deadline)):
+            break
+    if depot in by_cell:
+        tour.insert(1, depot)
+
+    # 第二階段：展開成取貨序列（同格由上往下）並切分
+    sequence: List[Pick] = []
+    for cell in tour[1:]:
+        sequence.extend(sorted(by_cell[cell], key=lambda p: -p[2][2]))
+    cuts = _split([idx[p[2][:2]] for p in sequence], capacity, dist)
+    digs = _dig_moves(sequence, height)
+    trips = [sequence[a:b] for a, b in cuts]
+    trip_digs = [digs[a:b] for a, b in cuts]
+    plan = _evaluate(trips, trip_digs, starts, dist, costs)
+
+    # FIFO 基準：依到達順序，每 capacity 箱一趟
+    fifo_digs = _dig_moves(picks, height)
+    fifo_cuts = [(i, min(i + capacity, len(picks))) for i in range(0, len(picks), capacity)]
+    fifo = _evaluate(
+        [picks[a:b] for a, b in fifo_cuts],
+        [fifo_digs[a:b] for a, b in fifo_cuts],
+        starts,
+        dist,
+        costs,
+    )
+
+    summary.update(
+        {
+            "cars": len(starts),
+            "capacity": capacity,
+            "trips": plan["trips"],
+            "total_distance": plan["total_distance"],
+            "dig_moves": plan["dig_moves"],
+            "makespan_seconds": plan["makespan_seconds"],
+            "picks_per_hour": plan["picks_per_hour"],
+            "tour_length": {"constructed": constructed, "improved": _tour_length(tour, dist.d)},
+            "fifo": {k: v for k, v in fifo.items() if k != "cars"},
+            "elapsed_ms": (time.perf_counter() - started) * 1000,
+            "time_budget_ms": time_budget_ms,
+        }
+    )
+    return {"cars": plan["cars"], "summary": summary}
+
+
+MAX_TIME_BUDGET_MS = 10_000
+
+
+def select_orders(request: Request, order_ids: Optional[List[int]], limit: int) -> List[Dict[str, Any]]:
+    """指定的訂單；未指定時取最舊的 limit 筆仍待處理（尚未回報 received）的訂單"""
+    orders_db = getattr(request.app.state, "orders_db", None)
+    lifecycle = getattr(request.app.state, "lifecycle", None)
+    if orders_db is None or lifecycle is None:
+        raise HTTPException(status_code=503, detail="Order store not ready")
+    if order_ids is None:
+        # 待處理訂單依建立順序排列，已開始處理或已結束的不再重新規劃
+        order_ids = lifecycle.ids_in(PENDING_STATES)[: max(limit, 0)]
+    return [o for o in (orders_db.get(i) for i in order_ids) if o is not None]
+
+
+class BatchPlanRequest(BaseModel):
+    order_ids: Optional[List[int]] = None
+    limit: int = 500
+    cars: Optional[List[Dict[str, int]]] = None
+    capacity: int = DEFAULT_CAR_CAPACITY
+    time_budget_ms: float = Field(1000, gt=0, le=MAX_TIME_BUDGET_MS)
+    seconds_per_step: float = 1.0
+    seconds_per_pick: float = 2.0
+    seconds_per_dig: float = 2.0
+
+
+@router.post("/route/batch")
+async def plan_batch(payload: BatchPlanRequest, request: Request):
+    """為最舊的 limit 筆（或指定的）待處理訂單產生跨訂單的取貨計畫"""
+    orders = select_orders(request, payload.order_ids, payload.limit)
+
+    starts = None
+    if payload.cars:
+        starts = [(c.get("x", 0), c.get("z", 0)) for c in payload.cars]
+        if any(s not in TRACK.index for s in starts):
+            raise HTTPException(status_code=400, detail="Car start is not on the track grid")
+
+    # 在事件迴圈上取好位置快照，最佳化本身交給工作執行緒
+    located = {
+        box_id: locate_box(box_id) for order in orders for box_id in order.get("items") or []
+    }
+    heights = {(x, z): column_height(x, z) for x, z in TRACK.nodes}
+    return await asyncio.to_thread(
+        optimize_picks,
+        orders,
+        starts=starts,
+        capacity=payload.capacity,
+        time_budget_ms=payload.time_budget_ms,
+        locate=located.get,
+        height=lambda x, z: heights.get((x, z), 0),
+        costs=CostModel(payload.seconds_per_step, payload.seconds_per_pick, payload.seconds_per_dig),
+    )
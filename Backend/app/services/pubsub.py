@@ -0,0 +1,176 @@
+"""
+同一台機器上多個 worker 之間的發布/訂閱（Unix datagram socket）
+
+每個行程在共用目錄綁定一個 `<pid>-<隨機>.sock`，發布時對目錄中其他所有 socket
+各送一個 datagram（JSON），不需要額外的訊息伺服器。
+接收端以 loop.add_reader 讀取後放入 asyncio.Queue，由呼叫端依序處理。
+
+- 對方已結束（ConnectionRefused）時刪除其 socket 檔
+- 對方接收緩衝區已滿時丟棄並計數；訂單變更另有序號補齊，不依賴每一則都送達
+- 超過 max_datagram 的訊息先寫到 spill/ 再只送出檔名，過期的 spill 檔由發布端清除
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class UnixPubSub:
+    """以 Unix datagram socket 廣播 JSON 訊息給同目錄的其他行程"""
+
+    def __init__(
+        self,
+        directory: Path,
+        max_datagram: int = 60 * 1024,
+        receive_buffer: int = 4 * 1024 * 1024,
+        spill_ttl: float = 60.0,
+    ):
+        self.directory = Path(directory)
+        self.spill_dir = self.directory / "spill"
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.max_datagram = max_datagram
+        self.spill_ttl = spill_ttl
+        self.path = self.directory / f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock"
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        except OSError:
+            pass
+        self._sock.bind(str(self.path))
+        self._sock.setblocking(False)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+
+        self._peers: List[str] = []
+        self._peers_at = 0.0
+        self._last_spill_cleanup = 0.0
+
+        # 統計
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    # ---- 接收 ----
+
+    def start(self):
+        """開始接收（需在事件迴圈內呼叫）；收到的訊息放入 self.queue"""
+        self._loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self._loop.add_reader(self._sock.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data = self._sock.recv(self.max_datagram + 1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.error(f"pub/sub 接收失敗: {e}")
+                return
+            try:
+                message = json.loads(data)
+                if "spill" in message:
+                    message = self._read_spill(message["spill"])
+            except (ValueError, OSError) as e:
+                logger.warning(f"略過無法解析的 pub/sub 訊息: {e}")
+                continue
+            self.received += 1
+            self.queue.put_nowait(message)
+
+    def _read_spill(self, name: str) -> Dict[str, Any]:
+        with open(self.spill_dir / Path(name).name, "rb") as f:
+            return json.loads(f.read())
+
+    # ---- 發布 ----
+
+    def _peer_paths(self, refresh: bool = False) -> List[str]:
+        now = time.monotonic()
+        if refresh or now - self._peers_at > 1.0:
+            own = self.path.name
+            self._peers = [str(p) for p in self.directory.glob("*.sock") if p.name != own]
+            self._peers_at = now
+        return self._peers
+
+    def publish(self, message: Dict[str, Any]) -> int:
+        """送給其他所有行程，回傳送出的份數（不含自己）"""
+        data = json.dumps(message, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_datagram:
+            data = self._spill(data)
+        sent = 0
+        stale = False
+        for peer in self._peer_paths():
+            try:
+                self._sock.sendto(data, peer)
+                sent += 1
+            except (BlockingIOError, InterruptedError):
+                self.dropped += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 行程已結束但留下 socket 檔
+                stale = True
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+            except OSError as e:
+                self.dropped += 1
+                logger.warning(f"pub/sub 送往 {peer} 失敗: {e}")
+        if stale:
+            self._peer_paths(refresh=True)
+        self.published += 1
+        return sent
+
+    def _spill(self, data: bytes) -> bytes:
+        name = f"{uuid.uuid4().hex}.json"
+        temp = self.spill_dir / (name + ".tmp")
+        temp.write_bytes(data)
+        temp.replace(self.spill_dir / name)
+        self.spilled += 1
+        self._cleanup_spill()
+        return json.dumps({"spill": name}).encode("utf-8")
+
+    def _cleanup_spill(self):
+        now = time.time()
+        if now - self._last_spill_cleanup < self.spill_ttl:
+            return
+        self._last_spill_cleanup = now
+        for path in self.spill_dir.glob("*.json"):
+            try:
+                if now - path.stat().st_mtime > self.spill_ttl:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def peers(self) -> int:
+        return len(self._peer_paths())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "socket": self.path.name,
+            "peers": self.peers(),
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+        }
+
+    def close(self):
+        if self._loop is not None and not self._loop.is_closed():
+            try:
+                self._loop.remove_reader(self._sock.fileno())
+            except (ValueError, OSError):
+                pass
+        self._sock.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,127 @@
+"""
+輪詢讀取端點的回應快取（ETag / 304 / gzip）
+
+UE 端透過 VaRest 不斷輪詢 /vue/orders、/vue/order/latest、/vue/cargo，
+資料沒變時每次重建 dict 清單並重新序列化是白工。
+各儲存維護 version 計數器，每次變更加一；這裡以 (端點, 參數) 為鍵保存
+序列化後的 body 與其 version，version 未變就直接送出同一份 bytes：
+
+- ETag 取 body 內容的雜湊，與 version 無關，重啟或換 worker 後仍可沿用
+- If-None-Match 相符時回 304，不送 body
+- body 超過 gzip_min_bytes 且客戶端接受 gzip 時送壓縮版本（同樣只壓一次）；
+  壓縮版本是不同的表示，ETag 加上 `-gz`，並一律回 `Vary: Accept-Encoding`，
+  避免快取把壓縮與未壓縮的 body 互相代換
+"""
+
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from fastapi import Request, Response
+
+
+class CachedBody:
+    """一份序列化好的回應"""
+
+    __slots__ = ("version", "body", "etag", "gzip_etag", "_gzipped")
+
+    def __init__(self, version: int, body: bytes):
+        self.version = version
+        self.body = body
+        digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gz"'
+        self._gzipped: Optional[bytes] = None
+
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=5, mtime=0)
+        return self._gzipped
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _accepts_gzip(header: Optional[str]) -> bool:
+    if not header:
+        return False
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+class ResponseCache:
+    """以 (端點, 參數) 為鍵、最多保存 max_entries 份 body 的 LRU 快取"""
+
+    def __init__(self, max_entries: int = 64, gzip_min_bytes: int = 1024):
+        """gzip_min_bytes 為 0 時不壓縮"""
+        self.max_entries = max(max_entries, 1)
+        self.gzip_min_bytes = gzip_min_bytes
+        self._entries: "OrderedDict[Hashable, CachedBody]" = OrderedDict()
+
+        # 統計
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.gzipped = 0
+
+    def get(self, key: Hashable, version: int, build: Callable[[], Any]) -> CachedBody:
+        """取得 key 在 version 的 body；版本不同或尚未快取時呼叫 build() 重建"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        body = json.dumps(build(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        entry = CachedBody(version, body)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def respond(self, request: Request, key: Hashable, version: int, build: Callable[[], Any]) -> Response:
+        """回傳快取的 JSON 回應，處理 If-None-Match（304）與 Accept-Encoding（gzip）"""
+        entry = self.get(key, version, build)
+        # 是否壓縮取決於 Accept-Encoding 與 body 大小，同一個 URL 的回應都要帶 Vary
+        headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        gzipped = 0 < self.gzip_min_bytes <= len(entry.body) and _accepts_gzip(
+            request.headers.get("accept-encoding")
+        )
+        headers["ETag"] = entry.gzip_etag if gzipped else entry.etag
+        if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        if gzipped:
+            self.gzipped += 1
+            headers["Content-Encoding"] = "gzip"
+            return Response(entry.gzipped(), media_type="application/json", headers=headers)
+        return Response(entry.body, media_type="application/json", headers=headers)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "gzipped": self.gzipped,
+        }
@@ -0,0 +1,231 @@
+"""
+軌道路徑規劃
+
+車子在貨架頂部沿格位移動（與 CarManager.findGridPath 相同的四方向移動），
+卸貨區的軌道依 protrudeSteps 向 z 負方向延伸，卸貨點位於延伸段末端。
+網格是靜態的，因此每個起點的 Dijkstra 結果（距離與前驅）在第一次使用時
+快取下來，之後任意兩點的距離為 O(1)、路徑重建為 O(路徑長度)。
+"""
+
+import heapq
+import math
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel
+
+from app.services.send_to_Front import locate_box
+from app.services.warehouse_config import GRID, WarehouseGrid
+
+router = APIRouter(tags=["route"])
+
+Node = Tuple[int, int]  # (x, z)；卸貨延伸段的 z 為負值
+BoxCell = Tuple[int, int, int]  # (x, z, 層)
+
+# 現行 CarManager 一次只載一箱
+DEFAULT_CAR_CAPACITY = 1
+
+
+class TrackGraph:
+    """軌道網格圖與全點對距離快取"""
+
+    def __init__(
+        self,
+        grid: WarehouseGrid,
+        step_x: float = 1.0,
+        step_z: float = 1.0,
+        blocked: Iterable[Node] = (),
+    ):
+        self.grid = grid
+        blocked = set(blocked)
+        self.nodes: List[Node] = [
+            (x, z)
+            for x in range(grid.width)
+            for z in range(grid.depth)
+            if (x, z) not in blocked
+        ]
+        self.unload_points: List[Node] = []
+        bay_links: List[Tuple[Node, Node]] = []
+        for bay in grid.unload_bays:
+            steps = bay["protrudeSteps"]
+            for x, z in bay["cells"]:
+                prev = (x, z)
+                for k in range(1, steps + 1):
+                    node = (x, z - k)
+                    self.nodes.append(node)
+                    bay_links.append((prev, node))
+                    prev = node
+                self.unload_points.append(prev)
+
+        self.index: Dict[Node, int] = {node: i for i, node in enumerate(self.nodes)}
+        self.adj: List[List[Tuple[int, float]]] = [[] for _ in self.nodes]
+        for x, z in self.nodes:
+            if z < 0:
+                continue
+            for dx, dz, cost in ((1, 0, step_x), (0, 1, step_z)):
+                neighbor = (x + dx, z + dz)
+                if neighbor in self.index and neighbor[1] >= 0:
+                    self._link((x, z), neighbor, cost)
+        for a, b in bay_links:
+            if a in self.index:
+                self._link(a, b, step_z)
+
+        self._rows: Dict[int, Tuple[List[float], List[int]]] = {}
+
+    def _link(self, a: Node, b: Node, cost: float):
+        ia, ib = self.index[a], self.index[b]
+        self.adj[ia].append((ib, cost))
+        self.adj[ib].append((ia, cost))
+
+    def _row(self, src: int) -> Tuple[List[float], List[int]]:
+        """單一起點的 Dijkstra 結果（距離、前驅），計算後快取"""
+        row = self._rows.get(src)
+        if row is not None:
+            return row
+        dist = [math.inf] * len(self.nodes)
+        parent = [-1] * len(self.nodes)
+        dist[src] = 0.0
+        heap = [(0.0, src)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for v, cost in self.adj[u]:
+                nd = d + cost
+                if nd < dist[v]:
+                    dist[v] = nd
+                    parent[v] = u
+                    heapq.heappush(heap, (nd, v))
+        row = (dist, parent)
+        self._rows[src] = row
+        return row
+
+    def warm(self):
+        """預先計算全點對距離"""
+        for i in range(len(self.nodes)):
+            self._row(i)
+
+    def distance(self, a: Node, b: Node) -> float:
+        return self._row(self.index[a])[0][self.index[b]]
+
+    def path(self, a: Node, b: Node) -> Optional[List[Node]]:
+        """a → b 的最短路徑（含兩端點），不可達時回傳 None"""
+        ia, ib = self.index[a], self.index[b]
+        dist, parent = self._row(ia)
+        if math.isinf(dist[ib]):
+            return None
+        path = [ib]
+        while path[-1] != ia:
+            path.append(parent[path[-1]])
+        path.reverse()
+        return [self.nodes[i] for i in path]
+
+    def nearest_unload(self, a: Node) -> Tuple[Optional[Node], float]:
+        dist = self._row(self.index[a])[0]
+        best, best_dist = None, math.inf
+        for node in self.unload_points:
+            d = dist[self.index[node]]
+            if d < best_dist:
+                best, best_dist = node, d
+        return best, best_dist
+
+
+TRACK = TrackGraph(GRID)
+
+
+def _point(node: Node) -> Dict[str, int]:
+    return {"x": node[0], "z": node[1]}
+
+
+def _leg(graph: TrackGraph, start: Node, end: Node) -> Dict[str, Any]:
+    path = graph.path(start, end) or []
+    return {"path": [_point(n) for n in path], "distance": graph.distance(start, end)}
+
+
+def plan_route(
+    graph: TrackGraph,
+    start: Node,
+    picks: Sequence[Tuple[int, BoxCell]],
+    capacity: int = DEFAULT_CAR_CAPACITY,
+) -> Dict[str, Any]:
+    """依序取貨，滿載或最後一箱後前往最近的卸貨點"""
+    capacity = max(capacity, 1)
+    legs: List[Dict[str, Any]] = []
+    unreachable: List[int] = []
+    position, load, total = start, 0, 0.0
+
+    def unload():
+        nonlocal position, load, total
+        bay, _ = graph.nearest_unload(position)
+        if bay is None:
+            return
+        leg = _leg(graph, position, bay)
+        legs.append({"action": "unload", "cell": _point(bay), "boxes": load, **leg})
+        total += leg["distance"]
+        position, load = bay, 0
+
+    for box_id, (x, z, level) in picks:
+        target = (x, z)
+        if target not in graph.index or math.isinf(graph.distance(position, target)):
+            unreachable.append(box_id)
+            continue
+        leg = _leg(graph, position, target)
+        legs.append(
+            {"action": "pick", "box_id": box_id, "cell": {"x": x, "z": z, "level": level}, **leg}
+        )
+        total += leg["distance"]
+        position = target
+        load += 1
+        if load >= capacity:
+            unload()
+    if load:
+        unload()
+
+    return {
+        "start": _point(start),
+        "legs": legs,
+        "total_distance": total,
+        "unreachable": unreachable,
+    }
+
+
+class RoutePoint(BaseModel):
+    x: int
+    z: int
+
+
+class RouteRequest(BaseModel):
+    start: RoutePoint
+    items: Optional[List[int]] = None
+    order_id: Optional[int] = None
+    capacity: int = DEFAULT_CAR_CAPACITY
+
+
+@router.post("/route")
+async def plan_order_route(payload: RouteRequest, request: Request):
+    """規劃車子從目前位置取完訂單所有箱子並卸貨的路線"""
+    items = payload.items
+    if items is None and payload.order_id is not None:
+        orders_db = getattr(request.app.state, "orders_db", None)
+        order = orders_db.get(payload.order_id) if orders_db is not None else None
+        if order is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        items = order.get("items") or []
+    if items is None:
+        raise HTTPException(status_code=400, detail="Missing items or order_id")
+
+    start = (payload.start.x, payload.start.z)
+    if start not in TRACK.index:
+        raise HTTPException(status_code=400, detail="Start is not on the track grid")
+
+    picks, unknown = [], []
+    for box_id in items:
+        cell = locate_box(box_id)
+        if cell is None:
+            unknown.append(box_id)
+        else:
+            picks.append((box_id, cell))
+
+    plan = plan_route(TRACK, start, picks, payload.capacity)
+    plan["unknown_items"] = unknown
+    return plan
@@ -0,0 +1,384 @@
+"""
+追加式分段封存（segment archive）
+
+資料依序追加到 `<prefix>-<編號>.seg`，達到大小或時間上限就換下一個分段；
+每累積 index_every 位元組，於 `.idx` 追加一筆稀疏索引（位元組範圍與該範圍內的
+最小/最大時間），查詢時只以 mmap 讀取與時間區間重疊的範圍，不載入整個檔案。
+超過保存期限或總容量的舊分段會在換段時刪除。
+
+多個行程（uvicorn worker）可共用同一個目錄：各自寫入自己建立的分段
+（以獨佔建立檔案決定編號，寫入中的分段持有 flock，不會被其他行程的保存期限清理刪除），
+讀取時重新列出目錄，因此查詢涵蓋所有行程寫入的資料。
+
+寫入（包含換段時的 fsync 與保存期限清理）在每個封存專屬的單一寫入執行緒上依序執行，
+append 只排入工作、不阻塞事件迴圈；讀取前先等排入的寫入完成，確保讀得到自己寫的資料。
+
+封存本身不解讀內容，寫入端與讀取端自行約定區塊格式：
+JsonLinesArchive 每行一筆 JSON；遙測直接封存二進位 frame（見 telemetry.py）。
+"""
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (起始位元組, 結束位元組, 最小時間, 最大時間)
+INDEX_ENTRY = struct.Struct("<QQdd")
+
+Chunk = Tuple[int, int, float, float]
+
+
+class _Segment:
+    def __init__(self, path: Path):
+        self.path = path
+        self.index_path = path.with_suffix(".idx")
+        self.number = int(re.search(r"-(\d+)\.seg$", path.name).group(1))
+        self.chunks: List[Chunk] = []
+        if self.index_path.exists():
+            data = self.index_path.read_bytes()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            self.chunks = [e for e in INDEX_ENTRY.iter_unpack(data[:usable])]
+
+    @property
+    def size(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def bounds(self) -> Tuple[float, float]:
+        """分段的時間範圍；有未索引的尾段時上限視為無限大"""
+        if not self.chunks:
+            return float("-inf"), float("inf")
+        lo = min(c[2] for c in self.chunks)
+        hi = max(c[3] for c in self.chunks)
+        if self.chunks[-1][1] < self.size:
+            hi = float("inf")
+        return lo, hi
+
+    def overlapping(self, start: float, end: float) -> List[Tuple[int, int]]:
+        """與 [start, end] 重疊的位元組範圍（相鄰範圍合併），含未索引的尾段"""
+        ranges: List[Tuple[int, int]] = []
+        for lo_byte, hi_byte, lo_t, hi_t in self.chunks:
+            if hi_t < start or lo_t > end:
+                continue
+            if ranges and ranges[-1][1] == lo_byte:
+                ranges[-1] = (ranges[-1][0], hi_byte)
+            else:
+                ranges.append((lo_byte, hi_byte))
+        indexed_end = self.chunks[-1][1] if self.chunks else 0
+        size = self.size
+        if indexed_end < size:
+            if ranges and ranges[-1][1] == indexed_end:
+                ranges[-1] = (ranges[-1][0], size)
+            else:
+                ranges.append((indexed_end, size))
+        return ranges
+
+
+class SegmentArchive:
+    """依大小/時間換段、附稀疏時間索引的追加式封存"""
+
+    def __init__(
+        self,
+        directory: Path,
+        prefix: str,
+        max_segment_bytes: int = 64 * 1024 * 1024,
+        max_segment_seconds: float = 3600.0,
+        retention_seconds: Optional[float] = 7 * 24 * 3600.0,
+        retention_bytes: Optional[int] = None,
+        index_every: int = 64 * 1024,
+    ):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.max_segment_bytes = max(max_segment_bytes, 1)
+        self.max_segment_seconds = max_segment_seconds
+        self.retention_seconds = retention_seconds
+        self.retention_bytes = retention_bytes
+        self.index_every = max(index_every, 1)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segments: List[_Segment] = []
+        self._active: Optional[_Segment] = None  # 本行程寫入中的分段
+        self._file = None
+        self._index_file = None
+        self._opened_at = 0.0
+        self._offset = 0
+        # 尚未寫入索引的範圍：(起始位元組, 最小時間, 最大時間)
+        self._pending: Optional[List[float]] = None
+        self.appended = 0
+        self.removed_segments = 0
+        self.write_errors = 0
+        # 所有改動檔案與分段清單的操作都在這個執行緒上執行，彼此不需加鎖
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"archive-{prefix}")
+        # 每次啟動都從新分段開始，舊分段未索引的尾段查詢時一律掃描
+        self._refresh()
+        self._enforce_retention()
+
+    def _refresh(self):
+        """重新列出目錄中的分段（包含其他行程建立的）"""
+        segments = []
+        for path in self.directory.glob(f"{self.prefix}-*.seg"):
+            if self._active is not None and path == self._active.path:
+                segments.append(self._active)
+            else:
+                segments.append(_Segment(path))
+        self._segments = sorted(segments, key=lambda s: s.number)
+
+    # ---- 寫入 ----
+
+    def append(self, block: bytes, min_t: float, max_t: Optional[float] = None):
+        """排入一個區塊，由寫入執行緒依序追加；min_t / max_t 為區塊內資料的時間範圍（Unix 秒）"""
+        if max_t is None:
+            max_t = min_t
+        self.appended += 1
+        self._writer.submit(self._write, block, min_t, max_t)
+
+    def _write(self, block: bytes, min_t: float, max_t: float):
+        try:
+            self._write_block(block, min_t, max_t)
+        except Exception as e:
+            self.write_errors += 1
+            logger.error(f"寫入封存 {self.prefix} 失敗: {e}")
+
+    def _write_block(self, block: bytes, min_t: float, max_t: float):
+        if self._file is None or self._should_rotate():
+            self._rotate()
+        self._file.write(block)
+        self._file.flush()
+        if self._pending is None:
+            self._pending = [self._offset, min_t, max_t]
+        else:
+            self._pending[1] = min(self._pending[1], min_t)
+            self._pending[2] = max(self._pending[2], max_t)
+        self._offset += len(block)
+        if self._offset - self._pending[0] >= self.index_every:
+            self._write_index()
+
+    def _should_rotate(self) -> bool:
+        return (
+            self._offset >= self.max_segment_bytes
+            or time.time() - self._opened_at >= self.max_segment_seconds
+        )
+
+    def _write_index(self):
+        if self._pending is None:
+            return
+        start, lo, hi = self._pending
+        entry = (int(start), self._offset, lo, hi)
+        self._index_file.write(INDEX_ENTRY.pack(*entry))
+        self._index_file.flush()
+        self._active.chunks.append(entry)
+        self._pending = None
+
+    def _rotate(self):
+        self._close_segment()
+        self._refresh()
+        number = self._segments[-1].number + 1 if self._segments else 1
+        while True:
+            path = self.directory / f"{self.prefix}-{number:06d}.seg"
+            try:
+                # 獨佔建立：其他行程同時換段時不會寫進同一個分段
+                self._file = open(path, "xb")
+                break
+            except FileExistsError:
+                number += 1
+        # 寫入中的分段持有共享鎖，保存期限清理以此判斷是否仍在使用
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_SH)
+        self._index_file = open(path.with_suffix(".idx"), "ab")
+        self._active = _Segment(path)
+        self._segments.append(self._active)
+        self._opened_at = time.time()
+        self._offset = 0
+        self._enforce_retention()
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._write_index()
+        for f in (self._file, self._index_file):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self._file = self._index_file = None
+        self._active = None
+
+    @staticmethod
+    def _in_use(segment: _Segment) -> bool:
+        """分段是否仍有行程（包含本行程）在寫入"""
+        try:
+            f = open(segment.path, "rb")
+        except FileNotFoundError:
+            return False
+        with f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            return False
+
+    def _enforce_retention(self):
+        """刪除超過保存期限或使總容量超過上限的舊分段（不刪除寫入中的分段）"""
+        now = time.time()
+        total = sum(s.size for s in self._segments)
+        for segment in list(self._segments):
+            if segment is self._active or self._in_use(segment):
+                continue
+            expired = False
+            if self.retention_seconds is not None:
+                try:
+                    expired = now - segment.path.stat().st_mtime > self.retention_seconds
+                except FileNotFoundError:
+                    expired = True
+            over = self.retention_bytes is not None and total > self.retention_bytes
+            if not (expired or over):
+                break
+            total -= segment.size
+            for path in (segment.path, segment.index_path):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            self._segments.remove(segment)
+            self.removed_segments += 1
+
+    def _flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def sync(self):
+        """等待已排入的寫入完成（讀取前呼叫，之後寫入執行緒閒置到下一次 append）"""
+        self._writer.submit(self._flush).result()
+
+    def close(self):
+        """寫完排入的區塊、關閉寫入中的分段並停止寫入執行緒"""
+        self._writer.submit(self._close_segment).result()
+        self._writer.shutdown(wait=True)
+
+    # ---- 讀取 ----
+
+    def scan(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> Iterator[Tuple[mmap.mmap, int, int]]:
+        """依序產生與 [start, end] 重疊的 (mmap, 起始位元組, 結束位元組)
+
+        範圍邊界一定落在區塊邊界上，但可能包含區間外的區塊，由讀取端依時間過濾。
+        mmap 只在下一次迭代前有效，讀取端需自行複製要保留的資料。
+        """
+        lo = float("-inf") if start is None else start
+        hi = float("inf") if end is None else end
+        self.sync()
+        self._refresh()
+        for segment in list(self._segments):
+            seg_lo, seg_hi = segment.bounds()
+            if seg_hi < lo or seg_lo > hi:
+                continue
+            ranges = segment.overlapping(lo, hi)
+            if not ranges:
+                continue
+            try:
+                f = open(segment.path, "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    continue
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for begin, finish in ranges:
+                        yield mm, begin, min(finish, size)
+                finally:
+                    try:
+                        mm.close()
+                    except BufferError:
+                        # 讀取端仍持有視圖時交給垃圾回收關閉
+                        pass
+
+    def size(self) -> int:
+        """已知分段的位元組總和；不等待排入的寫入，可在事件迴圈上呼叫（監控用）"""
+        return sum(s.size for s in list(self._segments))
+
+    def stats(self) -> Dict[str, Any]:
+        self.sync()
+        self._refresh()
+        return {
+            "segments": len(self._segments),
+            "bytes": sum(s.size for s in self._segments),
+            "appended": self.appended,
+            "removed_segments": self.removed_segments,
+            "write_errors": self.write_errors,
+        }
+
+
+class JsonLinesArchive(SegmentArchive):
+    """每行一筆 JSON 的封存，時間欄位為 `ts`（Unix 秒）"""
+
+    def append_record(self, record: Dict[str, Any], ts: float):
+        line = json.dumps({"ts": ts, **record}, ensure_ascii=False).encode("utf-8") + b"\n"
+        self.append(line, ts)
+
+    def query(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        lo = float("-inf") if start is None else start
+        hi = float("inf") if end is None else end
+        records: List[Dict[str, Any]] = []
+        for mm, pos, finish in self.scan(start, end):
+            while pos < finish:
+                newline = mm.find(b"\n", pos, finish)
+                if newline < 0:
+                    newline = finish
+                line = mm[pos:newline]
+                pos = newline + 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                ts = record.get("ts", lo)
+                if ts < lo or ts > hi:
+                    continue
+                records.append(record)
+                if limit is not None and len(records) >= limit:
+                    return records
+        return records
+
+    def tail(self, limit: int) -> List[Dict[str, Any]]:
+        """最近 limit 筆（由舊到新），從最新的分段由後往前讀"""
+        self.sync()
+        self._refresh()
+        records: List[Dict[str, Any]] = []
+        for segment in reversed(list(self._segments)):
+            if len(records) >= limit:
+                break
+            try:
+                f = open(segment.path, "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    end = len(mm)
+                    while end > 0 and len(records) < limit:
+                        start = mm.rfind(b"\n", 0, end - 1) + 1
+                        try:
+                            records.append(json.loads(mm[start:end]))
+                        except ValueError:
+                            pass
+                        end = start
+        records.reverse()
+        return records
@@ -1,12 +1,35 @@
+import asyncio
 import json
 import os
+import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, HTTPException, Request
+import numpy as np
+from fastapi import APIRouter, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 
+from app.services import metrics
+from app.services.cargo_store import CargoIngest, CargoStore, apply_ingest
+from app.services.dispatch_queue import LeaseError
+from app.services.inventory import Inventory
+from app.services.order_events import sse_response
+from app.services.order_lifecycle import STATES
+from app.services.order_store import OrderStore
+from app.services.response_cache import ResponseCache
+from app.services.segment_archive import JsonLinesArchive, SegmentArchive
+from app.services.spatial_index import CargoSpatialIndex
+from app.services.telemetry import (
+    FrameError,
+    TelemetryStore,
+    downsample,
+    heatmap,
+    summarize,
+    to_columns,
+)
+from app.services.warehouse_config import GRID
+
 router = APIRouter(prefix="/vue", tags=["vue"])
 
 
@@ -14,11 +37,122 @@ class VUEAckRequest(BaseModel):
     order_id: int
     status: str  # e.g. "received" | "in_progress" | "completed" | "failed"
     message: Optional[str] = None
+    lease: Optional[str] = None  # 由 /vue/dispatch/claim 領取時取得，帶上時會檢查租約仍屬於自己
+    lease_seconds: Optional[float] = None
+
+
+class DispatchClaimRequest(BaseModel):
+    agent: str
+    limit: int = 1
+    lease_seconds: Optional[float] = None
+    wait: float = 0  # 沒有可領取的訂單時最多等待的秒數（長輪詢）
+
+
+class DispatchReleaseRequest(BaseModel):
+    lease: str
+
+
+class InventoryCheckRequest(BaseModel):
+    items: List[int]
+    order_id: Optional[int] = None  # 已有訂單時略過其自身的保留
+
+
+# 確認與遙測的完整歷史寫入分段封存，記憶體只保留最近的尾端
+ARCHIVE_DIR = (
+    Path(os.getenv("APP_DATA_DIR", Path(__file__).parent.parent.parent / "data")) / "archive"
+)
+_archive_options = {
+    "max_segment_bytes": int(float(os.getenv("ARCHIVE_SEGMENT_MB", "64")) * 1024 * 1024),
+    "max_segment_seconds": float(os.getenv("ARCHIVE_SEGMENT_MINUTES", "60")) * 60,
+    "retention_seconds": float(os.getenv("ARCHIVE_RETENTION_DAYS", "7")) * 86400 or None,
+    "retention_bytes": int(float(os.getenv("ARCHIVE_MAX_MB", "0")) * 1024 * 1024) or None,
+}
+# 封存於路由的 startup 建立（列目錄、清理過期分段、讀取尾端），import 時不碰磁碟
+_ack_archive: Optional[JsonLinesArchive] = None
+_telemetry_log_archive: Optional[JsonLinesArchive] = None
+_sample_archive: Optional[SegmentArchive] = None
+
+
+def _recent(archive: JsonLinesArchive, limit: int = 500) -> List[Dict[str, Any]]:
+    """啟動時由封存還原最近的尾端（去掉封存用的 ts 欄位）"""
+    try:
+        records = archive.tail(limit)
+    except Exception as e:
+        print(f"讀取封存失敗: {e}")
+        return []
+    for record in records:
+        record.pop("ts", None)
+    return records
 
 
 _ack_history: List[Dict[str, Any]] = []
 _telemetry_history: List[Dict[str, Any]] = []
 
+# 每位玩家保留的遙測樣本數（預設 60 Hz × 10 分鐘）；封存於 open_archives 接上
+_telemetry = TelemetryStore(int(os.getenv("TELEMETRY_CAPACITY", "36000")))
+
+
+@router.on_event("startup")
+def open_archives():
+    """建立三個封存並由其還原最近的確認與遙測記錄（需在 main 重播確認之前）"""
+    global _ack_archive, _telemetry_log_archive, _sample_archive
+    if _ack_archive is not None:
+        return
+    _ack_archive = JsonLinesArchive(ARCHIVE_DIR, "acks", **_archive_options)
+    _telemetry_log_archive = JsonLinesArchive(ARCHIVE_DIR, "telemetry", **_archive_options)
+    _sample_archive = SegmentArchive(ARCHIVE_DIR, "samples", **_archive_options)
+    _ack_history[:] = _recent(_ack_archive)
+    _telemetry_history[:] = _recent(_telemetry_log_archive)
+    _telemetry.archive = _sample_archive
+
+
+TELEMETRY_INGEST_SECONDS = metrics.Histogram(
+    "telemetry_ingest_duration_seconds", "二進位遙測解碼、寫入環狀緩衝區與封存的時間", ("transport",)
+)
+metrics.Counter("telemetry_samples_total", "已寫入的遙測樣本數", callback=lambda: _telemetry.samples)
+metrics.Counter("telemetry_frames_total", "已寫入的遙測 frame 數", callback=lambda: _telemetry.frames)
+metrics.Gauge("telemetry_players", "有遙測資料的玩家數", callback=lambda: len(_telemetry.players()))
+metrics.Gauge(
+    "archive_bytes", "各封存目前佔用的位元組", ("archive",),
+    callback=lambda: {
+        name: archive.size()
+        for name, archive in (
+            ("acks", _ack_archive), ("telemetry", _telemetry_log_archive), ("samples", _sample_archive)
+        )
+        if archive is not None
+    },
+)
+metrics.Gauge("cargo_items", "貨物數", callback=lambda: len(_cargo_db))
+
+# 輪詢端點（/orders、/order/latest、/cargo）的回應快取；超過 VUE_GZIP_MIN_BYTES 的 body 可 gzip，0 表示不壓縮
+_responses = ResponseCache(gzip_min_bytes=int(os.getenv("VUE_GZIP_MIN_BYTES", "1024")))
+metrics.Counter(
+    "vue_response_cache_total", "輪詢端點的回應快取結果", ("result",),
+    callback=lambda: {
+        "hit": _responses.hits,
+        "miss": _responses.misses,
+        "not_modified": _responses.not_modified,
+        "gzipped": _responses.gzipped,
+    },
+)
+
+
+def _ingest_telemetry(buffer: bytes, transport: str) -> int:
+    started = time.perf_counter()
+    stored = _telemetry.ingest(buffer)
+    TELEMETRY_INGEST_SECONDS.labels(transport).observe(time.perf_counter() - started)
+    return stored
+
+
+@router.on_event("shutdown")
+def close_archives():
+    global _ack_archive, _telemetry_log_archive, _sample_archive
+    for archive in (_ack_archive, _telemetry_log_archive, _sample_archive):
+        if archive is not None:
+            archive.close()
+    _telemetry.archive = None
+    _ack_archive = _telemetry_log_archive = _sample_archive = None
+
 
 # 貨物數據模型
 class Cargo(BaseModel):
@@ -29,33 +163,73 @@ class Cargo(BaseModel):
 
 
 # 貨物路徑
-CARGO_DATA_FILE = Path(__file__).parent.parent.parent / "data" / "cargo_data.json"
-
-# 貨物數據庫
-_cargo_db: List[Dict[str, Any]] = []
+CARGO_DATA_FILE = (
+    Path(os.getenv("APP_DATA_DIR", Path(__file__).parent.parent.parent / "data"))
+    / "cargo_data.json"
+)
+
+# 貨物數據庫（依 id 索引）與分批上傳 session
+_cargo_db = CargoStore(CARGO_DATA_FILE)
+_cargo_ingest = CargoIngest()
+
+# 貨物空間索引，隨貨物變更逐筆更新
+_cargo_index = CargoSpatialIndex(GRID)
+_cargo_db.add_listener(_cargo_index.on_cargo_change)
+
+# 庫存佔用（依空間索引的位置重建，須在其後註冊）；揀貨完成時移除箱子，新增訂單時據此驗證
+inventory = Inventory(GRID, lambda: _cargo_db, _cargo_index.cell_of)
+_cargo_db.add_listener(inventory.on_cargo_change)
+metrics.Gauge(
+    "inventory_boxes", "庫存箱數", ("state",),
+    callback=lambda: {"in_stock": inventory.stats()["in_stock"], "reserved": inventory.stats()["reserved"]},
+)
+
+
+def locate_box(box_id: int) -> Optional[Tuple[int, int, int]]:
+    """箱子目前所在的 (x, z, 層)；不在庫（已揀走或貨物資料中沒有）時回傳 None"""
+    x, z, level = inventory.locate_many([box_id])[0].tolist()
+    return None if x < 0 else (x, z, level)
+
+
+def column_height(x: int, z: int) -> int:
+    """(x, z) 的堆疊高度；沒有貨物資料時依預設配置"""
+    return inventory.column_height(x, z)
+
+
+def cargo_record(box_id: int, cell: Tuple[int, int, int], timestamp: str) -> Dict[str, Any]:
+    """箱子放到 cell 時的貨物記錄（POST /vue/cargo 的格式），沿用原記錄的尺寸與其他欄位
+
+    沒有貨物資料可校準座標時以單位尺寸的箱子排列，上傳後空間索引依此重新校準。
+    """
+    cargo_id = f"case {box_id}"
+    record = dict(_cargo_db.get(cargo_id) or {"id": cargo_id, "size": {"x": 1.0, "y": 1.0, "z": 1.0}})
+    x, z, level = cell
+    if _cargo_index.origin is not None:
+        px, py, pz = _cargo_index.cell_center(x, z, level)
+    else:
+        size = record["size"]
+        sx, sy, sz = (
+            abs(float(size[axis])) * (1 + ratio) for axis, ratio in zip("xyz", GRID.spacing_ratio)
+        )
+        px, py, pz = x * sx, level * sy, z * sz
+    record["position"] = {"x": round(px, 4), "y": round(py, 4), "z": round(pz, 4)}
+    record["timestamp"] = timestamp
+    return record
 
 
 # 加載貨物數據
 def load_cargo_data():
-    global _cargo_db
     try:
-        if CARGO_DATA_FILE.exists():
-            with open(CARGO_DATA_FILE, "r", encoding="utf-8") as f:
-                _cargo_db = json.load(f)
-        else:
-            _cargo_db = []
+        _cargo_db.load()
     except Exception as e:
         print(f"加載貨物數據失敗: {e}")
-        _cargo_db = []
+        _cargo_db.clear()
 
 
 # 保存貨物數據
 def save_cargo_data():
     try:
-        # 確認目錄是否存在
-        CARGO_DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with open(CARGO_DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(_cargo_db, f, ensure_ascii=False, indent=2)
+        _cargo_db.save()
     except Exception as e:
         print(f"保存貨物數據失敗: {e}")
         raise
@@ -65,9 +239,65 @@ def save_cargo_data():
 load_cargo_data()
 
 
+def _shared(request: Request):
+    """多 worker 共用狀態（STATE_BACKEND=sqlite），單一行程時為 None"""
+    return getattr(request.app.state, "shared", None)
+
+
+def _publish(request: Request, message: Dict[str, Any]):
+    """通知其他 worker（單一行程時不做事）"""
+    publish = getattr(request.app.state, "publish", None)
+    if publish is not None:
+        publish(message)
+
+
+def _ingest(request: Request):
+    shared = _shared(request)
+    return _cargo_ingest if shared is None else shared.cargo_ingest
+
+
+def _mutate_cargo(request: Request, mutate: Callable[[], Any]) -> Any:
+    """套用貨物變更並寫檔；多 worker 時在跨行程鎖內先重新載入最新檔案，寫檔後通知其他 worker 重新載入"""
+    shared = _shared(request)
+    if shared is None:
+        result = mutate()
+        save_cargo_data()
+        return result
+    with shared.cargo_lock():
+        load_cargo_data()
+        result = mutate()
+        save_cargo_data()
+    _publish(request, {"kind": "cargo"})
+    return result
+
+
+# 貨物變更事件最多列出的 id 數；超過時 ids 為 None，客戶端改為重新讀取 /vue/cargo
+CARGO_EVENT_MAX_IDS = 500
+
+
+async def _broadcast_cargo(request: Request, message_type: str, ids: Optional[List[str]] = None, **extra: Any):
+    """廣播貨物變更（cargo 主題，/ws 與 /vue/events 都收得到；多 worker 時由 broadcast 轉送）"""
+    broadcast = getattr(request.app.state, "broadcast", None)
+    if broadcast is None:
+        return
+    message = {"type": message_type, "total": len(_cargo_db), **extra}
+    if ids is not None:
+        message["count"] = len(ids)
+        message["ids"] = ids if len(ids) <= CARGO_EVENT_MAX_IDS else None
+    message["timestamp"] = datetime.now(timezone.utc).isoformat()
+    await broadcast(message)
+
+
+def _orders(request: Request) -> OrderStore:
+    """取得主程式共用的訂單儲存（尚未掛載時回傳空的儲存）"""
+    orders_db = getattr(request.app.state, "orders_db", None)
+    # 空的 OrderStore 為 falsy，需以 None 判斷
+    return OrderStore() if orders_db is None else orders_db
+
+
 @router.get("/ping")
 async def Vue_ping(request: Request):
-    orders_db = getattr(request.app.state, "orders_db", [])
+    orders_db = _orders(request)
     return {
         "status": "ok",
         "server_time": datetime.now(timezone.utc).isoformat(),
@@ -75,49 +305,203 @@ async def Vue_ping(request: Request):
     }
 
 
+def _brief(order: Dict[str, Any]) -> Dict[str, Any]:
+    # 回傳精簡結構，方便 VaRest 解析
+    return {
+        "id": order.get("id"),
+        "content": order.get("content", ""),
+        "items": order.get("items"),
+        "timestamp": order.get("timestamp"),
+    }
+
+
 @router.get("/orders")
 async def Vue_list_orders(request: Request, limit: int = 20):
-    orders_db = getattr(request.app.state, "orders_db", [])
-    recent = orders_db[-limit:]
-    # 回傳精簡結構，方便 VaRest 解析
-    result = [
-        {
-            "id": o.get("id"),
-            "content": o.get("content", ""),
-            "items": o.get("items"),
-            "timestamp": o.get("timestamp"),
-        }
-        for o in recent
-    ]
-    return {"orders": result, "total": len(orders_db)}
+    orders_db = _orders(request)
+    return _responses.respond(
+        request, ("orders", limit), orders_db.version,
+        lambda: {"orders": [_brief(o) for o in orders_db.tail(limit)], "total": len(orders_db)},
+    )
 
 
 @router.get("/order/latest")
 async def Vue_latest_order(request: Request):
-    orders_db = getattr(request.app.state, "orders_db", [])
-    if not orders_db:
+    orders_db = _orders(request)
+    latest = orders_db.latest()
+    if latest is None:
         raise HTTPException(status_code=404, detail="No orders")
-    latest = orders_db[-1]
-    return {
-        "id": latest.get("id"),
-        "content": latest.get("content", ""),
-        "items": latest.get("items"),
-        "timestamp": latest.get("timestamp"),
-    }
+    return _responses.respond(request, ("order_latest",), orders_db.version, lambda: _brief(latest))
+
+
+# 長輪詢最多等待的秒數
+LONG_POLL_MAX_SECONDS = float(os.getenv("VUE_LONG_POLL_MAX_SECONDS", "60"))
+
+
+@router.get("/order/next")
+async def Vue_next_order(request: Request, after: int = 0, timeout: float = 30):
+    """長輪詢：回傳 id 大於 after 的最舊一筆訂單，沒有時等到新訂單加入或逾時（204）
+
+    pending 為連同這筆在內尚未取走的訂單數，UE 可據此決定是否立刻再取下一筆。
+    """
+    orders_db = _orders(request)
+    waiters = getattr(request.app.state, "order_waiters", None)
+    deadline = time.monotonic() + min(max(timeout, 0.0), LONG_POLL_MAX_SECONDS)
+    while True:
+        order, pending = orders_db.next_after(after)
+        if order is not None:
+            return {**_brief(order), "pending": pending}
+        remaining = deadline - time.monotonic()
+        if waiters is None or remaining <= 0 or not await waiters.wait(remaining):
+            return Response(status_code=204)
+
+
+@router.get("/events")
+async def Vue_events(
+    request: Request,
+    topics: str = "orders,cargo",
+    cars: Optional[str] = None,
+    zones: Optional[str] = None,
+):
+    """Server-Sent Events：與 /ws 相同的廣播，每則事件的 data 為一則 JSON 訊息（預設只訂閱訂單與貨物）"""
+    registry = getattr(request.app.state, "registry", None)
+    hub = getattr(request.app.state, "hub", None)
+    if registry is None or hub is None:
+        raise HTTPException(status_code=503, detail="Event stream unavailable")
+    try:
+        return sse_response(request, registry, hub, topics, cars, zones)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/ack")
-async def Vue_acknowledge(payload: VUEAckRequest):
+async def Vue_acknowledge(payload: VUEAckRequest, request: Request):
+    now = datetime.now(timezone.utc)
     record = {
         "order_id": payload.order_id,
         "status": payload.status,
         "message": payload.message,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": now.isoformat(),
+    }
+    # 先更新派工租約：帶了租約但已過期或被其他代理領走時拒絕，避免重複揀貨的結果蓋掉對方
+    dispatch = getattr(request.app.state, "dispatch", None)
+    lease_expires_at = None
+    if dispatch is not None:
+        try:
+            lease_expires_at = dispatch.acknowledge(
+                payload.order_id, payload.status, payload.lease, payload.lease_seconds, now.timestamp()
+            )
+        except LeaseError:
+            raise HTTPException(status_code=409, detail="Lease expired or held by another agent")
+    _ack_archive.append_record(record, now.timestamp())
+    _remember_ack(record)
+    # 推進訂單生命週期；未知狀態或訂單只記錄確認，不影響回應
+    lifecycle = getattr(request.app.state, "lifecycle", None)
+    state = None
+    ack = {**record, "ts": now.timestamp()}
+    if lifecycle is not None:
+        _, state = apply_ack(lifecycle, ack, _orders(request))
+    # 其他 worker 的生命週期也要跟著推進
+    _publish(request, {"kind": "ack", "ack": ack})
+    return {"ok": True, "state": state, "lease_expires_at": lease_expires_at}
+
+
+def _dispatch(request: Request):
+    dispatch = getattr(request.app.state, "dispatch", None)
+    if dispatch is None:
+        raise HTTPException(status_code=503, detail="Dispatch queue unavailable")
+    return dispatch
+
+
+@router.post("/dispatch/claim")
+async def Vue_dispatch_claim(payload: DispatchClaimRequest, request: Request):
+    """領取最多 limit 筆待派訂單（優先度高、較早到達者先），每筆附租約；租約內以 /vue/ack 回報進度"""
+    dispatch = _dispatch(request)
+    limit = min(max(payload.limit, 1), 100)
+    waiters = getattr(request.app.state, "order_waiters", None)
+    deadline = time.monotonic() + min(max(payload.wait, 0.0), LONG_POLL_MAX_SECONDS)
+    while True:
+        claimed = dispatch.claim(payload.agent, limit, payload.lease_seconds)
+        remaining = deadline - time.monotonic()
+        if claimed or waiters is None or remaining <= 0:
+            break
+        # 新訂單與放棄的租約會通知等待者；租約到期沒有通知，最多等到下一個租約到期再領一次
+        expires_at = dispatch.next_expiry()
+        if expires_at is not None:
+            remaining = min(remaining, max(expires_at - time.time(), 0.01))
+        await waiters.wait(remaining)
+    return {
+        "agent": payload.agent,
+        "orders": [
+            {**_brief(c["order"]), "lease": c["lease"], "expires_at": c["expires_at"], "deliveries": c["deliveries"]}
+            for c in claimed
+        ],
     }
+
+
+@router.post("/dispatch/{order_id}/release")
+async def Vue_dispatch_release(order_id: int, payload: DispatchReleaseRequest, request: Request):
+    """放棄租約，訂單立即回到佇列給其他代理"""
+    if not _dispatch(request).release(order_id, payload.lease):
+        raise HTTPException(status_code=409, detail="Lease expired or held by another agent")
+    # 喚醒正在長輪詢領取的代理（其他 worker 收到後各自喚醒）
+    waiters = getattr(request.app.state, "order_waiters", None)
+    if waiters is not None:
+        waiters.notify()
+    _publish(request, {"kind": "released", "order_id": order_id})
+    return {"order_id": order_id, "released": True}
+
+
+@router.get("/dispatch")
+async def Vue_dispatch_stats(request: Request):
+    """待派與租約中的訂單數及租約事件統計"""
+    return _dispatch(request).stats()
+
+
+def _remember_ack(record: Dict[str, Any]):
     _ack_history.append(record)
     if len(_ack_history) > 1000:
         del _ack_history[:-500]
-    return {"ok": True}
+
+
+def receive_peer_ack(
+    lifecycle, ack: Dict[str, Any], orders_db: Optional[OrderStore] = None
+) -> Tuple[bool, Optional[str]]:
+    """其他 worker 收到的確認：加入最近記錄並推進本行程的訂單狀態（封存已由對方寫入）"""
+    _remember_ack({k: v for k, v in ack.items() if k != "ts"})
+    return apply_ack(lifecycle, ack, orders_db)
+
+
+def apply_ack(
+    lifecycle, ack: Dict[str, Any], orders_db: Optional[OrderStore] = None
+) -> Tuple[bool, Optional[str]]:
+    """以一筆確認記錄（含 ts）推進訂單狀態
+
+    給了 orders_db 時一併更新庫存：completed 移除訂單的箱子，failed 取消保留。
+    啟動重播不給，庫存以 cargo_data.json 為準。
+    """
+    if ack.get("status") not in STATES:
+        return False, None
+    order_id = ack.get("order_id")
+    ok, state = lifecycle.transition(order_id, ack["status"], ack.get("ts"), ack.get("message"))
+    if ok and orders_db is not None:
+        order = orders_db.get(order_id)
+        if state == "completed" and order is not None:
+            inventory.consume(order_id, order.get("items") or [])
+        elif state == "failed":
+            inventory.release(order_id)
+    return ok, state
+
+
+def replay_acks(lifecycle) -> int:
+    """啟動時依封存的確認記錄重建訂單狀態，只讀取最早一筆未完成訂單之後的記錄"""
+    start = lifecycle.oldest_open()
+    if start is None:
+        return 0
+    applied = 0
+    for ack in _ack_archive.query(start=start):
+        ok, _ = apply_ack(lifecycle, ack)
+        applied += ok
+    return applied
 
 
 class VUETelemetry(BaseModel):
@@ -127,17 +511,61 @@ class VUETelemetry(BaseModel):
 
 @router.post("/telemetry")
 async def Vue_telemetry(payload: VUETelemetry):
+    now = datetime.now(timezone.utc)
     record = {
         "player_id": payload.player_id,
         "data": payload.data,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": now.isoformat(),
     }
+    _telemetry_log_archive.append_record(record, now.timestamp())
     _telemetry_history.append(record)
     if len(_telemetry_history) > 1000:
         del _telemetry_history[:-500]
+    # 含位置的 PlayerData 同時寫入環狀緩衝區，與二進位上傳共用查詢
+    if isinstance(payload.data.get("position"), dict):
+        _telemetry.ingest_player_data(payload.player_id or "default", payload.data, now.timestamp())
     return {"ok": True}
 
 
+@router.post("/telemetry/batch")
+async def Vue_telemetry_batch(request: Request):
+    """二進位批次上傳（格式見 app/services/telemetry.py），可串接多個 frame"""
+    try:
+        stored = _ingest_telemetry(await request.body(), "http")
+    except FrameError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, "samples": stored}
+
+
+@router.websocket("/telemetry/stream")
+async def Vue_telemetry_stream(websocket: WebSocket):
+    """二進位遙測串流：每則 binary 訊息為一或多個 frame，不逐筆回覆
+
+    文字訊息 {"type": "stats"} 可查詢目前寫入的樣本數。
+    """
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                try:
+                    _ingest_telemetry(message["bytes"], "ws")
+                except FrameError as e:
+                    await websocket.send_json({"type": "error", "message": str(e)})
+            elif message.get("text") is not None:
+                try:
+                    request = json.loads(message["text"])
+                except json.JSONDecodeError:
+                    await websocket.send_json({"type": "error", "message": "Invalid JSON"})
+                    continue
+                if request.get("type") == "stats":
+                    await websocket.send_json({"type": "telemetry_stats", **_telemetry.stats()})
+    except WebSocketDisconnect:
+        pass
+
+
 @router.get("/acks")
 async def Vue_list_acks(limit: int = 100):
     return {"acks": _ack_history[-limit:]}
@@ -148,55 +576,299 @@ async def Vue_list_telemetry(limit: int = 100):
     return {"telemetry": _telemetry_history[-limit:]}
 
 
+@router.get("/acks/history")
+async def Vue_ack_history(
+    start: Optional[float] = None, end: Optional[float] = None, limit: int = 1000
+):
+    """封存中時間區間（Unix 秒）內的確認記錄，由舊到新"""
+    # 讀取前需等待寫入執行緒排空，交給工作執行緒避免卡住事件迴圈
+    acks = await asyncio.to_thread(_ack_archive.query, start, end, limit)
+    return {"acks": acks, "count": len(acks)}
+
+
+@router.get("/telemetry/history")
+async def Vue_telemetry_history(
+    start: Optional[float] = None, end: Optional[float] = None, limit: int = 1000
+):
+    """封存中時間區間內以 JSON 上傳的遙測記錄，由舊到新"""
+    telemetry = await asyncio.to_thread(_telemetry_log_archive.query, start, end, limit)
+    return {"telemetry": telemetry, "count": len(telemetry)}
+
+
+def _archive_stats() -> Dict[str, Any]:
+    return {
+        "acks": _ack_archive.stats(),
+        "telemetry": _telemetry_log_archive.stats(),
+        "samples": _sample_archive.stats(),
+    }
+
+
+@router.get("/archive")
+async def Vue_archive_stats():
+    return await asyncio.to_thread(_archive_stats)
+
+
+@router.get("/telemetry/players")
+async def Vue_telemetry_players():
+    return {
+        "players": {p: _telemetry.get(p).stats() for p in _telemetry.players()},
+        **_telemetry.stats(),
+    }
+
+
+def _player_list(players: Optional[str]) -> Optional[List[str]]:
+    return [p for p in players.split(",") if p] if players else None
+
+
+@router.get("/telemetry/summary")
+async def Vue_telemetry_summary(
+    start: Optional[float] = None, end: Optional[float] = None, players: Optional[str] = None
+):
+    """各玩家在時間窗內的最後姿態、平均速度與移動距離"""
+    window = _telemetry.window(_player_list(players), start, end)
+    return {"players": {p: summarize(samples) for p, samples in window.items()}}
+
+
+@router.get("/telemetry/heatmap")
+async def Vue_telemetry_heatmap(
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    players: Optional[str] = None,
+    weight: str = "samples",
+    origin_x: Optional[float] = None,
+    origin_z: Optional[float] = None,
+    cell_x: Optional[float] = None,
+    cell_z: Optional[float] = None,
+):
+    """時間窗內位置落在各格位 (x, z) 的樣本數或停留秒數，cells[x][z]
+
+    格位原點與間距預設取自貨物空間索引，貨物資料尚未載入時需自行指定。
+    """
+    origin, step = _cargo_index.origin, _cargo_index.step
+    origin = (
+        origin_x if origin_x is not None else (origin[0] if origin else 0.0),
+        origin_z if origin_z is not None else (origin[2] if origin else 0.0),
+    )
+    step = (
+        cell_x if cell_x is not None else (step[0] if step else 1.0),
+        cell_z if cell_z is not None else (step[2] if step else 1.0),
+    )
+    if step[0] <= 0 or step[1] <= 0:
+        raise HTTPException(status_code=400, detail="Cell size must be positive")
+    window = _telemetry.window(_player_list(players), start, end)
+    if weight not in ("samples", "seconds"):
+        raise HTTPException(status_code=400, detail=f"Unknown weight: {weight}")
+    cells = np.zeros((GRID.width, GRID.depth))
+    for samples in window.values():
+        cells += heatmap(samples, origin, step, GRID.width, GRID.depth, weight)
+    return {
+        "width": GRID.width,
+        "depth": GRID.depth,
+        "origin": {"x": origin[0], "z": origin[1]},
+        "cell": {"x": step[0], "z": step[1]},
+        "weight": weight,
+        "players": list(window),
+        "cells": cells.tolist(),
+    }
+
+
+@router.get("/telemetry/{player_id}/history")
+async def Vue_telemetry_archived_series(
+    player_id: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    max_points: Optional[int] = None,
+    method: str = "stride",
+    field: str = "speed",
+    format: str = "json",
+):
+    """與 /telemetry/{player_id} 相同，但從封存讀取，可查詢超出環狀緩衝區的時間"""
+
+    def read() -> np.ndarray:
+        return downsample(_telemetry.history(player_id, start, end), max_points, method, field)
+
+    try:
+        samples = await asyncio.to_thread(read)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format == "binary":
+        return Response(content=samples.tobytes(), media_type="application/octet-stream")
+    return {"player_id": player_id, "count": len(samples), "series": to_columns(samples)}
+
+
+@router.get("/telemetry/{player_id}")
+async def Vue_telemetry_series(
+    player_id: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    max_points: Optional[int] = None,
+    method: str = "stride",
+    field: str = "speed",
+    format: str = "json",
+):
+    """時間區間內的樣本，可降採樣到 max_points 筆
+
+    method: stride 等間隔、minmax 每區段保留 field 的最小/最大值、lttb 以 field 保留形狀。
+    format=binary 回傳原始 SAMPLE_DTYPE 陣列。
+    """
+    try:
+        samples = _telemetry.query(player_id, start, end, max_points, method, field)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if samples is None:
+        raise HTTPException(status_code=404, detail="Player not found")
+    if format == "binary":
+        return Response(content=samples.tobytes(), media_type="application/octet-stream")
+    return {"player_id": player_id, "count": len(samples), "series": to_columns(samples)}
+
+
 # 貨物網路功能
 @router.post("/cargo")
-async def receive_cargo_data(cargo_data: List[Cargo]):
+async def receive_cargo_data(cargo_data: List[Cargo], request: Request):
     """接收並儲存（替換現有數據）"""
-    global _cargo_db
     try:
-        # 清空現有數據，用新數據替換
-        _cargo_db = []
-        
-        # 将货物数据转换为字典格式
-        for cargo in cargo_data:
-            cargo_dict = cargo.dict()
-            _cargo_db.append(cargo_dict)
-
-        # 保存到 JSON 文件
-        save_cargo_data()
+        # 取代後保存到 JSON 文件
+        _mutate_cargo(request, lambda: _cargo_db.replace_all(cargo.dict() for cargo in cargo_data))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"貨物儲存時出錯: {str(e)}")
+    await _broadcast_cargo(request, "cargo_updated", [cargo.id for cargo in cargo_data], mode="replace")
+    return {
+        "message": "貨物已儲存",
+        "total_cargo": len(_cargo_db),
+        "saved_count": len(cargo_data),
+    }
+
+
+@router.post("/cargo/ingest")
+async def begin_cargo_ingest(request: Request, mode: str = "replace"):
+    """開啟分批上傳 session（mode=replace 取代全部、merge 依 id 合併）"""
+    try:
+        session_id = _ingest(request).begin(mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"session_id": session_id, "mode": mode}
 
-        return {
-            "message": "貨物已儲存",
-            "total_cargo": len(_cargo_db),
-            "saved_count": len(cargo_data),
-        }
+
+@router.post("/cargo/ingest/{session_id}")
+async def append_cargo_chunk(session_id: str, cargo_data: List[Cargo], request: Request):
+    """將一批貨物暫存到 session（依 id upsert，不寫檔）"""
+    try:
+        result = _ingest(request).append(session_id, (cargo.dict() for cargo in cargo_data))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Ingest session not found")
+    return {"session_id": session_id, **result}
+
+
+@router.post("/cargo/ingest/{session_id}/commit")
+async def commit_cargo_ingest(session_id: str, request: Request):
+    """套用 session 內的所有貨物並寫檔一次"""
+    try:
+        mode, staged = _ingest(request).take(session_id)
+        saved_count = _mutate_cargo(request, lambda: apply_ingest(_cargo_db, mode, staged))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Ingest session not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"貨物儲存時出錯: {str(e)}")
+    await _broadcast_cargo(request, "cargo_updated", [cargo["id"] for cargo in staged], mode=mode)
+    return {
+        "message": "貨物已儲存",
+        "total_cargo": len(_cargo_db),
+        "saved_count": saved_count,
+    }
+
+
+@router.delete("/cargo/ingest/{session_id}")
+async def abort_cargo_ingest(session_id: str, request: Request):
+    """放棄 session 內尚未套用的貨物"""
+    if not _ingest(request).abort(session_id):
+        raise HTTPException(status_code=404, detail="Ingest session not found")
+    return {"session_id": session_id, "aborted": True}
 
 
 @router.get("/cargo")
-async def get_cargo_data(limit: int = 100):
+async def get_cargo_data(request: Request, limit: int = 100):
     """獲取貨物資訊"""
-    return {"cargo": _cargo_db[-limit:], "total": len(_cargo_db)}
+    return _responses.respond(
+        request, ("cargo", limit), _cargo_db.version,
+        lambda: {"cargo": _cargo_db.tail(limit), "total": len(_cargo_db)},
+    )
+
+
+@router.get("/cargo/region")
+async def get_cargo_in_region(
+    min_x: float, min_y: float, min_z: float, max_x: float, max_y: float, max_z: float
+):
+    """查詢與包圍盒相交的貨物"""
+    cargo = _cargo_index.region((min_x, min_y, min_z), (max_x, max_y, max_z))
+    return {"cargo": cargo, "count": len(cargo)}
+
+
+@router.get("/cargo/cell")
+async def get_cargo_at_cell(x: int, z: int, level: int):
+    """查詢格位 (x, z, 層) 上的貨物"""
+    cargo = _cargo_index.at_cell(x, z, level)
+    if not cargo:
+        raise HTTPException(status_code=404, detail="No cargo at cell")
+    return {"cell": {"x": x, "z": z, "level": level}, "cargo": cargo}
+
+
+@router.get("/cargo/nearest")
+async def get_nearest_cargo(x: float, y: float, z: float, k: int = 5):
+    """查詢距離某點最近的 k 個貨物"""
+    cargo = _cargo_index.nearest((x, y, z), k)
+    return {"cargo": cargo, "count": len(cargo)}
+
+
+@router.get("/cargo/column")
+async def get_cargo_column(x: int, z: int):
+    """查詢 (x, z) 整柱堆疊，由下而上"""
+    cargo = _cargo_index.column(x, z)
+    return {"column": {"x": x, "z": z}, "cargo": cargo, "height": len(cargo)}
 
 
 @router.get("/cargo/latest")
 async def get_latest_cargo():
     """獲取貨物最新資訊"""
-    if not _cargo_db:
+    latest = _cargo_db.latest()
+    if latest is None:
         raise HTTPException(status_code=404, detail="No cargo data")
-    return _cargo_db[-1]
+    return latest
 
 
 @router.delete("/cargo")
-async def clear_cargo_data():
+async def clear_cargo_data(request: Request):
     """清空貨物數據"""
-    global _cargo_db
-    _cargo_db = []
-    save_cargo_data()
+    _mutate_cargo(request, _cargo_db.clear)
+    await _broadcast_cargo(request, "cargo_cleared")
     return {"message": "貨物數據已清空", "total_cargo": 0}
 
 
+def _item_list(items: str) -> List[int]:
+    try:
+        return [int(part) for part in items.replace("-", ",").split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="items must be integers separated by ',' or '-'")
+
+
+@router.get("/inventory")
+async def get_inventory_stats():
+    """庫存格位佔用與保留數"""
+    return inventory.stats()
+
+
+@router.post("/inventory/check")
+async def check_inventory(payload: InventoryCheckRequest):
+    """一次檢查一組箱子：編號是否有效、是否在庫、是否已被其他訂單保留，以及哪些被壓住"""
+    result = inventory.validate(payload.items, payload.order_id)
+    return {**result, **inventory.buried(payload.items)}
+
+
+@router.get("/inventory/buried")
+async def get_buried_boxes(items: str):
+    """items=12,34,56：被其他箱子壓住的箱子、需先移開的箱子與挖箱次數"""
+    return inventory.buried(_item_list(items))
+
+
 """
 GET /vue/ping - 測試連線
 { "status": "ok", "server_time": "2025-11-06T13:30:00Z", "total_orders": 3 }
@@ -209,8 +881,21 @@ GET /vue/orders?limit=20 - 取得最近20筆訂單
     }
 GET /vue/order/latest - 取得最新訂單
     { "id": 3, "content": "12-34-56", "items": [12,34,56], "timestamp": "..." }
-POST /vue/ack - 確認訂單
-    { "ok": true }
+    以上兩者附 ETag，帶 If-None-Match 且資料未變時回 304
+GET /vue/order/next?after=3&timeout=30 - 長輪詢：id 大於 after 的最舊訂單，沒有則等到新訂單或逾時（204）
+    { "id": 4, "content": "12-34-56", "items": [12,34,56], "timestamp": "...", "pending": 1 }
+GET /vue/events?topics=orders,cargo&cars= - Server-Sent Events，每則 data 與 /ws 廣播相同
+    data: {"type": "new_order", "order": {...}, "seq": 12}
+POST /vue/ack - 確認訂單，status 為 received / in_progress / completed / failed 時推進訂單狀態
+    可帶 lease（派工租約）：received / in_progress 延長租約，completed / failed 結束；租約已失效時回 409
+    { "ok": true, "state": "received", "lease_expires_at": 1762435830.0 }
+
+派工佇列（多個代理同時揀貨，同一筆訂單同時只派給一個代理）:
+POST /vue/dispatch/claim - { "agent": "ue-1", "limit": 5, "lease_seconds": 30, "wait": 10 }
+    { "agent": "ue-1", "orders": [{"id": 4, "content": "...", "items": [...], "timestamp": "...",
+                                   "lease": "…", "expires_at": 1762435830.0, "deliveries": 1}] }
+POST /vue/dispatch/{order_id}/release - { "lease": "…" } 放棄租約，訂單回到佇列
+GET /vue/dispatch - { "pending": 12, "leased": 5, "claimed": 40, "completed": 23, "expired": 2, "released": 0 }
 POST /vue/telemetry - 發送玩家位置和動作資料
     { "ok": true }
 GET /vue/acks - 取得確認記錄
@@ -218,6 +903,26 @@ GET /vue/acks - 取得確認記錄
 GET /vue/telemetry - 取得玩家位置和動作資料
     { "telemetry": [{"player_id": "player1", "data": {"x": 100, "y": 200}, "timestamp": "..."}, ...] }
 
+封存歷史（data/archive 下的分段檔，start/end 為 Unix 秒）:
+GET /vue/acks/history?start=&end=&limit=1000 - 確認記錄
+    { "acks": [{"ts": 1762435800.0, "order_id": 3, "status": "received", ...}], "count": 1 }
+GET /vue/telemetry/history?start=&end=&limit=1000 - JSON 上傳的遙測記錄
+GET /vue/archive - 各封存的分段數與容量
+
+高頻遙測（二進位 frame，格式見 app/services/telemetry.py）:
+WS   /vue/telemetry/stream - 持續送出 binary frame
+POST /vue/telemetry/batch - body 為一或多個 frame
+    { "ok": true, "samples": 600 }
+GET /vue/telemetry/players - 各玩家緩衝區狀態
+GET /vue/telemetry/{player_id}?start=&end=&max_points=&method=stride|minmax|lttb&field=speed&format=json|binary
+    時間區間（Unix 秒），可降採樣；minmax / lttb 依 field（speed 或任一欄位）選點
+    { "player_id": "p1", "count": 2, "series": {"t": [...], "px": [...], ..., "vz": [...]} }
+GET /vue/telemetry/{player_id}/history?... - 同上，但從封存讀取（不受 TELEMETRY_CAPACITY 限制）
+GET /vue/telemetry/summary?start=&end=&players=p1,p2 - 最後姿態、平均/最大速度、移動距離
+    { "players": {"p1": {"samples": 3600, "duration": 60.0, "distance": 12.5, "avg_speed": 0.2, "last_pose": {...}}} }
+GET /vue/telemetry/heatmap?start=&end=&players=&weight=samples|seconds - 各格位的樣本數或停留秒數
+    { "width": 5, "depth": 10, "cells": [[...], ...] }
+
 獲取貨物最新資訊:
 POST /vue/cargo - 接收貨物數據
     { "message": "貨物已儲存", "total_cargo": 250, "saved_count": 250 }
@@ -227,4 +932,30 @@ GET /vue/cargo/latest - 取得最新貨物數據
     { "id": "case 250", "position": {...}, "size": {...}, "timestamp": "..." }
 DELETE /vue/cargo - 清空貨物數據
     { "message": "貨物數據已清空", "total_cargo": 0 }
+
+庫存（warehouseGrid 格位佔用，揀貨完成的箱子移除）:
+GET /vue/inventory - { "width": 5, "depth": 10, "height": 5, "max_box_id": 230, "seeded_from": "cargo",
+                       "in_stock": 228, "empty_slots": 2, "reserved": 6, "unplaced": 0 }
+POST /vue/inventory/check - { "items": [12, 34, 999], "order_id": null }
+    { "ok": false, "invalid": [999], "missing": [], "duplicates": [], "reserved": {"34": 7},
+      "buried": [{"box_id": 12, "cell": {"x": 2, "z": 1, "level": 0}, "above": 4, "blockers": [62, 112, 162, 212]}],
+      "dig_moves": 4 }
+GET /vue/inventory/buried?items=12,34 - { "buried": [...], "dig_moves": 4 }
+
+貨物空間查詢（cell 為格位 x/z 與層 level）:
+GET /vue/cargo/region?min_x=&min_y=&min_z=&max_x=&max_y=&max_z= - 包圍盒內的貨物
+    { "cargo": [{"id": "case 1", "cell": {"x": 0, "z": 1, "level": 0}, "position": {...}}], "count": 1 }
+GET /vue/cargo/cell?x=0&z=1&level=0 - 格位上的貨物
+GET /vue/cargo/nearest?x=0&y=0&z=0&k=5 - 最近的 k 個貨物（附 distance）
+GET /vue/cargo/column?x=0&z=1 - 整柱堆疊（由下而上）
+
+分批上傳（大量貨物）:
+POST /vue/cargo/ingest?mode=replace - 開啟上傳 session（replace 取代全部 / merge 依 id 合併）
+    { "session_id": "…", "mode": "replace" }
+POST /vue/cargo/ingest/{session_id} - 暫存一批貨物（依 id upsert）
+    { "session_id": "…", "received": 250, "staged": 500, "chunks": 2 }
+POST /vue/cargo/ingest/{session_id}/commit - 套用並寫檔一次
+    { "message": "貨物已儲存", "total_cargo": 750, "saved_count": 750 }
+DELETE /vue/cargo/ingest/{session_id} - 放棄上傳
+    { "session_id": "…", "aborted": true }
 """
@@ -0,0 +1,417 @@
+"""
+多 worker 共用的訂單狀態（SQLite，WAL 模式）
+
+STATE_BACKEND=sqlite 時，同一台機器上的多個 uvicorn worker 共用 APP_DATA_DIR/state.db：
+- orders：id → 訂單 JSON
+- changes：序號 → 變更（與 OrderLog 的日誌行相同格式），保留最近 feed_capacity × 2 筆
+- meta：seq（最後序號）、order_counter（下一個訂單 id）、epoch（變更序列的世代）
+- dispatch：尚未結束的訂單與其租約（派工佇列），visible_at 之前其他代理領不到
+
+訂單 id 與序號在同一個 BEGIN IMMEDIATE 交易內配發，多個 worker 同時新增也不會重複。
+各 worker 仍在記憶體保留 OrderStore 供讀取，依序號從 changes 補齊其他 worker 的變更。
+貨物分批上傳的 session 也存在這裡，任一 worker 都能接續同一個 session。
+"""
+
+import fcntl
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.services.cargo_store import INGEST_MODES
+from app.services.dispatch_queue import LeaseError, new_lease
+from app.services.order_lifecycle import IN_FLIGHT_STATES, TERMINAL_STATES
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKENDS = ("local", "sqlite")
+
+# 與 ORDER_FSYNC_POLICY 對應的 synchronous 設定
+_SYNCHRONOUS = {"always": "FULL", "batch": "NORMAL", "os": "OFF"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS orders (id INTEGER PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS cargo_sessions (
+    id TEXT PRIMARY KEY, mode TEXT NOT NULL, chunks INTEGER NOT NULL, expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cargo_staged (
+    session_id TEXT NOT NULL, cargo_id TEXT NOT NULL, body TEXT NOT NULL,
+    PRIMARY KEY (session_id, cargo_id)
+);
+CREATE TABLE IF NOT EXISTS dispatch (
+    order_id INTEGER PRIMARY KEY, priority INTEGER NOT NULL, visible_at REAL NOT NULL,
+    lease TEXT, agent TEXT, deliveries INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS dispatch_next ON dispatch (priority DESC, order_id);
+"""
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """跨行程的互斥鎖（flock），離開區塊即釋放"""
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class SqliteState:
+    """以 SQLite 保存訂單與變更序列，供多個行程共用"""
+
+    def __init__(
+        self,
+        path: Path,
+        fsync_policy: str = "batch",
+        feed_capacity: int = 10000,
+        seed: Optional[Callable[[], Tuple[List[Dict[str, Any]], int, int]]] = None,
+        lease_seconds: float = 30.0,
+    ):
+        """seed：資料庫初次建立時呼叫，回傳 (orders, order_counter, last_seq) 匯入既有資料"""
+        if fsync_policy not in _SYNCHRONOUS:
+            raise ValueError(f"未知的 fsync 策略: {fsync_policy}")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.cargo_lock_path = self.path.with_suffix(".cargo.lock")
+        self.keep_changes = max(feed_capacity, 1) * 2
+        self._lock = threading.Lock()
+        # 自行以 BEGIN 控制交易；連線由多個執行緒輪流使用，以 _lock 保護
+        self._conn = sqlite3.connect(
+            str(self.path), timeout=30.0, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={_SYNCHRONOUS[fsync_policy]}")
+        self._conn.executescript(_SCHEMA)
+        self.epoch = self._initialize(seed)
+        self.cargo_ingest = SqliteCargoIngest(self)
+        self.dispatch = SqliteDispatch(self, lease_seconds)
+
+    @contextmanager
+    def _transaction(self, immediate: bool = True) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _meta(self, conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set_meta(self, conn: sqlite3.Connection, **values: Any):
+        conn.executemany(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            [(k, str(v)) for k, v in values.items()],
+        )
+
+    def _initialize(self, seed) -> str:
+        # 多個 worker 同時啟動時只有第一個取得寫入鎖的會匯入
+        with self._transaction() as conn:
+            epoch = self._meta(conn, "epoch")
+            if epoch is None:
+                orders, counter, last_seq = seed() if seed is not None else ([], 1, 0)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO orders (id, body) VALUES (?, ?)",
+                    ((o["id"], json.dumps(o, ensure_ascii=False)) for o in orders),
+                )
+                epoch = uuid.uuid4().hex[:12]
+                self._set_meta(conn, epoch=epoch, seq=last_seq, order_counter=counter)
+                if orders:
+                    logger.info(f"已將 {len(orders)} 筆訂單匯入 {self.path.name}")
+            if self._meta(conn, "dispatch") is None:
+                # 既有訂單全部列入派工佇列；已結束的由啟動時重播的確認移除
+                conn.execute(
+                    "INSERT OR IGNORE INTO dispatch (order_id, priority, visible_at) "
+                    "SELECT id, COALESCE(json_extract(body, '$.priority'), 0), 0 FROM orders"
+                )
+                self._set_meta(conn, dispatch=1)
+            return epoch
+
+    # ---- 寫入 ----
+
+    def write_batch(self, entries: List[Dict[str, Any]]):
+        """在單一交易內套用多筆變更，就地填入配發的訂單 id 與 entry["seq"]
+
+        刪除不存在的訂單時不配發序號，entry["seq"] 為 None。
+        供 GroupCommitter 於工作執行緒呼叫。
+        """
+        with self._transaction() as conn:
+            seq = int(self._meta(conn, "seq"))
+            counter = int(self._meta(conn, "order_counter"))
+            changes = []
+            for entry in entries:
+                op = entry.get("op")
+                if op in ("create", "create_many"):
+                    orders = [entry["order"]] if op == "create" else entry["orders"]
+                    for order in orders:
+                        order["id"] = counter
+                        counter += 1
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO orders (id, body) VALUES (?, ?)",
+                        ((o["id"], json.dumps(o, ensure_ascii=False)) for o in orders),
+                    )
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO dispatch (order_id, priority, visible_at) VALUES (?, ?, 0)",
+                        ((o["id"], o.get("priority") or 0) for o in orders),
+                    )
+                elif op == "delete":
+                    if conn.execute("DELETE FROM orders WHERE id = ?", (entry["order_id"],)).rowcount == 0:
+                        entry["seq"] = None
+                        continue
+                    conn.execute("DELETE FROM dispatch WHERE order_id = ?", (entry["order_id"],))
+                elif op == "clear":
+                    conn.execute("DELETE FROM orders")
+                    conn.execute("DELETE FROM dispatch")
+                    counter = 1
+                else:
+                    raise ValueError(f"未知的訂單操作: {op}")
+                seq += 1
+                entry["seq"] = seq
+                changes.append((seq, json.dumps(entry, ensure_ascii=False)))
+            conn.executemany("INSERT INTO changes (seq, body) VALUES (?, ?)", changes)
+            conn.execute("DELETE FROM changes WHERE seq <= ?", (seq - self.keep_changes,))
+            self._set_meta(conn, seq=seq, order_counter=counter)
+
+    # ---- 讀取 ----
+
+    def last_seq(self) -> int:
+        with self._lock:
+            return int(self._meta(self._conn, "seq"))
+
+    def changes_since(self, seq: int, limit: int = 5000) -> Optional[List[Dict[str, Any]]]:
+        """序號大於 seq 的變更（依序號），最多 limit 筆；已被清除而無法補齊時回傳 None"""
+        with self._transaction(immediate=False) as conn:
+            last = int(self._meta(conn, "seq"))
+            if last <= seq:
+                return []
+            rows = conn.execute(
+                "SELECT seq, body FROM changes WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+            ).fetchall()
+        if not rows or rows[0][0] != seq + 1:
+            return None
+        return [json.loads(body) for _, body in rows]
+
+    def load_orders(self) -> Tuple[List[Dict[str, Any]], int, int]:
+        """所有訂單（依 id，即新增順序）、其對應的序號與已配發的最大 id，於同一個讀取交易內取得"""
+        with self._transaction(immediate=False) as conn:
+            last = int(self._meta(conn, "seq"))
+            issued = int(self._meta(conn, "order_counter")) - 1
+            rows = conn.execute("SELECT body FROM orders ORDER BY id").fetchall()
+        return [json.loads(body) for (body,) in rows], last, issued
+
+    @contextmanager
+    def cargo_lock(self) -> Iterator[None]:
+        """貨物「重新載入 → 修改 → 寫檔」期間的跨行程鎖"""
+        with file_lock(self.cargo_lock_path):
+            yield
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SqliteCargoIngest:
+    """與 CargoIngest 相同介面的分批上傳 session，暫存於 SQLite 供所有 worker 存取"""
+
+    def __init__(self, state: SqliteState, ttl_seconds: float = 600):
+        self.state = state
+        self.ttl = ttl_seconds
+
+    def _expire(self, conn: sqlite3.Connection):
+        expired = [
+            sid for (sid,) in conn.execute(
+                "SELECT id FROM cargo_sessions WHERE expires_at < ?", (time.time(),)
+            )
+        ]
+        for sid in expired:
+            logger.info(f"貨物上傳 session 逾時: {sid}")
+            self._delete(conn, sid)
+
+    def _delete(self, conn: sqlite3.Connection, sid: str) -> bool:
+        conn.execute("DELETE FROM cargo_staged WHERE session_id = ?", (sid,))
+        return conn.execute("DELETE FROM cargo_sessions WHERE id = ?", (sid,)).rowcount > 0
+
+    def begin(self, mode: str = "replace") -> str:
+        if mode not in INGEST_MODES:
+            raise ValueError(f"未知的上傳模式: {mode}")
+        sid = uuid.uuid4().hex
+        with self.state._transaction() as conn:
+            self._expire(conn)
+            conn.execute(
+                "INSERT INTO cargo_sessions (id, mode, chunks, expires_at) VALUES (?, ?, 0, ?)",
+                (sid, mode, time.time() + self.ttl),
+            )
+        return sid
+
+    def append(self, sid: str, items: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        rows = [(sid, cargo["id"], json.dumps(cargo, ensure_ascii=False)) for cargo in items]
+        with self.state._transaction() as conn:
+            self._expire(conn)
+            row = conn.execute("SELECT chunks FROM cargo_sessions WHERE id = ?", (sid,)).fetchone()
+            if row is None:
+                raise KeyError(sid)
+            conn.executemany(
+                "INSERT INTO cargo_staged (session_id, cargo_id, body) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id, cargo_id) DO UPDATE SET body = excluded.body",
+                rows,
+            )
+            conn.execute(
+                "UPDATE cargo_sessions SET chunks = chunks + 1, expires_at = ? WHERE id = ?",
+                (time.time() + self.ttl, sid),
+            )
+            staged = conn.execute(
+                "SELECT COUNT(*) FROM cargo_staged WHERE session_id = ?", (sid,)
+            ).fetchone()[0]
+        return {"received": len(rows), "staged": staged, "chunks": row[0] + 1}
+
+    def take(self, sid: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """取出並結束 session，回傳 (mode, 暫存的貨物)"""
+        with self.state._transaction() as conn:
+            self._expire(conn)
+            row = conn.execute("SELECT mode FROM cargo_sessions WHERE id = ?", (sid,)).fetchone()
+            if row is None:
+                raise KeyError(sid)
+            # 依暫存順序（rowid）還原，與記憶體版 session 的插入順序一致
+            items = [
+                json.loads(body) for (body,) in conn.execute(
+                    "SELECT body FROM cargo_staged WHERE session_id = ? ORDER BY rowid", (sid,)
+                )
+            ]
+            self._delete(conn, sid)
+        return row[0], items
+
+    def abort(self, sid: str) -> bool:
+        with self.state._transaction() as conn:
+            return self._delete(conn, sid)
+
+
+class SqliteDispatch:
+    """與 DispatchQueue 相同介面的派工佇列，領取與確認都在寫入交易內完成，多個 worker 不會重複派送"""
+
+    def __init__(self, state: SqliteState, lease_seconds: float = 30.0, max_lease_seconds: float = 600.0):
+        self.state = state
+        self.lease_seconds = lease_seconds
+        self.max_lease_seconds = max_lease_seconds
+
+        # 統計（本行程）
+        self.claimed = 0
+        self.completed = 0
+        self.expired = 0
+        self.released = 0
+
+    def _lease_for(self, seconds: Optional[float]) -> float:
+        seconds = self.lease_seconds if seconds is None else seconds
+        return min(max(seconds, 1.0), self.max_lease_seconds)
+
+    def claim(
+        self, agent: str, limit: int = 1, lease_seconds: Optional[float] = None, now: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        now = time.time() if now is None else now
+        expires_at = now + self._lease_for(lease_seconds)
+        claimed = []
+        with self.state._transaction() as conn:
+            rows = conn.execute(
+                "SELECT d.order_id, d.lease, d.deliveries, o.body FROM dispatch d "
+                "JOIN orders o ON o.id = d.order_id WHERE d.visible_at <= ? "
+                "ORDER BY d.priority DESC, d.order_id LIMIT ?",
+                (now, max(limit, 0)),
+            ).fetchall()
+            for order_id, previous, deliveries, body in rows:
+                token = new_lease()
+                conn.execute(
+                    "UPDATE dispatch SET visible_at = ?, lease = ?, agent = ?, deliveries = ? WHERE order_id = ?",
+                    (expires_at, token, agent, deliveries + 1, order_id),
+                )
+                self.expired += previous is not None
+                claimed.append(
+                    {"order": json.loads(body), "lease": token, "expires_at": expires_at, "deliveries": deliveries + 1}
+                )
+        self.claimed += len(claimed)
+        return claimed
+
+    def acknowledge(
+        self,
+        order_id: Any,
+        status: str,
+        lease: Optional[str] = None,
+        lease_seconds: Optional[float] = None,
+        now: Optional[float] = None,
+    ) -> Optional[float]:
+        now = time.time() if now is None else now
+        with self.state._transaction() as conn:
+            row = conn.execute(
+                "SELECT lease, visible_at FROM dispatch WHERE order_id = ?", (order_id,)
+            ).fetchone()
+            held = row is not None and row[0] is not None and row[1] > now
+            if lease is not None and (not held or row[0] != lease):
+                raise LeaseError(order_id)
+            if status in TERMINAL_STATES:
+                if row is not None:
+                    conn.execute("DELETE FROM dispatch WHERE order_id = ?", (order_id,))
+                    self.completed += 1
+                return None
+            if status not in IN_FLIGHT_STATES or row is None:
+                return None
+            expires_at = now + self._lease_for(lease_seconds)
+            if held:
+                conn.execute("UPDATE dispatch SET visible_at = ? WHERE order_id = ?", (expires_at, order_id))
+            else:
+                conn.execute(
+                    "UPDATE dispatch SET visible_at = ?, lease = ?, agent = NULL, deliveries = deliveries + 1 "
+                    "WHERE order_id = ?",
+                    (expires_at, new_lease(), order_id),
+                )
+            return expires_at
+
+    def release(self, order_id: Any, lease: str) -> bool:
+        with self.state._transaction() as conn:
+            released = conn.execute(
+                "UPDATE dispatch SET visible_at = 0, lease = NULL, agent = NULL WHERE order_id = ? AND lease = ?",
+                (order_id, lease),
+            ).rowcount > 0
+        self.released += released
+        return released
+
+    def next_expiry(self, now: Optional[float] = None) -> Optional[float]:
+        """最早到期的租約時間（沒有租約時為 None）"""
+        now = time.time() if now is None else now
+        with self.state._transaction(immediate=False) as conn:
+            (expires_at,) = conn.execute(
+                "SELECT MIN(visible_at) FROM dispatch WHERE visible_at > ?", (now,)
+            ).fetchone()
+        return expires_at
+
+    def discard(self, order_ids: Iterable[Any]) -> int:
+        """移除已結束的訂單（啟動時依重播的確認呼叫）"""
+        with self.state._transaction() as conn:
+            return conn.executemany(
+                "DELETE FROM dispatch WHERE order_id = ?", ((order_id,) for order_id in order_ids)
+            ).rowcount
+
+    def stats(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = time.time() if now is None else now
+        with self.state._transaction(immediate=False) as conn:
+            pending, leased = conn.execute(
+                "SELECT COALESCE(SUM(visible_at <= ?), 0), COALESCE(SUM(visible_at > ?), 0) FROM dispatch",
+                (now, now),
+            ).fetchone()
+        return {
+            "pending": pending,
+            "leased": leased,
+            "claimed": self.claimed,
+            "completed": self.completed,
+            "expired": self.expired,
+            "released": self.released,
+        }
@@ -0,0 +1,309 @@
+"""
+儲位最佳化（slotting）
+
+依訂單歷史的需求重新安排箱子位置：
+1. 需求：把所有訂單的 items 攤平成 (訂單, 箱子) 陣列，以 bincount 計算每箱被揀次數，
+   以分段的 0/1 關聯矩陣乘積計算兩兩同單次數（co-occurrence）；
+2. 格位成本：一次揀一箱（DEFAULT_CAR_CAPACITY），每次揀貨的行駛距離為格位到最近卸貨點的來回，
+   挖箱數為同柱上方的箱子數；只在目前有箱子的格位之間調換，各柱高度不變、不會懸空；
+3. 配置：揀貨次數多的箱子依序放到成本低的格位（可分離的線性成本下為最佳），
+   同成本的格位之間優先讓常同單的箱子疊在同一柱（同單的上方箱子本來就要取，不算挖箱），
+   沒有需求的箱子盡量不動；指定 max_moves 時改為從現況挑收益最大的成對調換。
+"""
+
+import asyncio
+import itertools
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel
+
+from app.services.order_lifecycle import parse_timestamp
+from app.services.routing import TRACK, TrackGraph
+from app.services.send_to_Front import cargo_record, inventory
+
+router = APIRouter(tags=["slotting"])
+
+
+class Demand:
+    """每箱揀貨次數（以箱子編號為索引）與被揀過的箱子之間的兩兩同單次數"""
+
+    def __init__(self, freq: np.ndarray, touched: np.ndarray, co: np.ndarray):
+        self.freq = freq
+        self.touched = touched
+        self.co = co
+        # 箱子編號 → co 的列，沒被揀過的箱子為 -1
+        self.pos = np.full(len(freq), -1, dtype=np.int64)
+        self.pos[touched] = np.arange(len(touched))
+
+    def co_between(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """a × b 兩組箱子的同單次數矩陣"""
+        pa, pb = self.pos[a], self.pos[b]
+        ia, ib = pa >= 0, pb >= 0
+        out = np.zeros((len(a), len(b)), dtype=np.int64)
+        out[np.ix_(ia, ib)] = self.co[np.ix_(pa[ia], pb[ib])]
+        return out
+
+    def top_pairs(self, top: int) -> List[Dict[str, Any]]:
+        pairs = np.triu(self.co, 1)
+        best = np.argsort(pairs, axis=None, kind="stable")[::-1][:top]
+        return [
+            {"boxes": [int(self.touched[a]), int(self.touched[b])], "orders": int(pairs[a, b])}
+            for a, b in zip(*np.unravel_index(best, pairs.shape))
+            if pairs[a, b] > 0
+        ]
+
+
+def count_demand(orders: Sequence[Dict[str, Any]], max_box_id: int, chunk: int = 4096) -> Demand:
+    """以陣列運算統計訂單需求；同一訂單重複的箱子只算一次
+
+    與 Inventory._ids 相同，範圍外的編號先換成 -1，超出 int64 的值也不會溢位。
+    """
+    size = max_box_id + 1
+    lengths = np.fromiter((len(o.get("items") or ()) for o in orders), dtype=np.int64, count=len(orders))
+    values = map(int, itertools.chain.from_iterable(o.get("items") or () for o in orders))
+    flat = np.fromiter(
+        (v if 1 <= v <= max_box_id else -1 for v in values),
+        dtype=np.int64,
+        count=int(lengths.sum()),
+    )
+    rows = np.repeat(np.arange(len(orders), dtype=np.int64), lengths)
+    valid = flat >= 1
+    codes = np.unique(rows[valid] * size + flat[valid])
+    rows, boxes = np.divmod(codes, size)
+    freq = np.bincount(boxes, minlength=size)
+    touched, boxes = np.unique(boxes, return_inverse=True)
+
+    width = len(touched)
+    co = np.zeros((width, width), dtype=np.int64)
+    # codes 已排序，各段訂單的範圍以 searchsorted 取得；float32 在每段 chunk 筆內可精確累計
+    bounds = np.searchsorted(rows, np.arange(0, len(orders) + chunk, chunk))
+    for k, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if hi - lo < 2:
+            continue
+        incidence = np.zeros((chunk, width), dtype=np.float32)
+        incidence[rows[lo:hi] - k * chunk, boxes[lo:hi]] = 1.0
+        co += (incidence.T @ incidence).astype(np.int64)
+    np.fill_diagonal(co, 0)
+    return Demand(freq, touched, co)
+
+
+def slot_costs(cells: np.ndarray, graph: TrackGraph) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """各格位的 (來回行駛步數, 上方箱子數, 柱索引)"""
+    columns = cells[:, 0] * graph.grid.depth + cells[:, 1]
+    trip = {}
+    for x, z in {(int(x), int(z)) for x, z in cells[:, :2]}:
+        trip[x * graph.grid.depth + z] = 2 * graph.nearest_unload((x, z))[1]
+    travel = np.array([trip[c] for c in columns], dtype=np.float64)
+    # 依 (柱, 層) 排序後，同柱中排在後面的格位數即上方的箱子數
+    order = np.lexsort((cells[:, 2], columns))
+    sorted_columns = columns[order]
+    ends = np.searchsorted(sorted_columns, sorted_columns, side="right")
+    above = np.empty(len(cells), dtype=np.int64)
+    above[order] = ends - np.arange(len(cells)) - 1
+    return travel, above, columns
+
+
+def layout_cost(
+    boxes: np.ndarray, demand: Demand, travel: np.ndarray, above: np.ndarray, columns: np.ndarray
+) -> Dict[str, float]:
+    """boxes[i] 放在格位 i 時，觀察到的需求下的總行駛步數與挖箱數"""
+    f = demand.freq[boxes]
+    dig = float(f @ above)
+    # 同柱且同單的箱子：上方那箱本來就要取，不算挖箱
+    for column in np.unique(columns):
+        stacked = boxes[columns == column]
+        if len(stacked) > 1:
+            dig -= float(np.triu(demand.co_between(stacked, stacked), 1).sum())
+    return {"travel_steps": float(f @ travel), "dig_moves": dig}
+
+
+def _full_layout(boxes: np.ndarray, demand: Demand, cost: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    """依需求重新配置所有格位，回傳新的 boxes（格位 i 的箱子）"""
+    n = len(boxes)
+    f = demand.freq[boxes]
+    current = np.arange(n)
+    placed = np.zeros(n, dtype=np.int64)
+    free = np.ones(n, dtype=bool)
+    stacks: Dict[int, List[int]] = {}
+
+    def put(slot: int, box: int):
+        placed[slot] = box
+        free[slot] = False
+        stacks.setdefault(int(columns[slot]), []).append(box)
+
+    # 同成本的格位中，原本就放著有需求箱子的排前面，已是最佳的配置不會再被搬動
+    slot_order = np.lexsort((f == 0, cost))
+    # 需求高者先；同需求時原本格位成本低者先，減少搬動
+    demanded = current[f > 0]
+    demanded = demanded[np.lexsort((cost[demanded], -f[demanded]))]
+    targets = slot_order[: len(demanded)]
+    tier_starts = np.flatnonzero(np.r_[True, np.diff(cost[targets]) != 0])
+    for lo, hi in zip(tier_starts, np.r_[tier_starts[1:], len(targets)]):
+        tier = targets[lo:hi]
+        movers = []
+        for i in demanded[lo:hi]:
+            if i in tier and free[i]:
+                put(i, boxes[i])
+            else:
+                movers.append(i)
+        for i in movers:
+            box = boxes[i : i + 1]
+            candidates = tier[free[tier]]
+            affinity = [
+                demand.co_between(box, np.array(stacks.get(int(columns[s]), []), dtype=np.int64)).sum()
+                for s in candidates
+            ]
+            put(int(candidates[int(np.argmax(affinity))]), int(box[0]))
+
+    # 沒有需求的箱子留在原位，被占走的依序補進剩下的格位
+    idle = current[f == 0]
+    stay = idle[free[idle]]
+    for i in stay:
+        put(i, boxes[i])
+    rest = slot_order[free[slot_order]]
+    for slot, i in zip(rest, idle[~np.isin(idle, stay)]):
+        put(int(slot), boxes[i])
+    return placed
+
+
+def _swap_layout(boxes: np.ndarray, freq: np.ndarray, cost: np.ndarray, max_moves: int) -> np.ndarray:
+    """從現況起，每次做收益 (f_i - f_j)(c_i - c_j) 最大的一組調換，每箱最多搬一次
+
+    至少一邊有需求才有收益，因此只對有需求的箱子建收益矩陣（有需求數 × 格位數）。
+    """
+    placed = boxes.copy()
+    f = freq[boxes].astype(np.float64)
+    hot = np.flatnonzero(f > 0)
+    row_of = {int(i): r for r, i in enumerate(hot)}
+    gain = (f[hot, None] - f[None, :]) * (cost[hot, None] - cost[None, :])
+    gain[gain <= 0] = -np.inf
+    moves = 0
+    while moves + 2 <= max_moves and gain.size:
+        r, j = divmod(int(np.argmax(gain)), len(placed))
+        if not np.isfinite(gain[r, j]):
+            break
+        i = int(hot[r])
+        placed[i], placed[j] = placed[j], placed[i]
+        for slot in (i, j):
+            gain[:, slot] = -np.inf
+            if slot in row_of:
+                gain[row_of[slot], :] = -np.inf
+        moves += 2
+    return placed
+
+
+def _cell(cell: Sequence[int]) -> Dict[str, int]:
+    x, z, level = (int(v) for v in cell)
+    return {"x": x, "z": z, "level": level}
+
+
+def plan_slotting(
+    orders: Sequence[Dict[str, Any]],
+    boxes: np.ndarray,
+    cells: np.ndarray,
+    max_box_id: int,
+    graph: TrackGraph = TRACK,
+    seconds_per_step: float = 1.0,
+    seconds_per_dig: float = 2.0,
+    max_moves: Optional[int] = None,
+    top: int = 10,
+) -> Dict[str, Any]:
+    """依訂單需求為在庫箱子（boxes[i] 位於 cells[i]）產生新配置與預估的節省"""
+    started = time.perf_counter()
+    demand = count_demand(orders, max_box_id)
+    freq = demand.freq
+    summary: Dict[str, Any] = {"orders": len(orders), "picks": int(freq.sum()), "boxes": len(boxes)}
+
+    travel, above, columns = slot_costs(cells, graph) if len(boxes) else (np.zeros(0),) * 3
+    cost = seconds_per_step * travel + seconds_per_dig * above
+    proposed = _full_layout(boxes, demand, cost, columns)
+    if max_moves is not None and int((proposed != boxes).sum()) > max_moves:
+        proposed = _swap_layout(boxes, freq, cost, max_moves)
+
+    projected = {}
+    for name, layout in (("current", boxes), ("proposed", proposed)):
+        stats = layout_cost(layout, demand, travel, above, columns)
+        stats["seconds"] = seconds_per_step * stats["travel_steps"] + seconds_per_dig * stats["dig_moves"]
+        projected[name] = stats
+    before, after = projected["current"], projected["proposed"]
+    projected["saving"] = {
+        key: before[key] - after[key] for key in ("travel_steps", "dig_moves", "seconds")
+    }
+    projected["saving"]["percent"] = (
+        100.0 * projected["saving"]["seconds"] / before["seconds"] if before["seconds"] else 0.0
+    )
+
+    origin = {int(b): i for i, b in enumerate(boxes)}
+    slot_of = {int(b): i for i, b in enumerate(proposed)}
+    summary["hot"] = [
+        {
+            "box_id": int(b),
+            "picks": int(freq[b]),
+            "from": _cell(cells[origin[int(b)]]) if int(b) in origin else None,
+            "to": _cell(cells[slot_of[int(b)]]) if int(b) in slot_of else None,
+        }
+        for b in np.argsort(-freq, kind="stable")[:top]
+        if freq[b] > 0
+    ]
+    summary["pairs"] = demand.top_pairs(top)
+
+    moved = np.flatnonzero(proposed != boxes)
+    moves = [
+        {"box_id": int(proposed[i]), "from": _cell(cells[origin[int(proposed[i])]]), "to": _cell(cells[i])}
+        for i in moved
+    ]
+    summary.update(
+        {
+            "moves": len(moves),
+            "projected": projected,
+            "elapsed_ms": (time.perf_counter() - started) * 1000,
+        }
+    )
+    layout = [(int(b), tuple(int(v) for v in cells[i]), bool(b != boxes[i])) for i, b in enumerate(proposed)]
+    return {"summary": summary, "moves": moves, "layout": layout}
+
+
+class SlottingRequest(BaseModel):
+    limit: Optional[int] = None  # 只看最近 limit 筆訂單
+    since: Optional[str] = None  # 只看此時間（ISO 8601 或 Unix 秒）之後的訂單
+    max_moves: Optional[int] = None  # 最多搬動幾箱；不指定時完整重排
+    seconds_per_step: float = 1.0
+    seconds_per_dig: float = 2.0
+    top: int = 10
+
+
+@router.post("/slotting/plan")
+async def plan_slots(payload: SlottingRequest, request: Request):
+    """依訂單歷史產生儲位調整計畫；cargo 可直接送到 POST /vue/cargo 套用"""
+    orders_db = getattr(request.app.state, "orders_db", None)
+    if orders_db is None:
+        raise HTTPException(status_code=503, detail="Order store not ready")
+    orders = orders_db.tail(payload.limit) if payload.limit is not None else list(orders_db)
+    if payload.since is not None:
+        since = parse_timestamp(payload.since)
+        if since is None:
+            raise HTTPException(status_code=400, detail="since must be an ISO 8601 timestamp or Unix seconds")
+        orders = [o for o in orders if (parse_timestamp(o.get("timestamp")) or 0) >= since]
+
+    # 在事件迴圈上取好庫存快照，計算交給工作執行緒
+    boxes, cells = inventory.occupied()
+    result = await asyncio.to_thread(
+        plan_slotting,
+        orders,
+        boxes,
+        cells,
+        inventory.max_box_id,
+        seconds_per_step=payload.seconds_per_step,
+        seconds_per_dig=payload.seconds_per_dig,
+        max_moves=payload.max_moves,
+        top=max(payload.top, 0),
+    )
+    now = datetime.now(timezone.utc).isoformat()
+    # 空間索引以第一筆貨物校準座標，未搬動的箱子排在前面
+    layout = sorted(result.pop("layout"), key=lambda entry: entry[2])
+    result["cargo"] = [cargo_record(box_id, cell, now) for box_id, cell, _ in layout]
+    return result
@@ -0,0 +1,226 @@
+"""
+貨物空間索引
+
+以 warehouseGrid 的格距建立均勻網格（x, 層, z），每個貨物依中心點
+落入對應格子；區域、格位、最近鄰與整柱查詢都只檢查附近的格子。
+監聽 CargoStore 的變更逐筆更新，不需重建。
+"""
+
+import heapq
+import math
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.services.warehouse_config import WarehouseGrid, parse_box_id
+
+Vec3 = Tuple[float, float, float]
+Lattice = Tuple[int, int, int]  # (x, 層, z)
+
+_AXES = ("x", "y", "z")
+
+
+def _vec(d: Dict[str, float]) -> Vec3:
+    return float(d["x"]), float(d["y"]), float(d["z"])
+
+
+class CargoSpatialIndex:
+    """均勻網格空間索引，格距由貨物尺寸與網格間距推得"""
+
+    def __init__(self, grid: WarehouseGrid):
+        self.grid = grid
+        self.origin: Optional[Vec3] = None
+        self.step: Optional[Vec3] = None
+        # id → (中心, 半尺寸, 格子)
+        self._boxes: Dict[str, Tuple[Vec3, Vec3, Lattice]] = {}
+        self._cells: Dict[Lattice, Set[str]] = {}
+        self._columns: Dict[Tuple[int, int], Set[str]] = {}
+        self._max_half = 0.0
+        # 已佔用格子的範圍，變更時失效、查詢時重算
+        self._extent: Optional[Tuple[List[int], List[int]]] = None
+
+    # ---- 維護 ----
+
+    def calibrate(self, items: Iterable[Dict[str, Any]]) -> bool:
+        """以第一個可辨識編號的貨物推算網格原點與格距"""
+        for cargo in items:
+            box_id = parse_box_id(cargo.get("id"))
+            cell = self.grid.box_cell(box_id) if box_id is not None else None
+            if cell is None:
+                continue
+            size = _vec(cargo["size"])
+            pos = _vec(cargo["position"])
+            self.step = tuple(
+                max(abs(s) * (1 + r), 1e-6) for s, r in zip(size, self.grid.spacing_ratio)
+            )
+            x, z, level = cell
+            lattice = (x, level, z)
+            self.origin = tuple(p - c * s for p, c, s in zip(pos, lattice, self.step))
+            return True
+        return False
+
+    def to_lattice(self, point: Vec3) -> Lattice:
+        return tuple(round((p - o) / s) for p, o, s in zip(point, self.origin, self.step))
+
+    def cell_center(self, x: int, z: int, level: int) -> Vec3:
+        lattice = (x, level, z)
+        return tuple(o + c * s for o, c, s in zip(self.origin, lattice, self.step))
+
+    def on_cargo_change(self, upserted: List[Dict[str, Any]], removed: List[str]):
+        """CargoStore 監聽者：先移除再新增/更新"""
+        for cargo_id in removed:
+            self.remove(cargo_id)
+        if not self._boxes:
+            self.origin = self.step = None
+            self._max_half = 0.0
+        if upserted and self.origin is None and not self.calibrate(upserted):
+            return
+        for cargo in upserted:
+            self.insert(cargo)
+
+    def insert(self, cargo: Dict[str, Any]):
+        if self.origin is None:
+            return
+        cargo_id = cargo["id"]
+        self.remove(cargo_id)
+        center = _vec(cargo["position"])
+        half = tuple(abs(s) / 2 for s in _vec(cargo["size"]))
+        lattice = self.to_lattice(center)
+        self._boxes[cargo_id] = (center, half, lattice)
+        self._cells.setdefault(lattice, set()).add(cargo_id)
+        self._columns.setdefault((lattice[0], lattice[2]), set()).add(cargo_id)
+        self._max_half = max(self._max_half, *half)
+        self._extent = None
+
+    def remove(self, cargo_id: str):
+        entry = self._boxes.pop(cargo_id, None)
+        if entry is None:
+            return
+        lattice = entry[2]
+        self._extent = None
+        for index, key in ((self._cells, lattice), (self._columns, (lattice[0], lattice[2]))):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.discard(cargo_id)
+                if not bucket:
+                    del index[key]
+
+    def __len__(self) -> int:
+        return len(self._boxes)
+
+    # ---- 查詢 ----
+
+    def _describe(self, cargo_id: str) -> Dict[str, Any]:
+        center, _, (x, level, z) = self._boxes[cargo_id]
+        return {
+            "id": cargo_id,
+            "cell": {"x": x, "z": z, "level": level},
+            "position": dict(zip(_AXES, center)),
+        }
+
+    def region(self, lo: Vec3, hi: Vec3) -> List[Dict[str, Any]]:
+        """與軸對齊包圍盒 [lo, hi] 相交的貨物"""
+        if self.origin is None:
+            return []
+        lo, hi = (
+            tuple(min(a, b) for a, b in zip(lo, hi)),
+            tuple(max(a, b) for a, b in zip(lo, hi)),
+        )
+        # 擴張半個箱子，涵蓋中心在範圍外但邊緣相交的貨物
+        margin = self._max_half
+        cmin = self.to_lattice(tuple(v - margin for v in lo))
+        cmax = self.to_lattice(tuple(v + margin for v in hi))
+        volume = 1
+        for a, b in zip(cmin, cmax):
+            volume *= b - a + 1
+        if volume > len(self._cells):
+            candidates = (cid for ids in self._cells.values() for cid in ids)
+        else:
+            candidates = (
+                cid
+                for cx in range(cmin[0], cmax[0] + 1)
+                for cy in range(cmin[1], cmax[1] + 1)
+                for cz in range(cmin[2], cmax[2] + 1)
+                for cid in self._cells.get((cx, cy, cz), ())
+            )
+        result = []
+        for cargo_id in candidates:
+            center, half, _ = self._boxes[cargo_id]
+            if all(c + h >= l and c - h <= u for c, h, l, u in zip(center, half, lo, hi)):
+                result.append(self._describe(cargo_id))
+        return result
+
+    def cell_of(self, cargo_id: str) -> Optional[Tuple[int, int, int]]:
+        """貨物目前所在的 (x, z, 層)"""
+        entry = self._boxes.get(cargo_id)
+        if entry is None:
+            return None
+        x, level, z = entry[2]
+        return x, z, level
+
+    def at_cell(self, x: int, z: int, level: int) -> List[Dict[str, Any]]:
+        return [self._describe(cid) for cid in self._cells.get((x, level, z), ())]
+
+    def column(self, x: int, z: int) -> List[Dict[str, Any]]:
+        """(x, z) 整柱貨物，由下而上排序"""
+        ids = self._columns.get((x, z), ())
+        return sorted(
+            (self._describe(cid) for cid in ids), key=lambda d: d["cell"]["level"]
+        )
+
+    def stack_height(self, x: int, z: int) -> int:
+        """(x, z) 最上層貨物的層數 + 1，沒有貨物時為 0"""
+        ids = self._columns.get((x, z))
+        if not ids:
+            return 0
+        return max(self._boxes[cid][2][1] for cid in ids) + 1
+
+    def nearest(self, point: Vec3, k: int = 1) -> List[Dict[str, Any]]:
+        """距離 point 最近的 k 個貨物（以中心點計算），由近到遠"""
+        if self.origin is None or k <= 0 or not self._boxes:
+            return []
+        center = self.to_lattice(point)
+        if self._extent is None:
+            keys = self._cells.keys()
+            self._extent = (
+                [min(c[i] for c in keys) for i in range(3)],
+                [max(c[i] for c in keys) for i in range(3)],
+            )
+        lo, hi = self._extent
+        max_radius = max(
+            max(abs(center[i] - lo[i]), abs(hi[i] - center[i])) for i in range(3)
+        )
+        min_step = min(self.step)
+
+        best: List[Tuple[float, str]] = []  # 以負距離維持大小為 k 的最大堆
+        for radius in range(max_radius + 1):
+            for cell in self._shell(center, radius, lo, hi):
+                for cargo_id in self._cells.get(cell, ()):
+                    dist = math.dist(point, self._boxes[cargo_id][0])
+                    if len(best) < k:
+                        heapq.heappush(best, (-dist, cargo_id))
+                    elif dist < -best[0][0]:
+                        heapq.heapreplace(best, (-dist, cargo_id))
+            # 更外圈的格子與 point 的距離至少為 radius 個格距
+            if len(best) == k and -best[0][0] <= radius * min_step:
+                break
+
+        result = []
+        for neg_dist, cargo_id in sorted(best, reverse=True):
+            item = self._describe(cargo_id)
+            item["distance"] = -neg_dist
+            result.append(item)
+        return result
+
+    @staticmethod
+    def _shell(center: Lattice, radius: int, lo: List[int], hi: List[int]):
+        """以 center 為中心、Chebyshev 距離恰為 radius 且落在範圍內的格子"""
+        ranges = [
+            range(max(center[i] - radius, lo[i]), min(center[i] + radius, hi[i]) + 1)
+            for i in range(3)
+        ]
+        for cx in ranges[0]:
+            edge_x = abs(cx - center[0]) == radius
+            for cy in ranges[1]:
+                edge_xy = edge_x or abs(cy - center[1]) == radius
+                for cz in ranges[2]:
+                    if edge_xy or abs(cz - center[2]) == radius:
+                        yield cx, cy, cz
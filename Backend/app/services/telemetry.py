@@ -0,0 +1,442 @@
+"""
+遙測（玩家位置/旋轉/速度）的二進位批次上傳與環狀緩衝區
+
+UE 端以固定格式的二進位 frame 批次送出 PlayerData，每位玩家一個預先配置的
+NumPy 結構化陣列做為環狀緩衝區；寫入與查詢都以整段陣列操作，不為每筆樣本建立 dict。
+
+Frame 格式（little-endian）：
+
+    header   uint8 version(=1) | uint8 player_id 長度 | uint16 樣本數
+    player   UTF-8 player_id
+    samples  樣本數 × SAMPLE_DTYPE（44 bytes）：
+             float64 t（Unix 秒）| float32 px py pz | pitch yaw roll | vx vy vz
+
+一則 WebSocket 訊息或 HTTP body 可串接多個 frame。
+"""
+
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<BBH")
+
+SAMPLE_DTYPE = np.dtype(
+    [
+        ("t", "<f8"),
+        ("px", "<f4"), ("py", "<f4"), ("pz", "<f4"),
+        ("pitch", "<f4"), ("yaw", "<f4"), ("roll", "<f4"),
+        ("vx", "<f4"), ("vy", "<f4"), ("vz", "<f4"),
+    ]
+)
+FIELDS = SAMPLE_DTYPE.names
+
+# PlayerData 欄位對應到樣本欄位
+_PLAYER_DATA_FIELDS = {
+    "position": (("x", "px"), ("y", "py"), ("z", "pz")),
+    "rotation": (("pitch", "pitch"), ("yaw", "yaw"), ("roll", "roll")),
+    "velocity": (("x", "vx"), ("y", "vy"), ("z", "vz")),
+}
+
+
+class FrameError(ValueError):
+    """二進位 frame 格式錯誤"""
+
+
+def encode_frame(player_id: str, samples: np.ndarray) -> bytes:
+    """將樣本陣列編碼成一個 frame（供客戶端參考與測試使用）"""
+    name = player_id.encode("utf-8")
+    samples = np.ascontiguousarray(samples, dtype=SAMPLE_DTYPE)
+    if len(name) > 255 or len(samples) > 0xFFFF:
+        raise FrameError("player_id 或樣本數超出 frame 上限")
+    return FRAME_HEADER.pack(FRAME_VERSION, len(name), len(samples)) + name + samples.tobytes()
+
+
+def decode_frames(buffer: bytes) -> Iterable[Tuple[str, np.ndarray]]:
+    """逐一解出 (player_id, 樣本陣列)；樣本為 buffer 上的唯讀視圖，不複製
+
+    player_id 不是合法 UTF-8 或 t 不是有限值（NaN / ±inf 會破壞環狀緩衝區的時間排序）時拋出 FrameError。
+    """
+    view = memoryview(buffer)
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < FRAME_HEADER.size:
+            raise FrameError(f"frame header 不完整（offset {offset}）")
+        version, name_len, count = FRAME_HEADER.unpack_from(view, offset)
+        if version != FRAME_VERSION:
+            raise FrameError(f"不支援的 frame 版本: {version}")
+        offset += FRAME_HEADER.size
+        end = offset + name_len + count * SAMPLE_DTYPE.itemsize
+        if end > len(view):
+            raise FrameError(f"frame 長度不足（offset {offset}）")
+        try:
+            player_id = bytes(view[offset:offset + name_len]).decode("utf-8")
+        except UnicodeDecodeError:
+            raise FrameError(f"player_id 不是合法的 UTF-8（offset {offset}）")
+        offset += name_len
+        samples = np.frombuffer(view, dtype=SAMPLE_DTYPE, count=count, offset=offset)
+        if not np.isfinite(samples["t"]).all():
+            raise FrameError(f"樣本時間不是有限值（offset {offset}）")
+        offset = end
+        yield player_id, samples
+
+
+class TelemetryRing:
+    """單一玩家的固定容量環狀緩衝區，樣本依時間遞增保存"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(capacity, 1)
+        self._data = np.zeros(self.capacity, dtype=SAMPLE_DTYPE)
+        self._head = 0  # 下一筆寫入位置
+        self._count = 0
+        self.last_t = -np.inf
+        self.received = 0
+        self.dropped = 0  # 時間早於已保存樣本而被捨棄的筆數
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, samples: np.ndarray) -> int:
+        """寫入一批樣本，回傳實際保存的筆數"""
+        n = len(samples)
+        if n == 0:
+            return 0
+        self.received += n
+        t = samples["t"]
+        if n > 1 and np.any(t[1:] < t[:-1]):
+            samples = samples[np.argsort(t, kind="stable")]
+            t = samples["t"]
+        if t[0] < self.last_t:
+            # 環狀緩衝區以時間做二分搜尋，不接受比已保存資料更舊的樣本
+            keep = t >= self.last_t
+            self.dropped += n - int(keep.sum())
+            samples = samples[keep]
+            n = len(samples)
+            if n == 0:
+                return 0
+        if n > self.capacity:
+            samples = samples[-self.capacity:]
+            n = self.capacity
+
+        first = min(n, self.capacity - self._head)
+        self._data[self._head:self._head + first] = samples[:first]
+        if first < n:
+            self._data[:n - first] = samples[first:]
+        self._head = (self._head + n) % self.capacity
+        self._count = min(self._count + n, self.capacity)
+        self.last_t = float(samples["t"][-1])
+        return n
+
+    def ordered(self) -> np.ndarray:
+        """依時間排序的樣本；未繞回時為視圖，繞回時複製一次"""
+        if self._count < self.capacity:
+            return self._data[:self._count]
+        if self._head == 0:
+            return self._data
+        return np.concatenate((self._data[self._head:], self._data[:self._head]))
+
+    def range(self, start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        """時間區間 [start, end] 內的樣本"""
+        data = self.ordered()
+        t = data["t"]
+        lo = 0 if start is None else int(np.searchsorted(t, start, side="left"))
+        hi = len(data) if end is None else int(np.searchsorted(t, end, side="right"))
+        return data[lo:hi]
+
+    def stats(self) -> Dict[str, Any]:
+        data = self.ordered()
+        return {
+            "samples": self._count,
+            "capacity": self.capacity,
+            "received": self.received,
+            "dropped": self.dropped,
+            "first_t": float(data["t"][0]) if self._count else None,
+            "last_t": float(data["t"][-1]) if self._count else None,
+        }
+
+
+def decimate(samples: np.ndarray, max_points: Optional[int]) -> np.ndarray:
+    """等間隔抽樣到最多 max_points 筆（保留首尾）"""
+    n = len(samples)
+    if not max_points or n <= max_points:
+        return samples
+    if max_points == 1:
+        return samples[-1:]
+    index = np.linspace(0, n - 1, max_points).round().astype(np.int64)
+    return samples[index]
+
+
+DOWNSAMPLE_METHODS = ("stride", "minmax", "lttb")
+
+
+def field_values(samples: np.ndarray, field: str) -> np.ndarray:
+    """取出一個欄位；speed 為速度向量長度"""
+    if field == "speed":
+        return np.sqrt(
+            samples["vx"].astype(np.float64) ** 2
+            + samples["vy"].astype(np.float64) ** 2
+            + samples["vz"].astype(np.float64) ** 2
+        )
+    if field not in FIELDS:
+        raise ValueError(f"未知的欄位: {field}")
+    return samples[field].astype(np.float64)
+
+
+def minmax_indices(values: np.ndarray, buckets: int) -> np.ndarray:
+    """每個區段保留最小值與最大值所在的樣本（依時間排序）"""
+    n = len(values)
+    if buckets <= 0 or n <= 2 * buckets:
+        return np.arange(n)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    starts = edges[:-1]
+    lo = np.minimum.reduceat(values, starts)
+    hi = np.maximum.reduceat(values, starts)
+    bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+
+    def first_in_bucket(mask: np.ndarray) -> np.ndarray:
+        # 每個區段第一個等於極值的位置
+        index = np.flatnonzero(mask)
+        _, first = np.unique(bucket_of[index], return_index=True)
+        return index[first]
+
+    picked = (first_in_bucket(values == lo[bucket_of]), first_in_bucket(values == hi[bucket_of]))
+    return np.unique(np.concatenate(picked))
+
+
+def lttb_indices(t: np.ndarray, values: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets 降採樣，回傳保留的樣本索引（含首尾）"""
+    n = len(values)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1])
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 下一個區段的平均點（最後一段以末點代替）
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            avg_t = t[nlo:nhi].mean()
+            avg_v = values[nlo:nhi].mean()
+        else:
+            avg_t, avg_v = t[-1], values[-1]
+        area = np.abs(
+            (t[a] - avg_t) * (values[lo:hi] - values[a])
+            - (t[a] - t[lo:hi]) * (avg_v - values[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(
+    samples: np.ndarray, max_points: Optional[int], method: str = "stride", field: str = "speed"
+) -> np.ndarray:
+    """依 method 降採樣到最多 max_points 筆（保留首尾）；minmax / lttb 以 field 選點，回傳完整樣本"""
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"未知的降採樣方法: {method}")
+    if not max_points or len(samples) <= max_points:
+        return samples
+    if method == "stride":
+        return decimate(samples, max_points)
+    values = field_values(samples, field)
+    if max_points < 3:
+        return decimate(samples, max_points)
+    if method == "minmax":
+        # 首尾固定保留，其餘點數分給中間各區段的最小值與最大值
+        n = len(samples)
+        buckets = (max_points - 2) // 2
+        inner = minmax_indices(values[1:-1], buckets) + 1 if buckets else np.zeros(0, dtype=np.int64)
+        return samples[np.concatenate(([0], inner, [n - 1]))]
+    return samples[lttb_indices(samples["t"], values, max_points)]
+
+
+def summarize(samples: np.ndarray) -> Dict[str, Any]:
+    """時間窗內的彙總：最後姿態、平均速度、移動距離"""
+    n = len(samples)
+    if n == 0:
+        return {"samples": 0}
+    position = np.stack([samples["px"], samples["py"], samples["pz"]], axis=1).astype(np.float64)
+    steps = np.linalg.norm(np.diff(position, axis=0), axis=1)
+    distance = float(steps.sum())
+    duration = float(samples["t"][-1] - samples["t"][0])
+    speed = field_values(samples, "speed")
+    last = samples[-1]
+    return {
+        "samples": n,
+        "start": float(samples["t"][0]),
+        "end": float(samples["t"][-1]),
+        "duration": duration,
+        "distance": distance,
+        # 速度欄位的平均值；UE 未送速度時可參考 path_speed（距離 / 時間）
+        "avg_speed": float(speed.mean()),
+        "max_speed": float(speed.max()),
+        "path_speed": distance / duration if duration > 0 else 0.0,
+        "last_pose": {name: float(last[name]) for name in FIELDS},
+    }
+
+
+def heatmap(
+    samples: np.ndarray,
+    origin: Tuple[float, float],
+    step: Tuple[float, float],
+    width: int,
+    depth: int,
+    weight: str = "samples",
+) -> np.ndarray:
+    """將 (px, pz) 分箱到 width × depth 的格位，回傳 [x][z] 的樣本數或停留秒數
+
+    weight="seconds" 時每筆樣本以到下一筆的時間加權。網格外的樣本忽略。
+    """
+    grid = np.zeros(width * depth, dtype=np.float64)
+    if len(samples) == 0:
+        return grid.reshape(width, depth)
+    x = np.rint((samples["px"] - origin[0]) / step[0]).astype(np.int64)
+    z = np.rint((samples["pz"] - origin[1]) / step[1]).astype(np.int64)
+    inside = (x >= 0) & (x < width) & (z >= 0) & (z < depth)
+    if weight == "seconds":
+        dt = np.diff(samples["t"], append=samples["t"][-1])
+        weights = dt[inside]
+    elif weight == "samples":
+        weights = None
+    else:
+        raise ValueError(f"未知的權重: {weight}")
+    grid += np.bincount(x[inside] * depth + z[inside], weights=weights, minlength=width * depth)
+    return grid.reshape(width, depth)
+
+
+def to_columns(samples: np.ndarray) -> Dict[str, List[float]]:
+    """轉成欄位導向的 JSON（每個欄位一個 list），不逐筆建立 dict"""
+    return {name: samples[name].tolist() for name in FIELDS}
+
+
+def _select_frames(buffer, player_id: str, lo: float, hi: float) -> List[np.ndarray]:
+    """複製 buffer 中指定玩家、時間在 [lo, hi] 的樣本（回傳後不再參照 buffer）"""
+    selected = []
+    try:
+        for frame_player, samples in decode_frames(buffer):
+            if frame_player == player_id:
+                t = samples["t"]
+                selected.append(samples[(t >= lo) & (t <= hi)])  # 布林索引即複製
+    except FrameError:
+        # 未正常關閉的分段尾端可能有寫到一半的 frame
+        pass
+    return selected
+
+
+class TelemetryStore:
+    """所有玩家的遙測環狀緩衝區"""
+
+    def __init__(self, capacity: int = 36000, archive=None):
+        self.capacity = capacity
+        self._players: Dict[str, TelemetryRing] = {}
+        # 選用的 SegmentArchive：原始 frame 追加封存，供超出環狀緩衝區的歷史查詢
+        self.archive = archive
+        self.frames = 0
+        self.samples = 0
+
+    def ring(self, player_id: str) -> TelemetryRing:
+        ring = self._players.get(player_id)
+        if ring is None:
+            ring = self._players[player_id] = TelemetryRing(self.capacity)
+        return ring
+
+    def get(self, player_id: str) -> Optional[TelemetryRing]:
+        return self._players.get(player_id)
+
+    def players(self) -> List[str]:
+        return list(self._players)
+
+    def ingest(self, buffer: bytes) -> int:
+        """寫入一段可能含多個 frame 的二進位資料，回傳保存的樣本數
+
+        格式錯誤時拋出 FrameError，整段資料都不寫入。
+        """
+        frames = list(decode_frames(buffer))
+        stored = 0
+        for player_id, samples in frames:
+            self.frames += 1
+            stored += self.ring(player_id).append(samples)
+        self.samples += stored
+        if self.archive is not None:
+            times = [samples["t"] for _, samples in frames if len(samples)]
+            if times:
+                lo = min(float(t.min()) for t in times)
+                hi = max(float(t.max()) for t in times)
+                self.archive.append(bytes(buffer), lo, hi)
+        return stored
+
+    def ingest_player_data(self, player_id: str, data: Dict[str, Any], t: float) -> int:
+        """寫入單筆 JSON 格式的 PlayerData（position / rotation / velocity）"""
+        sample = np.zeros(1, dtype=SAMPLE_DTYPE)
+        sample["t"] = t
+        for group, pairs in _PLAYER_DATA_FIELDS.items():
+            values = data.get(group) or {}
+            for key, field in pairs:
+                sample[field] = float(values.get(key, 0.0))
+        stored = self.ring(player_id).append(sample)
+        self.samples += stored
+        if self.archive is not None:
+            self.archive.append(encode_frame(player_id, sample), t)
+        return stored
+
+    def history(
+        self, player_id: str, start: Optional[float] = None, end: Optional[float] = None
+    ) -> np.ndarray:
+        """從封存讀取時間區間內的樣本（依時間排序），不受環狀緩衝區容量限制"""
+        if self.archive is None:
+            return np.zeros(0, dtype=SAMPLE_DTYPE)
+        lo = -np.inf if start is None else start
+        hi = np.inf if end is None else end
+        parts: List[np.ndarray] = []
+        for mm, begin, finish in self.archive.scan(start, end):
+            view = memoryview(mm)[begin:finish]
+            try:
+                parts.extend(_select_frames(view, player_id, lo, hi))
+            finally:
+                view.release()
+        if not parts:
+            return np.zeros(0, dtype=SAMPLE_DTYPE)
+        merged = np.concatenate(parts)
+        return merged[np.argsort(merged["t"], kind="stable")]
+
+    def query(
+        self,
+        player_id: str,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        max_points: Optional[int] = None,
+        method: str = "stride",
+        field: str = "speed",
+    ) -> Optional[np.ndarray]:
+        ring = self._players.get(player_id)
+        if ring is None:
+            return None
+        return downsample(ring.range(start, end), max_points, method, field)
+
+    def window(
+        self,
+        players: Optional[Iterable[str]] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ) -> Dict[str, np.ndarray]:
+        """各玩家在時間窗內的樣本（未指定 players 時為全部玩家）"""
+        ids = self.players() if players is None else [p for p in players if p in self._players]
+        return {p: self._players[p].range(start, end) for p in ids}
+
+    def clear(self):
+        self._players.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "players": len(self._players),
+            "frames": self.frames,
+            "samples": self.samples,
+            "capacity_per_player": self.capacity,
+            "sample_bytes": SAMPLE_DTYPE.itemsize,
+        }
@@ -0,0 +1,121 @@
+"""
+倉儲網格設定（與前端 Frontend/src/utils/warehouseConfig.js 共用）
+
+啟動時直接解析前端的設定檔，確保後端與 Three.js 場景使用同一份
+width/depth/height 與卸貨區配置；找不到檔案時使用相同的預設值。
+箱子編號規則與 boxGrid.js 相同：依 x → z → 層 的順序跳過卸貨區遞增。
+"""
+
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+FRONTEND_CONFIG = (
+    Path(__file__).resolve().parents[3] / "Frontend" / "src" / "utils" / "warehouseConfig.js"
+)
+
+DEFAULT_UNLOAD_BAYS = [
+    {"cells": ["0-0", "1-0"], "protrudeSteps": 1},
+    {"cells": ["3-0", "4-0"], "protrudeSteps": 1},
+]
+
+Cell = Tuple[int, int]
+
+
+def parse_cell_key(key: str) -> Cell:
+    """將 'x-z' 形式的格位鍵轉為 (x, z)"""
+    x, z = key.split("-")
+    return int(x), int(z)
+
+
+def parse_box_id(cargo_id) -> Optional[int]:
+    """從貨物 id（例如 'case 12'）取出箱子編號"""
+    if isinstance(cargo_id, int):
+        return cargo_id
+    match = re.search(r"(\d+)\s*$", str(cargo_id))
+    return int(match.group(1)) if match else None
+
+
+class WarehouseGrid:
+    """網格尺寸、卸貨區與箱子編號 ↔ (x, z, 層) 的對應"""
+
+    # 與 boxGrid.js 相同：x/z 方向間距為箱子尺寸的 20%，垂直方向無間距
+    spacing_ratio = (0.2, 0.0, 0.2)
+
+    def __init__(self, width: int = 5, depth: int = 10, height: int = 5, unload_bays=None):
+        self.width = width
+        self.depth = depth
+        self.height = height
+        self.unload_bays: List[Dict] = []
+        for bay in unload_bays if unload_bays is not None else DEFAULT_UNLOAD_BAYS:
+            self.unload_bays.append(
+                {
+                    "cells": [parse_cell_key(c) for c in bay["cells"]],
+                    "protrudeSteps": max(0, int(bay.get("protrudeSteps", 0))),
+                }
+            )
+        self.unload_cells: Set[Cell] = {c for bay in self.unload_bays for c in bay["cells"]}
+        # 可放箱子的格位，順序即 boxGrid.js 的建立順序
+        self.storage_columns: List[Cell] = [
+            (x, z)
+            for x in range(width)
+            for z in range(depth)
+            if (x, z) not in self.unload_cells
+        ]
+        self._column_index = {cell: i for i, cell in enumerate(self.storage_columns)}
+
+    def max_box_id(self) -> int:
+        """對應 getMaxBoxId()"""
+        total_boxes = self.width * self.depth * self.height
+        return total_boxes - len(self.unload_cells) * self.height
+
+    def in_bounds(self, x: int, z: int) -> bool:
+        return 0 <= x < self.width and 0 <= z < self.depth
+
+    def box_cell(self, box_id: int) -> Optional[Tuple[int, int, int]]:
+        """箱子預設位置 (x, z, 層)，超出範圍回傳 None"""
+        if not 1 <= box_id <= self.max_box_id():
+            return None
+        column, level = divmod(box_id - 1, self.height)
+        x, z = self.storage_columns[column]
+        return x, z, level
+
+    def box_id_at(self, x: int, z: int, level: int) -> Optional[int]:
+        """(x, z, 層) 的預設箱子編號，卸貨區或超出範圍回傳 None"""
+        column = self._column_index.get((x, z))
+        if column is None or not 0 <= level < self.height:
+            return None
+        return column * self.height + level + 1
+
+
+def load_grid(path: Path = FRONTEND_CONFIG) -> WarehouseGrid:
+    """解析 warehouseConfig.js；失敗時回傳預設網格"""
+    try:
+        source = Path(path).read_text(encoding="utf-8")
+    except OSError:
+        logger.info(f"找不到前端網格設定 {path}，使用預設值")
+        return WarehouseGrid()
+
+    def _number(name: str, default: int) -> int:
+        match = re.search(rf"\b{name}\s*:\s*(\d+)", source)
+        return int(match.group(1)) if match else default
+
+    bays = []
+    for cells, steps in re.findall(
+        r"cells\s*:\s*\[([^\]]*)\]\s*,\s*protrudeSteps\s*:\s*(\d+)", source
+    ):
+        keys = re.findall(r"['\"](\d+-\d+)['\"]", cells)
+        bays.append({"cells": keys, "protrudeSteps": int(steps)})
+
+    return WarehouseGrid(
+        width=_number("width", 5),
+        depth=_number("depth", 10),
+        height=_number("height", 5),
+        unload_bays=bays or None,
+    )
+
+
+GRID = load_grid()
@@ -1,14 +1,89 @@
 """
 WebSocket service layer for managing connections and data flow
+
+Every connection keeps a set of topic subscriptions (optionally filtered by car);
+broadcasts are routed only to the connections subscribed to the message's topic.
+New connections are subscribed to every topic so existing clients keep
+receiving everything.
+
+Only topics that something actually broadcasts are accepted. Telemetry is
+queried over HTTP, and no broadcast carries a zone, so a `telemetry` topic or
+a `zones` filter is rejected rather than accepted and never delivered.
 """
 
 import json
 import logging
-from typing import Dict, List, Optional
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+TOPICS = ("orders", "cargo", "fleet", "status")
+
+# Message types whose topic is not obvious from their prefix
+_TOPIC_BY_TYPE = {
+    "new_order": "orders",
+    "order_deleted": "orders",
+    "status_update": "status",
+}
+
+
+def topic_of(message_type: Optional[str]) -> Optional[str]:
+    """Map a message type to its topic; None means deliver to everyone"""
+    if not message_type:
+        return None
+    if message_type in _TOPIC_BY_TYPE:
+        return _TOPIC_BY_TYPE[message_type]
+    prefix = message_type.split("_", 1)[0]
+    if prefix == "order":
+        return "orders"
+    return prefix if prefix in TOPICS else None
+
+
+def parse_ids(value: Any) -> Optional[FrozenSet]:
+    """Parse a car filter from a JSON list or a comma separated string"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = [v for v in value.split(",") if v.strip()]
+    elif not isinstance(value, (list, tuple, set)):
+        value = [value]
+    ids = set()
+    for v in value:
+        if isinstance(v, str) and v.strip().lstrip("-").isdigit():
+            v = int(v)
+        ids.add(v)
+    return frozenset(ids)
+
+
+class Subscription:
+    """Topic subscription with an optional car filter (None = no filter)"""
+
+    __slots__ = ("cars",)
+
+    def __init__(self, cars: Optional[FrozenSet] = None):
+        self.cars = cars
+
+    @property
+    def key(self) -> Optional[FrozenSet]:
+        return self.cars
+
+    def project(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the part of the message this subscription wants, or None"""
+        if self.cars is None:
+            return message
+        if "car" in message:
+            return message if message["car"] in self.cars else None
+        entries = message.get("cars")
+        if isinstance(entries, list):
+            kept = [e for e in entries if isinstance(e, dict) and e.get("car") in self.cars]
+            return {**message, "cars": kept} if kept else None
+        return message
+
+    def describe(self) -> Dict[str, Any]:
+        return {"cars": sorted(self.cars, key=str) if self.cars is not None else None}
+
+
 class WebSocketService:
     """Service for managing WebSocket connections and data flow"""
 
@@ -18,10 +93,18 @@ class WebSocketService:
             "ue_clients": {},
             "svelte_clients": {}
         }
+        # topic -> {client_id: Subscription}
+        self.subscribers: Dict[str, Dict[str, Subscription]] = {t: {} for t in TOPICS}
         self.player_data_history: List[Dict] = []
 
-    def add_connection(self, client_id: str, websocket, client_type: str):
-        """Add a new WebSocket connection"""
+    def add_connection(
+        self,
+        client_id: str,
+        websocket,
+        client_type: str,
+        topics: Optional[Iterable[str]] = None,
+    ):
+        """Add a new WebSocket connection, subscribed to `topics` (default: all)"""
         self.connections["active"][client_id] = {
             "websocket": websocket,
             "client_type": client_type,
@@ -33,6 +116,7 @@ class WebSocketService:
         elif client_type == "svelte":
             self.connections["svelte_clients"][client_id] = websocket
 
+        self.subscribe(client_id, TOPICS if topics is None else topics)
         logger.info(f"Added {client_type} connection: {client_id}")
 
     def remove_connection(self, client_id: str):
@@ -46,14 +130,98 @@ class WebSocketService:
             elif client_type == "svelte" and client_id in self.connections["svelte_clients"]:
                 del self.connections["svelte_clients"][client_id]
 
+            for subs in self.subscribers.values():
+                subs.pop(client_id, None)
+
             logger.info(f"Removed {client_type} connection: {client_id}")
 
+    def subscribe(
+        self,
+        client_id: str,
+        topics: Optional[Iterable[str]] = None,
+        cars: Any = None,
+        zones: Any = None,
+        replace: bool = False,
+    ) -> Dict[str, Any]:
+        """Subscribe to topics (default: all); the car filter applies to the given topics only
+
+        Raises ValueError for unknown topics and for any `zones` filter, since
+        no broadcast is tagged with a zone. With replace=True every other topic
+        is unsubscribed first.
+        """
+        if client_id not in self.connections["active"]:
+            raise KeyError(client_id)
+        topics = self._check_topics(topics)
+        if zones is not None:
+            raise ValueError("Zone filters are not supported: no broadcast carries a zone")
+        if replace:
+            self.unsubscribe(client_id)
+        subscription = Subscription(parse_ids(cars))
+        for topic in topics:
+            self.subscribers[topic][client_id] = subscription
+        return self.subscriptions(client_id)
+
+    def unsubscribe(self, client_id: str, topics: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Unsubscribe from topics (default: all)"""
+        for topic in self._check_topics(topics):
+            self.subscribers[topic].pop(client_id, None)
+        return self.subscriptions(client_id)
+
+    def subscriptions(self, client_id: str) -> Dict[str, Any]:
+        return {
+            topic: subs[client_id].describe()
+            for topic, subs in self.subscribers.items()
+            if client_id in subs
+        }
+
+    @staticmethod
+    def _check_topics(topics: Optional[Iterable[str]]) -> List[str]:
+        if topics is None:
+            return list(TOPICS)
+        if isinstance(topics, str):
+            topics = [t.strip() for t in topics.split(",") if t.strip()]
+        topics = list(topics)
+        unknown = [t for t in topics if t not in TOPICS]
+        if unknown:
+            raise ValueError(f"Unknown topics: {unknown}; expected any of {list(TOPICS)}")
+        return topics
+
+    def route(self, message: Dict[str, Any]) -> List[Tuple[Dict[str, Any], List[Any]]]:
+        """Group recipients of a broadcast by what they should receive
+
+        Returns (message, websockets) pairs; connections sharing the same
+        filter share one projected message so it is serialized only once.
+        """
+        topic = topic_of(message.get("type"))
+        if topic is None:
+            sockets = [c["websocket"] for c in self.connections["active"].values()]
+            return [(message, sockets)] if sockets else []
+
+        active = self.connections["active"]
+        groups: Dict[Optional[FrozenSet], Tuple[Subscription, List[Any]]] = {}
+        for client_id, subscription in self.subscribers[topic].items():
+            connection = active.get(client_id)
+            if connection is None:
+                continue
+            group = groups.get(subscription.key)
+            if group is None:
+                group = groups[subscription.key] = (subscription, [])
+            group[1].append(connection["websocket"])
+
+        routed = []
+        for subscription, sockets in groups.values():
+            projected = subscription.project(message)
+            if projected is not None:
+                routed.append((projected, sockets))
+        return routed
+
     def get_connection_stats(self) -> Dict:
         """Get current connection statistics"""
         return {
             "total": len(self.connections["active"]),
             "ue_clients": len(self.connections["ue_clients"]),
-            "svelte_clients": len(self.connections["svelte_clients"])
+            "svelte_clients": len(self.connections["svelte_clients"]),
+            "subscribers": {topic: len(subs) for topic, subs in self.subscribers.items()},
         }
 
     def store_player_data(self, client_id: str, data: Dict):
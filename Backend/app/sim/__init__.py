@@ -0,0 +1,21 @@
+"""Headless discrete-event simulation of the warehouse pick loop."""
+
+from app.sim.engine import (
+    POLICIES,
+    SimConfig,
+    Simulation,
+    generate_orders,
+    load_cargo,
+    load_orders,
+    run_simulation,
+)
+
+__all__ = [
+    "POLICIES",
+    "SimConfig",
+    "Simulation",
+    "generate_orders",
+    "load_cargo",
+    "load_orders",
+    "run_simulation",
+]
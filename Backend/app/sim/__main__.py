@@ -0,0 +1,65 @@
+"""
+命令列執行模擬：
+
+    python -m app.sim --cars 4 --capacity 2 --orders 2000 --rate 600 --policy nearest
+    python -m app.sim --replay data/app_data.json --arrival timestamps --time-scale 60
+
+未指定 --orders 時重播 APP_DATA_DIR（預設 Backend/data）中的 app_data.json。
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+from app.sim.engine import POLICIES, SimConfig, Simulation, generate_orders, load_cargo, load_orders
+
+DATA_DIR = Path(os.getenv("APP_DATA_DIR", Path(__file__).resolve().parents[2] / "data"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.sim", description="倉儲揀貨離散事件模擬")
+    parser.add_argument("--cars", type=int, default=2)
+    parser.add_argument("--capacity", type=int, default=1)
+    parser.add_argument("--policy", choices=POLICIES, default="fifo")
+    parser.add_argument("--lookahead", type=int, default=32)
+    parser.add_argument("--step-seconds", type=float, default=1.0)
+    parser.add_argument("--pick-seconds", type=float, default=2.0)
+    parser.add_argument("--dig-seconds", type=float, default=2.0)
+    parser.add_argument("--unload-seconds", type=float, default=2.0)
+    parser.add_argument("--no-restock", action="store_true", help="取走的箱子不補回")
+    parser.add_argument("--cargo", type=Path, default=DATA_DIR / "cargo_data.json")
+    parser.add_argument("--replay", type=Path, default=DATA_DIR / "app_data.json")
+    parser.add_argument("--arrival", choices=("batch", "timestamps"), default="batch")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="重播時間壓縮倍率")
+    parser.add_argument("--orders", type=int, help="改用隨機產生的訂單數")
+    parser.add_argument("--rate", type=float, default=0.0, help="每小時到單數，0 表示全部同時到達")
+    parser.add_argument("--items", type=int, nargs=2, default=(1, 3), metavar=("MIN", "MAX"))
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    config = SimConfig(
+        cars=args.cars,
+        capacity=args.capacity,
+        step_seconds=args.step_seconds,
+        pick_seconds=args.pick_seconds,
+        dig_seconds=args.dig_seconds,
+        unload_seconds=args.unload_seconds,
+        policy=args.policy,
+        lookahead=args.lookahead,
+        restock=not args.no_restock,
+    )
+    sim = Simulation(config, cargo=load_cargo(args.cargo))
+    if args.orders is not None:
+        orders = generate_orders(
+            args.orders, sim.box_ids(), args.rate, tuple(args.items), args.seed
+        )
+    else:
+        orders = load_orders(args.replay, args.arrival, args.time_scale)
+
+    report = sim.run(orders)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
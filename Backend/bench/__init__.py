@@ -0,0 +1,16 @@
+"""REST / WebSocket load generation and benchmark harness (`python -m bench`)."""
+
+from bench.compare import check_limits, compare
+from bench.runner import TARGETS, Recorder, run_scenario
+from bench.scenarios import OPERATIONS, SCENARIOS, Scenario
+
+__all__ = [
+    "OPERATIONS",
+    "SCENARIOS",
+    "TARGETS",
+    "Recorder",
+    "Scenario",
+    "check_limits",
+    "compare",
+    "run_scenario",
+]
@@ -0,0 +1,110 @@
+"""
+命令列執行壓測：
+
+    python -m bench list
+    python -m bench run orders_10k --out results/orders_10k.json
+    python -m bench run clients_1k --target uvicorn --baseline baselines/clients_1k.json
+    python -m bench run mixed --target url --url http://127.0.0.1:8000 --clients 20
+    python -m bench compare baselines/orders_10k.json results/orders_10k.json --threshold 0.2
+
+結果以 JSON 輸出（未指定 --out 時印到標準輸出）；任一門檻或回歸檢查失敗時結束碼為 1。
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from bench.compare import check_limits, compare
+from bench.runner import TARGETS, run_scenario
+from bench.scenarios import SCENARIOS
+
+
+def _load(path: Path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _report(failures, label: str):
+    for failure in failures:
+        print(f"[{label}] {failure}", file=sys.stderr)
+
+
+def _run(args) -> int:
+    scenario = SCENARIOS[args.scenario].override(
+        clients=args.clients,
+        requests=args.requests,
+        ws_clients=args.ws_clients,
+        warmup=args.warmup,
+        seed=args.seed,
+    )
+    result = asyncio.run(run_scenario(scenario, args.target, args.url))
+
+    limits = check_limits(result)
+    regressions = compare(_load(args.baseline), result, args.threshold) if args.baseline else []
+    result["checks"] = {
+        "limits": limits,
+        "regressions": regressions,
+        "baseline": str(args.baseline) if args.baseline else None,
+        "threshold": args.threshold,
+        "passed": not (limits or regressions),
+    }
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    _report(limits, "limit")
+    _report(regressions, "regression")
+    return 0 if result["checks"]["passed"] else 1
+
+
+def _compare(args) -> int:
+    regressions = compare(_load(args.baseline), _load(args.current), args.threshold)
+    _report(regressions, "regression")
+    if not regressions:
+        print("no regressions", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="REST / WebSocket 壓測")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="列出內建情境")
+
+    run = commands.add_parser("run", help="執行情境並輸出 JSON 結果")
+    run.add_argument("scenario", choices=sorted(SCENARIOS))
+    run.add_argument("--target", choices=TARGETS, default="asgi")
+    run.add_argument("--url", help="url 目標的伺服器位址，例如 http://127.0.0.1:8000")
+    run.add_argument("--clients", type=int, help="同時送出請求的客戶端數")
+    run.add_argument("--requests", type=int, help="計入結果的請求總數")
+    run.add_argument("--ws-clients", type=int, help="只接收廣播的 WebSocket 連線數")
+    run.add_argument("--warmup", type=int)
+    run.add_argument("--seed", type=int)
+    run.add_argument("--out", type=Path, help="結果 JSON 檔案")
+    run.add_argument("--baseline", type=Path, help="與此基準結果比較")
+    run.add_argument("--threshold", type=float, default=0.2, help="允許的退步比例（0.2 = 20%%）")
+
+    cmp = commands.add_parser("compare", help="比較兩份結果")
+    cmp.add_argument("baseline", type=Path)
+    cmp.add_argument("current", type=Path)
+    cmp.add_argument("--threshold", type=float, default=0.2)
+
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        for name, scenario in SCENARIOS.items():
+            print(f"{name:12} {scenario.description}")
+        return 0
+    if args.command == "run":
+        if args.target == "url" and not args.url:
+            parser.error("--target url 需要 --url")
+        return _run(args)
+    return _compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
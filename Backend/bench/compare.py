@@ -0,0 +1,58 @@
+"""
+壓測結果檢查
+
+- check_limits：情境本身的絕對門檻（p99 上限、錯誤率）
+- compare：與基準結果比較，延遲或吞吐量退步超過 threshold（比例）即視為回歸；
+  延遲差距小於 min_delta_ms 時視為雜訊，避免次毫秒級的操作因抖動誤判
+"""
+
+from typing import Any, Dict, List
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def check_limits(result: Dict[str, Any]) -> List[str]:
+    scenario = result["scenario"]
+    failures = []
+    for op, limit in scenario.get("max_p99_ms", {}).items():
+        p99 = result["ops"].get(op, {}).get("p99_ms")
+        if p99 is not None and p99 > limit:
+            failures.append(f"{op}: p99 {p99:.1f} ms 超過上限 {limit} ms")
+    max_error_rate = scenario.get("max_error_rate", 0.0)
+    for op, stats in result["ops"].items():
+        if stats["error_rate"] > max_error_rate:
+            detail = f"（{stats['last_error']}）" if "last_error" in stats else ""
+            failures.append(f"{op}: 錯誤率 {stats['error_rate']:.2%} 超過 {max_error_rate:.2%}{detail}")
+    return failures
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float = 0.2,
+    min_delta_ms: float = 1.0,
+) -> List[str]:
+    """回傳退步項目；空清單表示沒有回歸"""
+    if baseline["scenario"]["name"] != current["scenario"]["name"]:
+        return [f"情境不同：基準為 {baseline['scenario']['name']}，本次為 {current['scenario']['name']}"]
+    if baseline.get("target") != current.get("target"):
+        return [f"目標不同：基準為 {baseline.get('target')}，本次為 {current.get('target')}"]
+
+    failures = []
+    for op, base in baseline["ops"].items():
+        cur = current["ops"].get(op)
+        if cur is None:
+            failures.append(f"{op}: 本次結果沒有此操作")
+            continue
+        for key in LATENCY_KEYS:
+            before, after = base.get(key), cur.get(key)
+            if before is None or after is None:
+                continue
+            if after > before * (1 + threshold) and after - before > min_delta_ms:
+                failures.append(f"{op}: {key} {before:.2f} → {after:.2f} ms（+{after / before - 1:.0%}）")
+        before, after = base["throughput_rps"], cur["throughput_rps"]
+        if before > 0 and after < before * (1 - threshold):
+            failures.append(f"{op}: 吞吐量 {before:.1f} → {after:.1f} req/s（{after / before - 1:.0%}）")
+        if cur["error_rate"] > base["error_rate"]:
+            failures.append(f"{op}: 錯誤率 {base['error_rate']:.2%} → {cur['error_rate']:.2%}")
+    return failures
@@ -0,0 +1,499 @@
+"""
+壓測執行
+
+以 scenario.clients 個 asyncio 客戶端依 mix 比例輪流送出請求（封閉迴圈：
+每個客戶端等上一個請求完成才送下一個），記錄各操作的延遲；另開
+scenario.ws_clients 個只接收廣播的 /ws 連線，量測扇出是否跟得上。
+
+目標（target）：
+- asgi：同一行程內以 httpx.ASGITransport 呼叫 app，WS 連線為記憶體中的假連線，
+  直接走 /ws 的訊息處理、BroadcastHub 與主題路由，不經網路；不需 uvicorn / websockets
+- uvicorn：以子行程在 127.0.0.1 的空閒埠啟動 uvicorn，經真實 HTTP / WebSocket 量測
+- url：對已在執行的伺服器量測；會新增訂單並取代貨物資料，勿對正式環境使用
+
+asgi / uvicorn 目標使用暫存的 APP_DATA_DIR，不會寫入 Backend/data。
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from bench.scenarios import Scenario
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+TARGETS = ("asgi", "uvicorn", "url")
+# 單一請求或 WS 回覆的逾時（秒）
+REQUEST_TIMEOUT = 30.0
+
+
+def percentile(ordered: List[float], p: float) -> Optional[float]:
+    """已排序樣本的第 p 百分位數（nearest-rank）"""
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(len(ordered) * p / 100.0))
+    return ordered[rank - 1]
+
+
+class Recorder:
+    """各操作的延遲樣本（毫秒）與失敗次數"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.last_error: Dict[str, str] = {}
+
+    def record(self, op: str, elapsed_ms: float):
+        self.samples.setdefault(op, []).append(elapsed_ms)
+
+    def fail(self, op: str, error: BaseException):
+        self.errors[op] = self.errors.get(op, 0) + 1
+        self.last_error[op] = f"{type(error).__name__}: {error}"
+
+    def summary(self, duration: float) -> Dict[str, Dict[str, Any]]:
+        ops = {}
+        for op in sorted(set(self.samples) | set(self.errors)):
+            ordered = sorted(self.samples.get(op, ()))
+            errors = self.errors.get(op, 0)
+            total = len(ordered) + errors
+            stats: Dict[str, Any] = {
+                "count": total,
+                "errors": errors,
+                "error_rate": round(errors / total, 6) if total else 0.0,
+                "throughput_rps": round(len(ordered) / duration, 2) if duration > 0 else 0.0,
+                "mean_ms": round(sum(ordered) / len(ordered), 3) if ordered else None,
+            }
+            for p in (50, 95, 99):
+                value = percentile(ordered, p)
+                stats[f"p{p}_ms"] = None if value is None else round(value, 3)
+            stats["max_ms"] = round(ordered[-1], 3) if ordered else None
+            if op in self.last_error:
+                stats["last_error"] = self.last_error[op]
+            ops[op] = stats
+        return ops
+
+
+class BenchError(RuntimeError):
+    pass
+
+
+def _check(response: httpx.Response):
+    if response.status_code >= 400:
+        raise BenchError(f"HTTP {response.status_code} {response.request.method} {response.request.url.path}")
+
+
+# ---- 目標：asgi ----
+
+
+class _MemoryWebSocket:
+    """只實作 BroadcastHub 需要的 send_text / close，計算收到的訊息數"""
+
+    def __init__(self):
+        self.received = 0
+        self.confirmation: Optional[asyncio.Future] = None
+
+    async def send_text(self, text: str):
+        self.received += 1
+        waiter = self.confirmation
+        if waiter is not None and not waiter.done() and '"order_confirmation"' in text:
+            waiter.set_result(text)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class _MemoryDriver:
+    """以 /ws 的訊息處理函式下單，等待 order_confirmation"""
+
+    def __init__(self, main, websocket: _MemoryWebSocket):
+        self.main = main
+        self.websocket = websocket
+
+    async def order(self, content: str):
+        waiter = asyncio.get_running_loop().create_future()
+        self.websocket.confirmation = waiter
+        await self.main.handle_ws_message(
+            self.websocket, id(self.websocket), {"type": "custom_message", "content": content}
+        )
+        await asyncio.wait_for(waiter, REQUEST_TIMEOUT)
+
+
+class AsgiTarget:
+    name = "asgi"
+
+    def __init__(self, env: Dict[str, str]):
+        self.env = env
+        self.main = None
+        self.http: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if "app.main" in sys.modules:
+            logger.warning("app.main 已載入，情境的環境變數不會生效")
+        os.environ.update(self.env)
+        from app import main
+
+        # app.main 以 INFO 設定根日誌；壓測時只保留警告以上，與 uvicorn 目標一致
+        logging.getLogger().setLevel(logging.WARNING)
+        self.main = main
+        await main.app.router.startup()
+        self.http = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=REQUEST_TIMEOUT
+        )
+
+    async def stop(self):
+        if self.http is not None:
+            await self.http.aclose()
+        if self.main is not None:
+            await self.main.app.router.shutdown()
+
+    def _register(self, topics: Optional[str] = None) -> _MemoryWebSocket:
+        websocket = _MemoryWebSocket()
+        self.main.hub.add(websocket)
+        self.main.registry.add_connection(str(id(websocket)), websocket, "bench", topics)
+        return websocket
+
+    async def open_listener(self) -> _MemoryWebSocket:
+        return self._register()
+
+    async def open_driver(self) -> _MemoryDriver:
+        # 只訂閱 status，下單的回覆不必與廣播混在一起
+        return _MemoryDriver(self.main, self._register("status"))
+
+    async def close_socket(self, handle):
+        websocket = handle.websocket if isinstance(handle, _MemoryDriver) else handle
+        self.main.hub.remove(websocket)
+        self.main.registry.remove_connection(str(id(websocket)))
+
+
+# ---- 目標：uvicorn / url ----
+
+
+class _RemoteListener:
+    def __init__(self, connection):
+        self.connection = connection
+        self.received = 0
+        self.task = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for _ in self.connection:
+                self.received += 1
+        except Exception:
+            pass
+
+
+class _RemoteDriver:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def order(self, content: str):
+        await self.connection.send(json.dumps({"type": "custom_message", "content": content}))
+        while True:
+            raw = await asyncio.wait_for(self.connection.recv(), REQUEST_TIMEOUT)
+            if json.loads(raw).get("type") == "order_confirmation":
+                return
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class RemoteTarget:
+    """經真實連線量測；未指定 url 時自行以 uvicorn 子行程啟動伺服器"""
+
+    def __init__(self, url: Optional[str], env: Optional[Dict[str, str]] = None, max_connections: int = 100):
+        self.spawn = url is None
+        self.name = "uvicorn" if self.spawn else "url"
+        self.port = _free_port() if self.spawn else None
+        self.url = (url or f"http://127.0.0.1:{self.port}").rstrip("/")
+        self.env = env or {}
+        self.max_connections = max_connections
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.http: Optional[httpx.AsyncClient] = None
+
+    @property
+    def ws_url(self) -> str:
+        return "ws" + self.url[len("http"):] + "/ws?client=bench"
+
+    async def start(self):
+        if self.spawn:
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "uvicorn", "app.main:app",
+                "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning",
+                cwd=str(BACKEND_DIR),
+                env={**os.environ, **self.env},
+                stdout=asyncio.subprocess.DEVNULL,
+            )
+        self.http = httpx.AsyncClient(
+            base_url=self.url,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=self.max_connections),
+        )
+        await self._wait_ready()
+
+    async def _wait_ready(self, timeout: float = 30.0):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if self.process is not None and self.process.returncode is not None:
+                raise BenchError(f"uvicorn 啟動失敗（結束碼 {self.process.returncode}）")
+            try:
+                if (await self.http.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+        raise BenchError(f"{self.url} 在 {timeout:.0f} 秒內沒有回應 /health")
+
+    async def stop(self):
+        if self.http is not None:
+            await self.http.aclose()
+        if self.process is not None and self.process.returncode is None:
+            # SIGTERM 讓 uvicorn 執行 shutdown，寫完排隊中的變更
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), 10)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+
+    async def _connect(self, topics: Optional[str] = None):
+        try:
+            import websockets
+        except ImportError as e:
+            raise BenchError("uvicorn / url 目標的 WebSocket 操作需要 websockets 套件") from e
+        url = self.ws_url + (f"&topics={topics}" if topics else "")
+        return await websockets.connect(url, max_size=None, open_timeout=REQUEST_TIMEOUT)
+
+    async def open_listener(self) -> _RemoteListener:
+        return _RemoteListener(await self._connect())
+
+    async def open_driver(self) -> _RemoteDriver:
+        return _RemoteDriver(await self._connect("status"))
+
+    async def close_socket(self, handle):
+        await handle.connection.close()
+        if isinstance(handle, _RemoteListener):
+            handle.task.cancel()
+
+
+def make_target(scenario: Scenario, target: str, url: Optional[str] = None, data_dir: Optional[str] = None):
+    if target not in TARGETS:
+        raise ValueError(f"未知的目標: {target}")
+    if target == "url":
+        if not url:
+            raise ValueError("url 目標需要指定 --url")
+        return RemoteTarget(url, max_connections=scenario.clients)
+    env = {
+        "APP_DATA_DIR": data_dir or tempfile.mkdtemp(prefix=f"bench-{scenario.name}-"),
+        **scenario.env,
+    }
+    if target == "asgi":
+        return AsgiTarget(env)
+    return RemoteTarget(None, env, max_connections=scenario.clients)
+
+
+# ---- 工作負載 ----
+
+
+class _Worker:
+    """一個客戶端：自己的亂數、WS 下單連線與遙測玩家"""
+
+    def __init__(self, index: int, scenario: Scenario):
+        self.index = index
+        self.rng = random.Random(scenario.seed * 1_000_003 + index)
+        self.np_rng = np.random.default_rng(scenario.seed * 1_000_003 + index)
+        self.players = [f"bench-{index}-{p}" for p in range(scenario.telemetry_players)]
+        # 遙測時間戳需遞增，否則環狀緩衝區會捨棄
+        self.clock = time.time()
+        self.driver = None
+
+
+class Workload:
+    def __init__(self, scenario: Scenario, target):
+        self.scenario = scenario
+        self.target = target
+        self.orders_created = 0
+        self._ops: Dict[str, Callable] = {
+            "create_order": self._create_order,
+            "list_orders": self._list_orders,
+            "ws_order": self._ws_order,
+            "cargo_upload": self._cargo_upload,
+            "telemetry_burst": self._telemetry_burst,
+        }
+
+    def schedule(self, count: int, seed: int) -> Deque[str]:
+        rng = random.Random(seed)
+        ops = list(self.scenario.mix)
+        weights = [self.scenario.mix[op] for op in ops]
+        return deque(rng.choices(ops, weights=weights, k=count))
+
+    async def drive(self, workers: List[_Worker], schedule: Deque[str], recorder: Recorder):
+        async def loop(worker: _Worker):
+            while schedule:
+                op = schedule.popleft()
+                started = time.perf_counter()
+                try:
+                    await self._ops[op](worker)
+                except Exception as e:
+                    recorder.fail(op, e)
+                else:
+                    recorder.record(op, (time.perf_counter() - started) * 1000)
+
+        await asyncio.gather(*(loop(w) for w in workers))
+
+    def _items(self, worker: _Worker) -> List[int]:
+        return [worker.rng.randint(1, 100) for _ in range(worker.rng.randint(1, 3))]
+
+    async def _create_order(self, worker: _Worker):
+        _check(await self.target.http.post("/orders", json={"items": self._items(worker)}))
+        self.orders_created += 1
+
+    async def _list_orders(self, worker: _Worker):
+        _check(await self.target.http.get("/vue/orders", params={"limit": 20}))
+
+    async def _ws_order(self, worker: _Worker):
+        await worker.driver.order("-".join(str(n) for n in self._items(worker)))
+        self.orders_created += 1
+
+    async def _cargo_upload(self, worker: _Worker):
+        now = datetime.now(timezone.utc).isoformat()
+        cargo = [
+            {
+                "id": f"case {k}",
+                "position": {"x": float(k % 10), "y": float(k // 100), "z": float(k // 10 % 10)},
+                "size": {"x": 1.0, "y": 1.0, "z": 1.0},
+                "timestamp": now,
+            }
+            for k in range(1, self.scenario.cargo_items + 1)
+        ]
+        _check(await self.target.http.post("/vue/cargo", json=cargo))
+
+    async def _telemetry_burst(self, worker: _Worker):
+        from app.services.telemetry import SAMPLE_DTYPE, encode_frame
+
+        n = self.scenario.telemetry_samples
+        frames = []
+        for player_id in worker.players:
+            samples = np.zeros(n, dtype=SAMPLE_DTYPE)
+            samples["t"] = worker.clock + np.arange(n) / 60.0
+            for field in ("px", "pz", "yaw", "vx", "vz"):
+                samples[field] = worker.np_rng.uniform(-50.0, 50.0, n)
+            frames.append(encode_frame(player_id, samples))
+        worker.clock += n / 60.0
+        _check(
+            await self.target.http.post(
+                "/vue/telemetry/batch",
+                content=b"".join(frames),
+                headers={"content-type": "application/octet-stream"},
+            )
+        )
+
+
+async def _open_many(factory: Callable, count: int, concurrency: int = 100) -> List[Any]:
+    gate = asyncio.Semaphore(concurrency)
+
+    async def open_one():
+        async with gate:
+            return await factory()
+
+    return list(await asyncio.gather(*(open_one() for _ in range(count))))
+
+
+async def _await_delivery(listeners: List[Any], expected: int, timeout: float = 10.0) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if all(l.received >= expected for l in listeners):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def run_scenario(
+    scenario: Scenario, target: str = "asgi", url: Optional[str] = None
+) -> Dict[str, Any]:
+    """執行一個情境並回傳可序列化成 JSON 的結果"""
+    if target == "url" and url is None:
+        raise ValueError("url 目標需要指定 url")
+    tgt = make_target(scenario, target, url)
+    workload = Workload(scenario, tgt)
+    workers = [_Worker(i, scenario) for i in range(scenario.clients)]
+    listeners: List[Any] = []
+    started_at = datetime.now(timezone.utc).isoformat()
+
+    await tgt.start()
+    try:
+        listeners = await _open_many(tgt.open_listener, scenario.ws_clients)
+        if "ws_order" in scenario.mix:
+            drivers = await _open_many(tgt.open_driver, len(workers))
+            for worker, driver in zip(workers, drivers):
+                worker.driver = driver
+
+        # 暖機不計入結果
+        await workload.drive(workers, workload.schedule(scenario.warmup, scenario.seed - 1), Recorder())
+
+        recorder = Recorder()
+        schedule = workload.schedule(scenario.requests, scenario.seed)
+        started = time.perf_counter()
+        await workload.drive(workers, schedule, recorder)
+        duration = time.perf_counter() - started
+
+        delivered = await _await_delivery(listeners, workload.orders_created)
+        received = [l.received for l in listeners]
+        response = await tgt.http.get("/health")
+        health = response.json() if response.status_code == 200 else {}
+    finally:
+        for handle in listeners + [w.driver for w in workers if w.driver is not None]:
+            try:
+                await tgt.close_socket(handle)
+            except Exception:
+                pass
+        await tgt.stop()
+
+    ops = recorder.summary(duration)
+    ok = sum(len(s) for s in recorder.samples.values())
+    errors = sum(recorder.errors.values())
+    expected = workload.orders_created
+    return {
+        "scenario": scenario.to_dict(),
+        "target": tgt.name,
+        "started_at": started_at,
+        "duration_s": round(duration, 3),
+        "requests": ok + errors,
+        "errors": errors,
+        "throughput_rps": round(ok / duration, 2) if duration > 0 else 0.0,
+        "ops": ops,
+        "ws": {
+            "listeners": len(listeners),
+            "orders_broadcast": expected,
+            "received_total": sum(received),
+            "received_min": min(received) if received else None,
+            "delivery_ratio": (
+                round(min(1.0, sum(received) / (len(received) * expected)), 4) if received and expected else None
+            ),
+            "drained": delivered,
+        },
+        "server": {key: health.get(key) for key in ("orders", "persistence", "broadcast")},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+    }
@@ -0,0 +1,134 @@
+"""
+壓測情境
+
+每個情境描述：同時發送請求的客戶端數、總請求數、各操作的比例，
+另外掛上多少個只接收廣播的 WebSocket 連線，以及不可超過的絕對門檻。
+"""
+
+from typing import Any, Dict, Optional
+
+# 可混合的操作
+OPERATIONS = (
+    "create_order",     # POST /orders
+    "list_orders",      # GET /vue/orders
+    "ws_order",         # WS custom_message → order_confirmation
+    "cargo_upload",     # POST /vue/cargo（整批取代）
+    "telemetry_burst",  # POST /vue/telemetry/batch（二進位 frame）
+)
+
+
+class Scenario:
+    """壓測參數；mix 為 {操作: 權重}，權重不需加總為 1"""
+
+    def __init__(
+        self,
+        name: str,
+        description: str = "",
+        clients: int = 10,
+        requests: int = 1000,
+        mix: Optional[Dict[str, float]] = None,
+        ws_clients: int = 0,
+        warmup: int = 50,
+        cargo_items: int = 200,
+        telemetry_players: int = 4,
+        telemetry_samples: int = 60,
+        max_p99_ms: Optional[Dict[str, float]] = None,
+        max_error_rate: float = 0.0,
+        env: Optional[Dict[str, str]] = None,
+        seed: int = 1,
+    ):
+        mix = dict(mix or {"create_order": 1.0})
+        unknown = set(mix) - set(OPERATIONS)
+        if unknown:
+            raise ValueError(f"未知的操作: {', '.join(sorted(unknown))}")
+        if not any(w > 0 for w in mix.values()):
+            raise ValueError("mix 至少需要一個權重大於 0 的操作")
+        self.name = name
+        self.description = description
+        self.clients = max(clients, 1)
+        self.requests = max(requests, 1)
+        self.mix = {op: w for op, w in mix.items() if w > 0}
+        self.ws_clients = max(ws_clients, 0)
+        self.warmup = max(warmup, 0)
+        self.cargo_items = max(cargo_items, 1)
+        self.telemetry_players = max(telemetry_players, 1)
+        self.telemetry_samples = max(telemetry_samples, 1)
+        self.max_p99_ms = dict(max_p99_ms or {})
+        self.max_error_rate = max_error_rate
+        # 伺服器端環境變數（asgi / uvicorn 目標才會套用）
+        self.env = dict(env or {})
+        self.seed = seed
+
+    def override(self, **changes: Any) -> "Scenario":
+        """以命令列參數覆寫部分欄位（值為 None 的忽略）"""
+        params = self.to_dict()
+        params.update({k: v for k, v in changes.items() if v is not None})
+        return Scenario(**params)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "clients": self.clients,
+            "requests": self.requests,
+            "mix": dict(self.mix),
+            "ws_clients": self.ws_clients,
+            "warmup": self.warmup,
+            "cargo_items": self.cargo_items,
+            "telemetry_players": self.telemetry_players,
+            "telemetry_samples": self.telemetry_samples,
+            "max_p99_ms": dict(self.max_p99_ms),
+            "max_error_rate": self.max_error_rate,
+            "env": dict(self.env),
+            "seed": self.seed,
+        }
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    s.name: s
+    for s in (
+        Scenario(
+            "smoke",
+            "每種操作各跑一些，確認壓測與各路徑可用",
+            clients=10,
+            requests=500,
+            mix={op: 1.0 for op in OPERATIONS},
+            ws_clients=10,
+            cargo_items=50,
+            max_p99_ms={"create_order": 500, "list_orders": 250, "ws_order": 500},
+        ),
+        Scenario(
+            "orders_10k",
+            "50 個客戶端送出 10,000 筆 POST /orders，另有 10 個連線接收廣播",
+            clients=50,
+            requests=10_000,
+            mix={"create_order": 1.0},
+            ws_clients=10,
+            max_p99_ms={"create_order": 250},
+        ),
+        Scenario(
+            "clients_1k",
+            "1,000 個 WebSocket 連線接收廣播時的新增與查詢延遲",
+            clients=50,
+            requests=3000,
+            mix={"create_order": 0.5, "list_orders": 0.3, "ws_order": 0.2},
+            ws_clients=1000,
+            max_p99_ms={"create_order": 500, "list_orders": 100, "ws_order": 750},
+        ),
+        Scenario(
+            "mixed",
+            "訂單、查詢、WS 下單、貨物上傳與遙測批次同時進行",
+            clients=50,
+            requests=5000,
+            mix={
+                "create_order": 0.35,
+                "list_orders": 0.3,
+                "ws_order": 0.1,
+                "cargo_upload": 0.05,
+                "telemetry_burst": 0.2,
+            },
+            ws_clients=100,
+            max_p99_ms={"create_order": 500, "list_orders": 100, "ws_order": 750, "telemetry_burst": 100},
+        ),
+    )
+}
@@ -0,0 +1,117 @@
+"""
+Load test for the broadcast hub: POST /orders latency with 1,000 WebSocket
+clients, 10 of which never finish a send.
+
+Run with `python -m pytest tests/test_broadcast_load.py -q -s` or directly
+with `python tests/test_broadcast_load.py` to print the latency summary.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 使用暫存資料夾，避免寫入 Backend/data；關閉群組提交時間窗與 fsync，只量測廣播成本
+os.environ["APP_DATA_DIR"] = tempfile.mkdtemp(prefix="broadcast-load-")
+os.environ["ORDER_COMMIT_WINDOW_MS"] = "0"
+os.environ["ORDER_FSYNC_POLICY"] = "os"
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import httpx  # noqa: E402
+
+from app.main import app, committer, hub, registry  # noqa: E402
+
+CLIENTS = 1000
+STALLED = 10
+REQUESTS = 300
+
+
+class FakeSocket:
+    """只實作 hub 需要的介面；stalled=True 時 send_text 永遠不返回"""
+
+    def __init__(self, stalled: bool = False):
+        self.stalled = stalled
+        self.received = 0
+
+    async def send_text(self, text: str):
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def _p99(samples):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+
+async def _post_orders(client: httpx.AsyncClient, count: int):
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        response = await client.post("/orders", json={"items": [i % 100 + 1]})
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200
+    return latencies
+
+
+async def _drain(sockets, expected: int, timeout: float = 10.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if all(s.received >= expected for s in sockets):
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+async def _scenario(client: httpx.AsyncClient, stalled: int):
+    sockets = [FakeSocket(stalled=i < stalled) for i in range(CLIENTS)]
+    for socket in sockets:
+        hub.add(socket)
+        registry.add_connection(str(id(socket)), socket, "load")
+    try:
+        latencies = await _post_orders(client, REQUESTS)
+        delivered = await _drain(sockets[stalled:], REQUESTS)
+        stats = hub.stats()
+    finally:
+        for socket in sockets:
+            hub.remove(socket)
+            registry.remove_connection(str(id(socket)))
+    return {"p99_ms": _p99(latencies), "delivered": delivered, "hub": stats}
+
+
+async def _run():
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await _post_orders(client, 20)  # 暖機
+            healthy = await _scenario(client, stalled=0)
+            degraded = await _scenario(client, stalled=STALLED)
+    finally:
+        await committer.close()
+    return healthy, degraded
+
+
+def test_post_latency_flat_with_stalled_clients():
+    healthy, degraded = asyncio.run(_run())
+    print(
+        f"\nPOST /orders p99 with {CLIENTS} clients: "
+        f"{healthy['p99_ms']:.2f} ms (0 stalled), "
+        f"{degraded['p99_ms']:.2f} ms ({STALLED} stalled)"
+    )
+
+    # 正常連線都收到每一則廣播，卡住的連線只佔用自己的有界佇列
+    assert healthy["delivered"] and degraded["delivered"]
+    assert degraded["hub"]["max_queue_depth"] <= hub.max_queue
+    assert degraded["hub"]["backlogged_clients"] == STALLED
+    # 10 個卡住的連線不應拉高請求延遲
+    assert degraded["p99_ms"] <= healthy["p99_ms"] * 3 + 10
+    assert degraded["p99_ms"] < 250
+
+
+if __name__ == "__main__":
+    test_post_latency_flat_with_stalled_clients()
@@ -0,0 +1,85 @@
+"""
+派工佇列測試：領取順序、心跳延長租約、到期重新派送、過期租約的確認被拒（409）
+
+Run with `python -m pytest tests/test_dispatch_queue.py -q`.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# 使用暫存資料夾，避免寫入 Backend/data
+os.environ["APP_DATA_DIR"] = tempfile.mkdtemp(prefix="dispatch-test-")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.services.dispatch_queue import DispatchQueue, LeaseError  # noqa: E402
+
+NOW = 1000.0
+
+
+def _queue(*orders):
+    """orders：(id, 優先度)；租約 10 秒"""
+    queue = DispatchQueue(lambda order_id: {"id": order_id}, lease_seconds=10)
+    for order_id, priority in orders:
+        queue.add(order_id, priority)
+    return queue
+
+
+def test_claim_by_priority_then_arrival():
+    queue = _queue((1, 0), (2, 5), (3, 0), (4, 5))
+    claimed = queue.claim("a", limit=3, now=NOW)
+    assert [c["order"]["id"] for c in claimed] == [2, 4, 1]
+    assert all(c["expires_at"] == NOW + 10 and c["deliveries"] == 1 for c in claimed)
+    assert [c["order"]["id"] for c in queue.claim("b", limit=5, now=NOW)] == [3]
+    assert queue.claim("b", now=NOW) == []
+
+
+def test_heartbeat_extends_and_terminal_ack_ends_lease():
+    queue = _queue((1, 0))
+    (claim,) = queue.claim("a", now=NOW)
+    assert queue.acknowledge(1, "in_progress", claim["lease"], now=NOW + 8) == NOW + 18
+    # 原本的到期時間已過，但租約已延長：不會重新派送
+    assert queue.claim("b", now=NOW + 15) == []
+    assert queue.next_expiry() == NOW + 18
+    assert queue.acknowledge(1, "completed", claim["lease"], now=NOW + 16) is None
+    assert queue.next_expiry() is None
+    assert queue.claim("b", now=NOW + 30) == []
+    assert queue.stats(now=NOW + 30)["completed"] == 1
+
+
+def test_expired_lease_is_redelivered_and_old_lease_rejected():
+    queue = _queue((1, 0))
+    (first,) = queue.claim("a", now=NOW)
+    assert queue.next_expiry() == NOW + 10
+    (second,) = queue.claim("b", now=NOW + 11)
+    assert second["deliveries"] == 2 and second["lease"] != first["lease"]
+    with pytest.raises(LeaseError):
+        queue.acknowledge(1, "in_progress", first["lease"], now=NOW + 12)
+    assert not queue.release(1, first["lease"])
+    assert queue.release(1, second["lease"])
+    assert queue.claim("c", now=NOW + 12)[0]["deliveries"] == 3
+    assert queue.stats(now=NOW + 12)["expired"] == 1
+
+
+def test_ack_with_stale_lease_returns_409():
+    with TestClient(app) as client:
+        # 同一行程中其他測試也新增了訂單：以最高優先度確保先領到這一筆
+        order_id = client.post("/orders", json={"items": [1], "priority": 1000}).json()["id"]
+        (claimed,) = client.post("/vue/dispatch/claim", json={"agent": "a"}).json()["orders"]
+        assert claimed["id"] == order_id
+        lease = claimed["lease"]
+
+        response = client.post("/vue/ack", json={"order_id": order_id, "status": "in_progress", "lease": lease})
+        assert response.status_code == 200 and response.json()["lease_expires_at"] is not None
+
+        assert client.post(f"/vue/dispatch/{order_id}/release", json={"lease": lease}).json()["released"]
+        response = client.post("/vue/ack", json={"order_id": order_id, "status": "completed", "lease": lease})
+        assert response.status_code == 409
+        response = client.post(f"/vue/dispatch/{order_id}/release", json={"lease": lease})
+        assert response.status_code == 409
@@ -0,0 +1,66 @@
+"""
+遙測降採樣與熱度圖測試：stride / minmax / LTTB 保留首尾且不超過點數上限，minmax 保留極值，熱度圖分箱
+
+Run with `python -m pytest tests/test_downsampling.py -q`.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.telemetry import SAMPLE_DTYPE, downsample, heatmap  # noqa: E402
+
+
+def _samples(n: int) -> np.ndarray:
+    """10 Hz、沿 x 前進的樣本；速度含一個尖峰"""
+    samples = np.zeros(n, dtype=SAMPLE_DTYPE)
+    samples["t"] = 1000.0 + np.arange(n) * 0.1
+    samples["px"] = np.arange(n) * 0.05
+    samples["vx"] = 1.0 + np.sin(np.arange(n) / 25.0)
+    samples["vx"][n // 3] = 40.0
+    return samples
+
+
+@pytest.mark.parametrize("method", ["stride", "minmax", "lttb"])
+@pytest.mark.parametrize("max_points", [2, 3, 10, 101, 500])
+def test_keeps_endpoints_and_point_budget(method, max_points):
+    samples = _samples(2000)
+    result = downsample(samples, max_points, method)
+    assert 2 <= len(result) <= max_points
+    assert result["t"][0] == samples["t"][0] and result["t"][-1] == samples["t"][-1]
+    assert np.all(np.diff(result["t"]) > 0)
+
+
+@pytest.mark.parametrize("method", ["minmax", "lttb"])
+def test_keeps_the_spike(method):
+    samples = _samples(2000)
+    assert 40.0 in downsample(samples, 50, method)["vx"]
+
+
+def test_short_series_and_unknown_method():
+    samples = _samples(20)
+    for method in ("stride", "minmax", "lttb"):
+        assert len(downsample(samples, 20, method)) == 20
+        assert len(downsample(samples, None, method)) == 20
+    with pytest.raises(ValueError):
+        downsample(samples, 5, "median")
+    with pytest.raises(ValueError):
+        downsample(samples, 5, "lttb", field="altitude")
+
+
+def test_heatmap_bins_samples_and_seconds():
+    samples = np.zeros(4, dtype=SAMPLE_DTYPE)
+    samples["t"] = [0.0, 1.0, 3.0, 6.0]
+    samples["px"] = [0.0, 1.2, 1.2, 9.0]  # 最後一筆在網格外
+    samples["pz"] = [0.0, 2.4, 2.4, 0.0]
+    counts = heatmap(samples, origin=(0.0, 0.0), step=(1.2, 1.2), width=3, depth=3)
+    assert counts.shape == (3, 3) and counts.sum() == 3
+    assert counts[0, 0] == 1 and counts[1, 2] == 2
+    seconds = heatmap(samples, (0.0, 0.0), (1.2, 1.2), 3, 3, weight="seconds")
+    assert seconds[0, 0] == 1.0 and seconds[1, 2] == 5.0
+    with pytest.raises(ValueError):
+        heatmap(samples, (0.0, 0.0), (1.2, 1.2), 3, 3, weight="speed")
@@ -0,0 +1,92 @@
+"""
+SSE /vue/events 測試：貨物上傳與清空會以 cargo_updated / cargo_cleared 事件送達
+
+TestClient 會等整個回應結束才返回，無法讀取不會結束的串流，
+因此在 TestClient 的事件迴圈上直接以 ASGI 呼叫 /vue/events，逐段收取 body。
+
+Run with `python -m pytest tests/test_events.py -q`.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 使用暫存資料夾，避免寫入 Backend/data
+os.environ["APP_DATA_DIR"] = tempfile.mkdtemp(prefix="events-test-")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import httpx  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+
+CARGO = [
+    {"id": f"case {i}", "position": {"x": i, "y": 0.5, "z": 0}, "size": {"x": 1, "y": 1, "z": 1},
+     "timestamp": "2025-01-01T00:00:00Z"}
+    for i in (1, 2)
+]
+
+
+class _EventStream:
+    """以 ASGI 開啟 SSE 串流，逐則取出 data 事件"""
+
+    def __init__(self, query: str):
+        self.scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/vue/events", "raw_path": b"/vue/events",
+            "query_string": query.encode(), "headers": [(b"host", b"test")],
+            "client": ("test", 1), "server": ("test", 80), "root_path": "",
+        }
+        self.chunks: "asyncio.Queue[bytes]" = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+        self.buffer = b""
+        self._requested = False
+
+    async def _receive(self):
+        if not self._requested:
+            self._requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message):
+        if message["type"] == "http.response.body":
+            await self.chunks.put(message.get("body", b""))
+
+    def start(self) -> asyncio.Task:
+        return asyncio.create_task(app(self.scope, self._receive, self._send))
+
+    async def next_event(self, timeout: float = 5.0):
+        while b"\n\n" not in self.buffer:
+            self.buffer += await asyncio.wait_for(self.chunks.get(), timeout)
+        event, self.buffer = self.buffer.split(b"\n\n", 1)
+        data = [line[6:] for line in event.split(b"\n") if line.startswith(b"data: ")]
+        return json.loads(data[0]) if data else None
+
+
+async def _cargo_events():
+    stream = _EventStream("topics=cargo")
+    task = stream.start()
+    try:
+        assert await stream.next_event() is None  # retry 與註解行
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            assert (await client.post("/vue/cargo", json=CARGO)).status_code == 200
+            updated = await stream.next_event()
+            assert (await client.delete("/vue/cargo")).status_code == 200
+            cleared = await stream.next_event()
+    finally:
+        stream.disconnected.set()
+        await asyncio.wait_for(task, 5)
+    return updated, cleared
+
+
+def test_cargo_changes_reach_sse_subscribers():
+    with TestClient(app) as client:
+        updated, cleared = client.portal.call(_cargo_events)
+    assert updated["type"] == "cargo_updated"
+    assert updated["ids"] == ["case 1", "case 2"]
+    assert updated["count"] == 2 and updated["total"] == 2
+    assert cleared["type"] == "cargo_cleared" and cleared["total"] == 0
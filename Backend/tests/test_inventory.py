@@ -0,0 +1,111 @@
+"""
+庫存模型測試：驗證、保留、揀貨移除、被壓住的箱子，以及超出 int64 的箱子編號
+
+Run with `python -m pytest tests/test_inventory.py -q`.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 使用暫存資料夾，避免寫入 Backend/data
+os.environ["APP_DATA_DIR"] = tempfile.mkdtemp(prefix="inventory-test-")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.services.inventory import Inventory  # noqa: E402
+from app.services.warehouse_config import WarehouseGrid  # noqa: E402
+
+HUGE = 10**20
+
+
+def _inventory() -> Inventory:
+    # 沒有貨物資料：預設配置，每柱 5 層全滿
+    return Inventory(WarehouseGrid())
+
+
+def test_validate_reports_each_problem():
+    inventory = _inventory()
+    result = inventory.validate([1, 1, 0, 231, HUGE, -HUGE])
+    assert not result["ok"]
+    assert result["invalid"] == [0, 231, HUGE, -HUGE]
+    assert result["duplicates"] == [1]
+    assert result["missing"] == []
+    assert inventory.validate([1, 2, 3])["ok"]
+
+
+def test_reserve_is_all_or_nothing():
+    inventory = _inventory()
+    assert inventory.reserve(7, [1, 2])["ok"]
+    conflict = inventory.reserve(8, [2, 3])
+    assert conflict["reserved"] == {2: 7}
+    # 失敗時一個都不保留
+    assert inventory.validate([3], order_id=9)["ok"]
+    # 自己的保留不算衝突
+    assert inventory.validate([1, 2], order_id=7)["ok"]
+    inventory.release(7)
+    assert inventory.reserve(8, [2, 3])["ok"]
+    assert inventory.stats()["reserved"] == 2
+
+
+def test_consume_removes_boxes_and_reservations():
+    inventory = _inventory()
+    inventory.reserve(5, [4, 5])
+    assert inventory.consume(5, [4, 5, HUGE]) == 2
+    assert inventory.validate([4])["missing"] == [4]
+    assert inventory.stats()["in_stock"] == inventory.max_box_id - 2
+    assert inventory.stats()["reserved"] == 0
+    # 重複完成不再移除
+    assert inventory.consume(5, [4, 5]) == 0
+
+
+def test_buried_skips_boxes_of_the_same_order():
+    inventory = _inventory()
+    # 編號 1..5 為同一柱的第 0..4 層
+    result = inventory.buried([1, 3])
+    by_box = {b["box_id"]: b for b in result["buried"]}
+    assert by_box[1]["above"] == 4
+    assert by_box[1]["blockers"] == [2, 4, 5]
+    assert by_box[3]["blockers"] == [4, 5]
+    assert result["dig_moves"] == 3
+    assert inventory.buried([5])["buried"] == []
+    assert inventory.buried([HUGE])["buried"] == []
+    inventory.consume(0, [4, 5])
+    assert inventory.buried([3]) == {"buried": [], "dig_moves": 0}
+
+
+def test_out_of_range_ids_are_rejected_not_crashing():
+    with TestClient(app) as client:
+        response = client.post("/orders", json={"items": [HUGE]})
+        assert response.status_code == 422
+        assert response.json()["detail"]["invalid"] == [HUGE]
+
+        response = client.post("/vue/inventory/check", json={"items": [1, HUGE]})
+        assert response.status_code == 200
+        assert response.json()["invalid"] == [HUGE]
+
+        response = client.get(f"/vue/inventory/buried?items=1,{HUGE}")
+        assert response.status_code == 200
+
+        response = client.post("/orders/bulk", content=f'{{"items": [{HUGE}]}}\n{{"items": [1]}}\n'.encode())
+        assert response.status_code == 200
+        assert response.json()["created"] == 1
+        assert response.json()["errors"][0]["line"] == 1
+
+        with client.websocket_connect("/ws?client=inventory") as websocket:
+            websocket.send_json({"type": "custom_message", "content": f"1-{HUGE}"})
+            for _ in range(20):
+                message = websocket.receive_json()
+                if message.get("type") == "error":
+                    break
+            assert message["invalid"] == [HUGE]
+            # 連線仍可使用
+            websocket.send_json({"type": "get_orders"})
+            for _ in range(20):
+                if websocket.receive_json().get("type") == "orders_list":
+                    break
+            else:
+                raise AssertionError("沒有收到 orders_list")
@@ -0,0 +1,38 @@
+"""
+訂單生命週期測試：各狀態內的登記順序與更新時間不一致時，stuck / in_states 仍由最舊的開始
+
+Run with `python -m pytest tests/test_order_lifecycle.py -q`.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.order_lifecycle import OrderLifecycle  # noqa: E402
+
+
+def _lifecycle():
+    """依 id 順序登記，但訂單時間戳不依 id 遞增；訂單 4 沒有時間戳（以現在為準）"""
+    now = time.time()
+    lifecycle = OrderLifecycle(stuck_after=60)
+    for order_id, created_at in ((1, now - 100), (2, now - 900), (3, now - 500), (4, None)):
+        lifecycle.track(order_id, created_at)
+    return lifecycle, now
+
+
+def test_stuck_finds_every_overdue_order_oldest_first():
+    lifecycle, _ = _lifecycle()
+    assert [o["order_id"] for o in lifecycle.stuck()] == [2, 3, 1]
+    assert [o["order_id"] for o in lifecycle.stuck(older_than=200)] == [2, 3]
+    assert [o["order_id"] for o in lifecycle.stuck(limit=1)] == [2]
+
+
+def test_replayed_ack_time_keeps_order_across_states():
+    lifecycle, now = _lifecycle()
+    # 確認重播時帶回原本的時間：後轉入 received 的訂單反而更舊
+    lifecycle.transition(1, "received", at=now - 50)
+    lifecycle.transition(3, "received", at=now - 400)
+    assert [o["order_id"] for o in lifecycle.in_states(("created", "received"))] == [2, 3, 1, 4]
+    assert [o["order_id"] for o in lifecycle.in_states(("received",), limit=1)] == [3]
@@ -0,0 +1,77 @@
+"""
+訂單日誌測試：壓縮途中當機後，由快照、`.wal.1` 與 `.wal` 重播出相同的訂單
+
+Run with `python -m pytest tests/test_order_log.py -q`.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.order_log import OrderLog  # noqa: E402
+
+
+def _log() -> OrderLog:
+    return OrderLog(Path(tempfile.mkdtemp(prefix="order-log-test-")) / "app_data.json", fsync_policy="os")
+
+
+def _create(log: OrderLog, order_id: int):
+    log.append_many([{"seq": log.next_seq(), "op": "create", "order": {"id": order_id, "items": [order_id]}}])
+
+
+def _reopen(log: OrderLog) -> OrderLog:
+    """模擬當機：不呼叫 close，另開一個 OrderLog 讀同一組檔案"""
+    log._file.flush()
+    return OrderLog(log.snapshot_path, fsync_policy="os")
+
+
+def test_crash_before_snapshot_replays_rotated_and_new_log():
+    log = _log()
+    for order_id in (1, 2, 3):
+        _create(log, order_id)
+    last_seq = log.begin_compaction()
+    # 快照尚未寫出就當機：舊日誌在 .wal.1，之後的變更在新的 .wal
+    _create(log, 4)
+    log.append_many([{"seq": log.next_seq(), "op": "delete", "order_id": 2}])
+    assert log.rotated_path.exists() and not log.snapshot_path.exists()
+
+    restored = _reopen(log)
+    orders, counter = restored.load()
+    assert [o["id"] for o in orders] == [1, 3, 4]
+    assert counter == 5
+    assert restored.seq == last_seq + 2
+
+
+def test_crash_after_snapshot_skips_entries_already_in_it():
+    log = _log()
+    for order_id in (1, 2, 3):
+        _create(log, order_id)
+    last_seq = log.begin_compaction()
+    _create(log, 4)
+    # 快照已寫入，但刪除 .wal.1 前當機：其中的變更都已包含在快照中，不可重複套用
+    rotated = log.rotated_path.read_bytes()
+    log.write_snapshot([{"id": i, "items": [i]} for i in (1, 2, 3)], 4, last_seq)
+    log.rotated_path.write_bytes(rotated)
+
+    orders, counter = _reopen(log).load()
+    assert [o["id"] for o in orders] == [1, 2, 3, 4]
+    assert counter == 5
+
+
+def test_failed_compaction_is_merged_and_torn_line_ignored():
+    log = _log()
+    _create(log, 1)
+    log.begin_compaction()
+    # 上一次壓縮沒寫出快照：.wal.1 留著，下一次輪替時把新日誌併入
+    log.compacting = False
+    _create(log, 2)
+    log.begin_compaction()
+    _create(log, 3)
+    # 最後一行只寫了一半
+    log._file.write('{"seq": 99, "op": "create", "order": {"id"')
+
+    orders, counter = _reopen(log).load()
+    assert [o["id"] for o in orders] == [1, 2, 3]
+    assert counter == 4
@@ -0,0 +1,45 @@
+"""
+訂單儲存測試：next_after 分辨「最新訂單被刪除」與「訂單已清空」
+
+Run with `python -m pytest tests/test_order_store.py -q`.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.order_store import OrderStore  # noqa: E402
+
+
+def _orders(first: int, last: int):
+    return [{"id": i, "items": [i]} for i in range(first, last + 1)]
+
+
+def test_deleting_newest_order_does_not_restart():
+    store = OrderStore(_orders(1, 10))
+    store.remove(10)
+    store.remove(9)
+    assert store.next_after(10) == (None, 0)
+    assert store.next_after(8) == (None, 0)
+    found, newer = store.next_after(5)
+    assert found["id"] == 6 and newer == 3
+
+
+def test_clear_restarts_numbering():
+    store = OrderStore(_orders(1, 10))
+    store.clear()
+    assert store.next_after(10) == (None, 0)
+    for order in _orders(1, 3):
+        store.add(order)
+    found, newer = store.next_after(10)
+    assert found["id"] == 1 and newer == 3
+
+
+def test_issued_survives_reload():
+    # 重新載入時最新的訂單已被刪除：以已配發的最大 id 為準
+    store = OrderStore(_orders(1, 8), issued=10)
+    assert store.next_after(10) == (None, 0)
+    store.add({"id": 11, "items": [11]})
+    found, newer = store.next_after(10)
+    assert found["id"] == 11 and newer == 1
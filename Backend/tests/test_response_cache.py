@@ -0,0 +1,81 @@
+"""
+回應快取測試：ETag 相符回 304、gzip 版本有自己的 ETag、兩種表示都帶 Vary，版本變更才重建
+
+Run with `python -m pytest tests/test_response_cache.py -q`.
+"""
+
+import gzip
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.services.response_cache import ResponseCache  # noqa: E402
+
+PLAIN = {"Accept-Encoding": "identity"}
+GZIP = {"Accept-Encoding": "gzip"}
+
+
+def _client(gzip_min_bytes: int = 1024):
+    cache = ResponseCache(gzip_min_bytes=gzip_min_bytes)
+    state = {"version": 1, "builds": 0, "size": 400}
+    app = FastAPI()
+
+    def build():
+        state["builds"] += 1
+        return {"version": state["version"], "items": list(range(state["size"]))}
+
+    @app.get("/items")
+    async def items(request: Request):
+        return cache.respond(request, "items", state["version"], build)
+
+    return TestClient(app), cache, state
+
+
+def test_matching_etag_returns_304_for_each_representation():
+    client, cache, state = _client()
+    plain = client.get("/items", headers=PLAIN)
+    zipped = client.get("/items", headers=GZIP)
+    assert plain.status_code == zipped.status_code == 200
+    assert zipped.headers["content-encoding"] == "gzip" and "content-encoding" not in plain.headers
+    assert plain.headers["vary"] == zipped.headers["vary"] == "Accept-Encoding"
+    assert zipped.headers["etag"] == plain.headers["etag"][:-1] + '-gz"'
+    assert zipped.json() == plain.json()
+
+    for headers, etag in ((PLAIN, plain.headers["etag"]), (GZIP, zipped.headers["etag"])):
+        response = client.get("/items", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304 and response.content == b""
+        assert response.headers["etag"] == etag and response.headers["vary"] == "Accept-Encoding"
+    # 另一種表示的 ETag 不能換到 304
+    response = client.get("/items", headers={**GZIP, "If-None-Match": plain.headers["etag"]})
+    assert response.status_code == 200
+    response = client.get("/items", headers={**PLAIN, "If-None-Match": f'W/{zipped.headers["etag"]}'})
+    assert response.status_code == 200
+    assert state["builds"] == 1 and cache.stats()["not_modified"] == 2
+
+
+def test_new_version_rebuilds_and_changes_etag():
+    client, _, state = _client()
+    first = client.get("/items", headers=PLAIN)
+    state["version"] += 1
+    second = client.get("/items", headers={**PLAIN, "If-None-Match": first.headers["etag"]})
+    assert second.status_code == 200 and second.json()["version"] == 2
+    assert second.headers["etag"] != first.headers["etag"]
+    assert state["builds"] == 2
+
+
+def test_small_body_is_not_compressed_but_still_varies():
+    client, cache, state = _client()
+    state["size"] = 3
+    response = client.get("/items", headers=GZIP)
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding" and not response.headers["etag"].endswith('-gz"')
+    assert cache.stats()["gzipped"] == 0
+    # 壓縮一次後重複使用同一份 bytes
+    client, cache, _ = _client(gzip_min_bytes=1)
+    client.get("/items", headers=GZIP)
+    entry = cache.get("items", 1, dict)
+    assert entry.gzipped() is entry.gzipped() and gzip.decompress(entry.gzipped()) == entry.body
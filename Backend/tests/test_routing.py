@@ -0,0 +1,78 @@
+"""
+軌道路徑規劃測試：最短路徑與逐格 BFS 一致、繞過封鎖格位、卸貨延伸段只與自己的格位相連
+
+Run with `python -m pytest tests/test_routing.py -q`.
+"""
+
+import math
+import sys
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.routing import TrackGraph, plan_route  # noqa: E402
+from app.services.warehouse_config import WarehouseGrid  # noqa: E402
+
+# z = 5 這一排只留 x = 4 可通過
+WALL = [(x, 5) for x in range(4)]
+
+
+def _bfs(graph: TrackGraph, start):
+    """以鄰接表逐格 BFS（每步成本 1）作為對照"""
+    steps = {start: 0}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        for neighbor, _ in graph.adj[graph.index[node]]:
+            neighbor = graph.nodes[neighbor]
+            if neighbor not in steps:
+                steps[neighbor] = steps[node] + 1
+                queue.append(neighbor)
+    return steps
+
+
+def _assert_valid_path(graph: TrackGraph, path, a, b):
+    assert path[0] == a and path[-1] == b
+    for (x1, z1), (x2, z2) in zip(path, path[1:]):
+        assert abs(x1 - x2) + abs(z1 - z2) == 1
+        assert (x2, z2) in graph.index
+
+
+def test_shortest_paths_match_bfs():
+    graph = TrackGraph(WarehouseGrid(), blocked=WALL)
+    for a in ((0, 0), (0, 4), (2, 9), (1, -1)):
+        steps = _bfs(graph, a)
+        for b in graph.nodes:
+            path = graph.path(a, b)
+            assert graph.distance(a, b) == steps[b]
+            _assert_valid_path(graph, path, a, b)
+            assert len(path) == steps[b] + 1
+
+
+def test_detours_and_unreachable_cells():
+    open_grid = TrackGraph(WarehouseGrid())
+    assert open_grid.distance((0, 4), (0, 6)) == 2
+    assert open_grid.distance((0, 0), (4, 9)) == 13
+    # 相鄰的卸貨點彼此不相連，需回到網格上
+    assert open_grid.distance((0, -1), (1, -1)) == 3
+
+    walled = TrackGraph(WarehouseGrid(), blocked=WALL)
+    path = walled.path((0, 4), (0, 6))
+    assert walled.distance((0, 4), (0, 6)) == 10 and (4, 5) in path
+
+    closed = TrackGraph(WarehouseGrid(), blocked=WALL + [(4, 5)])
+    assert closed.path((0, 4), (0, 6)) is None
+    assert math.isinf(closed.distance((0, 4), (0, 6)))
+    assert closed.nearest_unload((2, 8)) == (None, math.inf)
+    assert closed.nearest_unload((4, 4)) == ((4, -1), 5)
+
+
+def test_plan_route_unloads_when_full_and_skips_unreachable():
+    graph = TrackGraph(WarehouseGrid(), blocked=WALL + [(4, 5)])
+    plan = plan_route(graph, (2, 2), [(11, (2, 3, 0)), (99, (2, 7, 0)), (12, (2, 4, 1))], capacity=1)
+    assert [leg["action"] for leg in plan["legs"]] == ["pick", "unload", "pick", "unload"]
+    assert plan["unreachable"] == [99]
+    assert plan["total_distance"] == sum(leg["distance"] for leg in plan["legs"])
+    for leg in plan["legs"]:
+        assert len(leg["path"]) == leg["distance"] + 1
@@ -0,0 +1,73 @@
+"""
+共用狀態測試：兩個連線（模擬兩個 worker）同時寫入時，訂單 id 與序號不重複、不跳號
+
+Run with `python -m pytest tests/test_shared_state.py -q`.
+"""
+
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.shared_state import SqliteState  # noqa: E402
+
+WRITERS = 2
+BATCHES = 40
+
+
+def _states():
+    path = Path(tempfile.mkdtemp(prefix="shared-state-test-")) / "state.db"
+    return [SqliteState(path, fsync_policy="os") for _ in range(WRITERS)]
+
+
+def _create(count: int):
+    return [{"op": "create", "order": {"content": "", "items": [1]}} for _ in range(count)]
+
+
+def test_two_connections_allocate_unique_ids_and_seqs():
+    states = _states()
+    written = [[] for _ in states]
+
+    def writer(index: int):
+        for batch_no in range(BATCHES):
+            entries = _create(1 + batch_no % 3)
+            states[index].write_batch(entries)
+            written[index].extend(entries)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    entries = [e for part in written for e in part]
+    ids = sorted(e["order"]["id"] for e in entries)
+    seqs = sorted(e["seq"] for e in entries)
+    assert ids == list(range(1, len(entries) + 1))
+    assert seqs == list(range(1, len(entries) + 1))
+
+    # 兩個連線讀到同一份訂單與變更序列
+    for state in states:
+        orders, last_seq, issued = state.load_orders()
+        assert [o["id"] for o in orders] == ids
+        assert last_seq == len(entries) and issued == len(entries)
+        changes = state.changes_since(0)
+        assert [c["seq"] for c in changes] == seqs
+        assert [c["order"]["id"] for c in changes] == ids
+
+
+def test_clear_restarts_ids_for_every_connection():
+    first, second = _states()
+    first.write_batch(_create(3))
+    second.write_batch([{"op": "clear"}])
+    entries = _create(2)
+    first.write_batch(entries)
+    assert [e["order"]["id"] for e in entries] == [1, 2]
+    assert entries[-1]["seq"] == 6
+    # 刪除不存在的訂單不配發序號
+    missing = {"op": "delete", "order_id": 99}
+    second.write_batch([missing])
+    assert missing["seq"] is None
+    assert second.last_seq() == 6
@@ -0,0 +1,68 @@
+"""
+離散事件模擬測試：單筆訂單的時間可手算、卸貨區一次服務一台車、不補貨時挖箱數遞減、相同種子結果相同
+
+預設配置：車子從卸貨點 (0, -1)、(1, -1) 出發；箱子 1～5 在 (0, 1) 由下往上堆疊。
+
+Run with `python -m pytest tests/test_sim.py -q`.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.sim import SimConfig, Simulation, generate_orders, run_simulation  # noqa: E402
+
+
+def _order(order_id: int, items, arrival: float = 0.0):
+    return {"id": order_id, "items": items, "arrival": arrival}
+
+
+def test_single_pick_timeline():
+    report = run_simulation([_order(1, [1])], SimConfig(cars=1))
+    # 行駛 2 步 + 取貨 2 秒 + 移開上方 4 箱 × 2 秒 + 回卸貨點 2 步 + 卸貨 2 秒
+    assert report["lead_time_seconds"]["max"] == 16.0
+    (car,) = report["cars"]
+    assert car["distance"] == 4 and car["dig_moves"] == 4 and car["trips"] == 1
+    assert car["busy_seconds"] == 16.0 and report["car_utilization"]["mean"] == 1.0
+
+
+def test_bay_serves_one_car_at_a_time():
+    # 兩台車都回 (0, -1)：第二台 15 秒抵達，等第一台卸完（16 秒）才開始
+    report = run_simulation([_order(1, [1]), _order(2, [1])], SimConfig(cars=2))
+    assert [c["bay_wait_seconds"] for c in report["cars"]] == [0.0, 1.0]
+    assert report["sim_seconds"] == 18.0
+    assert report["lead_time_seconds"]["p50"] == 18.0
+
+
+def test_without_restock_picked_boxes_leave_the_column():
+    report = run_simulation([_order(1, [5, 1])], SimConfig(cars=1, capacity=2, restock=False))
+    # 先取最上層的 5，再取 1 時只剩 3 箱壓在上面
+    assert report["cars"][0]["dig_moves"] == 3 and report["cars"][0]["trips"] == 1
+
+
+def test_missing_boxes_and_empty_orders_still_complete():
+    report = run_simulation([_order(1, [1, 99999]), _order(2, [], arrival=5.0)], SimConfig(cars=1))
+    assert report["orders_completed"] == 2
+    assert report["picks"] == 1 and report["short_items"] == 1
+
+
+def test_seeded_runs_are_reproducible_and_complete():
+    box_ids = Simulation().box_ids()
+    orders = generate_orders(300, box_ids, rate_per_hour=600, seed=3)
+
+    def run(policy: str):
+        report = run_simulation(orders, SimConfig(cars=3, policy=policy))
+        # 只有牆鐘時間相關的欄位會變動
+        del report["wall_seconds"], report["speedup"]
+        return report
+
+    fifo, nearest = run("fifo"), run("nearest")
+    assert fifo == run("fifo")
+    assert fifo["orders_completed"] == nearest["orders_completed"] == 300
+    assert fifo["picks"] == nearest["picks"] == sum(len(o["items"]) for o in orders)
+    assert sum(c["distance"] for c in nearest["cars"]) < sum(c["distance"] for c in fifo["cars"])
+    with pytest.raises(ValueError):
+        SimConfig(policy="random")
@@ -0,0 +1,53 @@
+"""
+儲位最佳化測試：需求統計忽略範圍外（含超出 int64）的編號、預估節省不為負、遵守 max_moves
+
+Run with `python -m pytest tests/test_slotting.py -q`.
+"""
+
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.inventory import Inventory  # noqa: E402
+from app.services.slotting import count_demand, plan_slotting  # noqa: E402
+from app.services.warehouse_config import WarehouseGrid  # noqa: E402
+
+HUGE = 10**20
+
+
+def _orders(max_box_id: int, count: int = 300):
+    # 少數箱子特別常被揀，且常一起出現
+    rng = random.Random(7)
+    hot = rng.sample(range(1, max_box_id + 1), 12)
+    orders = []
+    for i in range(count):
+        items = [rng.randint(1, max_box_id)]
+        if i % 3:
+            items += rng.sample(hot, 2)
+        orders.append({"items": items})
+    return orders
+
+
+def test_count_demand_ignores_out_of_range_ids():
+    demand = count_demand([{"items": [1, HUGE, -HUGE, 0, 3, 3]}, {"items": [3, 231]}, {}], max_box_id=230)
+    assert demand.freq.sum() == 3 and demand.freq[1] == 1 and demand.freq[3] == 2
+    assert demand.touched.tolist() == [1, 3]
+    assert demand.co.tolist() == [[0, 1], [1, 0]]
+
+
+def test_plan_never_costs_more_and_respects_max_moves():
+    inventory = Inventory(WarehouseGrid())
+    boxes, cells = inventory.occupied()
+    orders = _orders(inventory.max_box_id)
+
+    for max_moves in (None, 0, 1, 6):
+        result = plan_slotting(orders, boxes, cells, inventory.max_box_id, max_moves=max_moves)
+        saving = result["summary"]["projected"]["saving"]
+        assert saving["seconds"] >= 0
+        if max_moves is not None:
+            assert result["summary"]["moves"] <= max_moves
+        moved = [box_id for box_id, _, changed in result["layout"] if changed]
+        assert len(moved) == result["summary"]["moves"]
+        assert sorted(b for b, _, _ in result["layout"]) == sorted(boxes.tolist())
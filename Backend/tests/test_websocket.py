@@ -1,37 +1,83 @@
 """
-Test script for the WebSocket bridge
+WebSocket /ws 協議測試：下單確認、訂單快照、主題訂閱、依車輛篩選的路由與錯誤回覆
+
+Run with `python -m pytest tests/test_websocket.py -q`.
 """
 
-import asyncio
-import json
-import websockets
-from datetime import datetime
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# 使用暫存資料夾，避免寫入 Backend/data
+os.environ["APP_DATA_DIR"] = tempfile.mkdtemp(prefix="websocket-test-")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.services.websocket_service import WebSocketService  # noqa: E402
+
+
+def _receive_type(websocket, expected: str, limit: int = 20):
+    """略過廣播，取得第一則指定類型的訊息"""
+    for _ in range(limit):
+        message = websocket.receive_json()
+        if message.get("type") == expected:
+            return message
+    raise AssertionError(f"沒有收到 {expected}")
+
+
+def test_ws_protocol():
+    with TestClient(app) as client, client.websocket_connect("/ws?client=test") as websocket:
+        websocket.send_json({"type": "custom_message", "content": "75-12-43"})
+        confirmation = _receive_type(websocket, "order_confirmation")
+        created = _receive_type(websocket, "new_order")
+        assert created["order"]["id"] == confirmation["order_id"]
+        assert created["order"]["items"] == [75, 12, 43]
+
+        websocket.send_json({"type": "get_orders"})
+        snapshot = _receive_type(websocket, "orders_list")
+        assert any(o["id"] == confirmation["order_id"] for o in snapshot["orders"])
+
+        websocket.send_json({"type": "subscribe", "topics": ["status"], "replace": True})
+        assert list(_receive_type(websocket, "subscriptions")["topics"]) == ["status"]
+
+        websocket.send_text("not json")
+        assert _receive_type(websocket, "error")["message"] == "Invalid JSON"
 
-async def test_websocket_connection():
-    """Test WebSocket connection to the server"""
-    uri = "ws://localhost:8000/ws/test/client1"
 
-    try:
-        async with websockets.connect(uri) as websocket:
-            print("Connected to WebSocket server")
+def test_routing_filters_and_rejects_unproduced_filters():
+    registry = WebSocketService()
+    for client_id in ("all", "car1", "orders"):
+        registry.add_connection(client_id, client_id, "test")
+    registry.subscribe("car1", ["fleet"], cars="1", replace=True)
+    registry.subscribe("orders", ["orders"], replace=True)
 
-            # Send a test message
-            test_message = {
-                "type": "test",
-                "data": {"message": "Hello from test client"},
-                "timestamp": datetime.utcnow().isoformat()
-            }
+    chunk = {"type": "fleet_waypoints", "cars": [{"car": 1, "waypoints": []}, {"car": 2, "waypoints": []}]}
+    routed = {tuple(sockets): message for message, sockets in registry.route(chunk)}
+    assert routed[("all",)] is chunk
+    assert [c["car"] for c in routed[("car1",)]["cars"]] == [1]
+    # 只訂閱 orders 的連線收不到車隊路徑；只含其他車輛的段落也不送給 car1
+    assert ("orders",) not in routed
+    assert [s for _, s in registry.route({"type": "fleet_waypoints", "cars": [{"car": 2}]})] == [["all"]]
 
-            await websocket.send(json.dumps(test_message))
-            print(f"Sent: {test_message}")
+    # 沒有任何廣播會產生的主題與篩選直接拒絕，而不是接受後永遠收不到
+    with pytest.raises(ValueError):
+        registry.subscribe("all", ["telemetry"])
+    with pytest.raises(ValueError):
+        registry.subscribe("all", ["orders"], zones="0")
 
-            # Wait for response
-            response = await websocket.recv()
-            print(f"Received: {response}")
+    with TestClient(app) as client:
+        assert client.get("/vue/events?topics=orders&zones=0").status_code == 400
+        with client.websocket_connect("/ws?client=zones") as websocket:
+            websocket.send_json({"type": "subscribe", "topics": ["telemetry"]})
+            assert "Unknown topics" in _receive_type(websocket, "error")["message"]
 
-    except Exception as e:
-        print(f"Connection failed: {e}")
 
 if __name__ == "__main__":
-    print("Testing WebSocket connection...")
-    asyncio.run(test_websocket_connection())
+    test_ws_protocol()
+    test_routing_filters_and_rejects_unproduced_filters()
+    print("ok")
@@ -8,6 +8,9 @@ export function useWebSocket() {
   const isClearing = ref(false)
 
   let websocket = null
+  // 最後套用的變更序號與伺服器 epoch，重連時只補送遺漏的變更
+  let lastSeq = null
+  let epoch = null
 
   const sendMessage = (message) => {
     if (websocket && websocket.readyState === WebSocket.OPEN) {
@@ -22,32 +25,117 @@ export function useWebSocket() {
     })
   }
 
+  const requestSync = () => {
+    sendMessage({
+      type: 'sync',
+      since: lastSeq,
+      epoch,
+      timestamp: new Date().toISOString()
+    })
+  }
+
+  // 訂單介面只需要訂單與狀態，不接收車隊路徑等其他主題
+  const subscribe = (topics = ['orders', 'status']) => {
+    sendMessage({
+      type: 'subscribe',
+      topics,
+      replace: true,
+      timestamp: new Date().toISOString()
+    })
+  }
+
+  const toView = (order) => ({
+    id: order.id,
+    content: order.content,
+    time: new Date(order.timestamp).toLocaleTimeString()
+  })
+
+  const prependOrders = (list) => {
+    orders.value = [...list.map(toView).reverse(), ...orders.value]
+    if (list.length > 0) {
+      orderCounter.value = Math.max(orderCounter.value, ...list.map(o => o.id + 1))
+    }
+  }
+
+  const applyChange = (change) => {
+    switch (change.op) {
+      case 'create':
+        prependOrders([change.order])
+        break
+      case 'create_many':
+        prependOrders(change.orders)
+        break
+      case 'delete':
+        orders.value = orders.value.filter(order => order.id !== change.order_id)
+        break
+      case 'clear':
+        orders.value = []
+        orderCounter.value = 1
+        break
+      default:
+        break
+    }
+  }
+
+  // 帶序號的廣播：已套用過的略過，發現跳號時向伺服器補齊
+  const acceptSeq = (message) => {
+    if (message.seq == null || lastSeq === null) {
+      return true
+    }
+    if (message.seq <= lastSeq) {
+      return false
+    }
+    if (message.seq > lastSeq + 1) {
+      requestSync()
+      return false
+    }
+    lastSeq = message.seq
+    return true
+  }
+
   const handleMessage = (message) => {
     switch (message.type) {
       case 'order_confirmation':
         break
       case 'new_order':
-        orders.value.unshift({
-          id: message.order.id,
-          content: message.order.content,
-          time: new Date(message.order.timestamp).toLocaleTimeString()
-        })
+        if (acceptSeq(message)) {
+          prependOrders([message.order])
+        }
         break
       case 'orders_list':
-        orders.value = message.orders.map(order => ({
-          id: order.id,
-          content: order.content,
-          time: new Date(order.timestamp).toLocaleTimeString()
-        }))
+        orders.value = message.orders.map(toView)
         orderCounter.value = message.orders.length > 0
           ? Math.max(...message.orders.map(o => o.id)) + 1
           : 1
+        lastSeq = message.seq ?? null
+        epoch = message.epoch ?? null
         isClearing.value = false
         break
+      case 'orders_delta':
+        message.changes
+          .filter(change => lastSeq === null || change.seq > lastSeq)
+          .forEach(applyChange)
+        lastSeq = message.seq
+        epoch = message.epoch
+        break
+      case 'orders_cleared':
+        if (acceptSeq(message)) {
+          orders.value = []
+          orderCounter.value = 1
+        }
+        break
       case 'status_update':
         break
+      case 'orders_bulk_created':
+        // 批次匯入只送摘要，以增量同步取得新訂單（過多時伺服器改回快照）
+        if (lastSeq === null || message.seq > lastSeq) {
+          requestSync()
+        }
+        break
       case 'order_deleted':
-        orders.value = orders.value.filter(order => order.id !== message.order_id)
+        if (acceptSeq(message)) {
+          orders.value = orders.value.filter(order => order.id !== message.order_id)
+        }
         break
       case 'error':
         errorMessage.value = message.message
@@ -71,9 +159,10 @@ export function useWebSocket() {
       websocket.onopen = () => {
         isConnected.value = true
         errorMessage.value = ''
+        subscribe()
 
-        if (!isClearing.value) {
-          requestOrders()
+        if (lastSeq !== null && !isClearing.value) {
+          requestSync()
         } else {
           requestOrders()
         }
@@ -182,6 +271,7 @@ export function useWebSocket() {
     toggleConnection,
     sendOrder,
     requestOrders,
+    subscribe,
     requestClearOrders,
     requestDeleteOrder,
     addLocalOrder,
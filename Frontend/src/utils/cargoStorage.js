@@ -60,14 +60,23 @@ export async function saveCargoDataToBackend(cargoData, options = {}) {
         chunks.push(cargoData.slice(i, i + chunkSize));
       }
 
+      // 開啟上傳 session，所有批次暫存於後端，最後一次 commit 寫檔
+      const { session_id: sessionId } = await postJson(`${apiBaseUrl}/vue/cargo/ingest?mode=replace`);
+
       const results = [];
-      for (let i = 0; i < chunks.length; i++) {
-        console.log(`發送第 ${i + 1}/${chunks.length} 批數據...`);
-        const result = await sendCargoChunk(chunks[i], apiBaseUrl);
-        results.push(result);
+      try {
+        for (let i = 0; i < chunks.length; i++) {
+          console.log(`發送第 ${i + 1}/${chunks.length} 批數據...`);
+          const result = await postJson(`${apiBaseUrl}/vue/cargo/ingest/${sessionId}`, chunks[i]);
+          results.push(result);
+        }
+      } catch (error) {
+        await fetch(`${apiBaseUrl}/vue/cargo/ingest/${sessionId}`, { method: 'DELETE' }).catch(() => {});
+        throw error;
       }
 
-      const totalSaved = results.reduce((sum, result) => sum + (result.saved_count || 0), 0);
+      const commitResult = await postJson(`${apiBaseUrl}/vue/cargo/ingest/${sessionId}/commit`);
+      const totalSaved = commitResult.saved_count || 0;
 
       console.log(`✓ 所有貨物數據已成功儲存！總計: ${totalSaved} 個`);
 
@@ -100,16 +109,16 @@ export async function saveCargoDataToBackend(cargoData, options = {}) {
 }
 
 /**
- * 發送單批貨物數據
+ * 發送 JSON POST 請求
  * @private
  */
-async function sendCargoChunk(cargoChunk, apiBaseUrl) {
-  const response = await fetch(`${apiBaseUrl}/vue/cargo`, {
+async function postJson(url, body) {
+  const response = await fetch(url, {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
     },
-    body: JSON.stringify(cargoChunk),
+    body: body === undefined ? undefined : JSON.stringify(body),
   });
 
   if (!response.ok) {
@@ -119,6 +128,14 @@ async function sendCargoChunk(cargoChunk, apiBaseUrl) {
   return await response.json();
 }
 
+/**
+ * 發送單批貨物數據
+ * @private
+ */
+async function sendCargoChunk(cargoChunk, apiBaseUrl) {
+  return postJson(`${apiBaseUrl}/vue/cargo`, cargoChunk);
+}
+
 /**
  * 清空後端的貨物數據
  * @param {Object} options - 選項配置